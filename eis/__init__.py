@@ -1,6 +1,8 @@
 import logging
-import logging.config
-import yaml
+import os
+import sys
+import types
+from functools import lru_cache
 from pathlib import Path
 
 
@@ -11,14 +13,75 @@ project_dir = Path(__file__).resolve().parents[1]
 info_out = str(project_dir / 'info.log')
 error_out = str(project_dir / 'errors.log')
 
-# Read log config file
-with open(project_dir / 'logging.yaml', 'rt') as f:
-    logging_config = yaml.safe_load(f.read())
-logging.config.dictConfig(logging_config)
-
 # Define module logger
 logger = logging.getLogger(__name__)
 
-# Model config
-with open(project_dir / 'model_config.yaml', 'rt') as f:
-    config = yaml.safe_load(f.read())
+# Handlers in logging.yaml which write to info_out and error_out
+FILE_HANDLERS = ('info_file_handler', 'error_file_handler')
+
+
+def setup_logging(file_handlers=None):
+    """Configure logging from logging.yaml. This is not done on import, so scripts
+    (rather than library code) should call it once before logging anything.
+
+    Args:
+        file_handlers (bool): Whether to log to info_out and error_out as well as the
+                              console. Defaults to True unless the EIS_LOG_FILES environment
+                              variable is '0', i.e. so that worker processes can opt out.
+    """
+    import logging.config
+    import yaml
+    if file_handlers is None:
+        file_handlers = os.environ.get('EIS_LOG_FILES', '1') != '0'
+    with open(project_dir / 'logging.yaml', 'rt') as f:
+        logging_config = yaml.safe_load(f.read())
+    if not file_handlers:
+        for name in FILE_HANDLERS:
+            del logging_config['handlers'][name]
+        for logger_config in logging_config.get('loggers', {}).values():
+            logger_config['handlers'] = [h for h in logger_config.get('handlers', [])
+                                         if h not in FILE_HANDLERS]
+    logging.config.dictConfig(logging_config)
+
+
+def process_pool(n_processes=None):
+    """Pool of worker processes which start from a fresh interpreter (spawn) rather than
+    a fork of this one, so that it can be made while threads are running. A forked
+    worker would inherit any lock held by another thread (i.e. of a cache or throttle)
+    in its held state, and wait on it forever.
+
+    On Python 3.6, where the start method can't be chosen per pool, the workers are
+    forked as soon as the pool is made instead, so the pool must be made before
+    starting any threads.
+
+    Args:
+        n_processes (int): Number of worker processes (defaults to the number of CPUs).
+    Returns:
+        pool (ProcessPoolExecutor)
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    try:
+        return ProcessPoolExecutor(n_processes, mp_context=multiprocessing.get_context('spawn'))
+    except TypeError:
+        pool = ProcessPoolExecutor(n_processes)
+        pool.submit(int).result()  # Every worker is started on the first submit
+        return pool
+
+
+@lru_cache(maxsize=None)
+def load_config():
+    """Model config from model_config.yaml, read on first use."""
+    import yaml
+    with open(project_dir / 'model_config.yaml', 'rt') as f:
+        return yaml.safe_load(f.read())
+
+
+class _Package(types.ModuleType):
+    """Module type for eis, so that the model config is only read when first accessed"""
+    @property
+    def config(self):
+        return load_config()
+
+
+sys.modules[__name__].__class__ = _Package
@@ -0,0 +1,408 @@
+"""Benchmarks of the hot paths of the crawl, the eurostat transforms and the analysis,
+on synthetic data sized like production (about 170k courses over 220 disciplines,
+and eurostat tables with thousands of rows and decades of year columns).
+
+Each benchmark reports its best time over some repeats and its peak memory (as
+traced by tracemalloc, in a separate run). Results are saved as json, and can be
+compared with a stored baseline to flag regressions:
+
+    python -m eis.benchmark --save-baseline     # e.g. before a change
+    python -m eis.benchmark                     # after it: exits with 1 on a regression
+
+Use --scale to shrink the data (e.g. --scale 0.1 for a quick check), and --only to
+run some of the benchmarks.
+"""
+from collections import defaultdict
+from unittest import mock
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import eis
+
+BENCHMARK_PATH = f'{eis.project_dir}/reports/benchmarks'
+BASELINE_PATH = f'{BENCHMARK_PATH}/baseline.json'
+RESULTS_PATH = f'{BENCHMARK_PATH}/latest.json'
+TOLERANCE = 0.25  # Slow down (or extra memory) as a fraction of the baseline, beyond which is a regression
+MIN_SECONDS = 0.01  # Changes in time are only regressions above this (i.e. not timer noise)
+LEVELS = ('bachelor', 'master', 'phd', 'preparation', 'short')
+DIMENSIONS = {'unit': 6, 'sex': 3, 'age': 12, 'isced11': 9}  # Dimension --> number of values
+
+logger = logging.getLogger(__name__)
+
+
+# Synthetic data
+
+def make_disciplines(n_disciplines=220, n_parents=20):
+    """Disciplines as from download_courses.discover_disciplines, with parents first."""
+    parents = [{'discipline_id': i, 'discipline_title': f'Parent {i}', 'parent': None}
+               for i in range(n_parents)]
+    children = [{'discipline_id': i, 'discipline_title': f'Discipline {i}', 'parent': i % n_parents}
+                for i in range(n_parents, n_parents + n_disciplines)]
+    return parents + children
+
+
+def make_level_counts(disciplines, n_courses=170000, seed=0):
+    """Look-up of (discipline id, level) --> number of courses, adding up to about n_courses."""
+    rng = np.random.RandomState(seed)
+    children = [d['discipline_id'] for d in disciplines if d['parent'] is not None]
+    weights = rng.dirichlet(np.ones(len(children)*len(LEVELS)))
+    counts = np.round(weights*n_courses).astype(int)
+    return {(di, lvl): int(counts[i*len(LEVELS) + j])
+            for i, di in enumerate(children) for j, lvl in enumerate(LEVELS)}
+
+
+def make_course(course_id, di, lvl):
+    """A course as returned by studyportal's search."""
+    return {'id': course_id, 'title': f'Course {course_id} in discipline {di}',
+            'level': lvl, 'organisation': f'University {course_id % 3000}',
+            'venues': [{'city': f'City {course_id % 800}', 'country': f'Country {course_id % 40}'}],
+            'tuition_fee': {'amount': course_id % 20000, 'unit': 'year', 'currency': 'EUR'},
+            'summary': 'A course ' * 20, 'listing_type': 'basic', 'enhanced': False, 'logo': None}
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    """Stands in for a studyportal session, serving synthetic facets and search pages
+    (without any network, so that only the crawl's own work is measured).
+
+    Args:
+        level_counts (dict): Look-up of (discipline id, level) --> number of courses.
+    """
+    def __init__(self, level_counts):
+        from eis.data.download_courses import PAGE_SIZE
+        self.page_size = PAGE_SIZE
+        self.levels = defaultdict(dict)
+        self.offsets = {}
+        offset = 0
+        for (di, lvl), count in level_counts.items():
+            self.levels[di][lvl] = count
+            self.offsets[(di, lvl)] = offset
+            offset += count
+
+    def get(self, url, params=None):
+        query = dict(part.split('-', 1) for part in params['q'].split('|'))
+        di = int(query['di'])
+        if 'facets' in params:
+            return FakeResponse({'lv': self.levels[di]})
+        lvl, start = query['lv'], params['start']
+        end = min(start + self.page_size, self.levels[di][lvl])
+        offset = self.offsets[(di, lvl)]
+        return FakeResponse([make_course(offset + i, di, lvl) for i in range(start, end)])
+
+
+def make_wide_table(n_rows=5000, n_years=30, first_year=1990, n_countries=40, seed=0):
+    """A wide eurostat table as from eurostat.get_data_df, with years as columns.
+
+    Args:
+        n_rows (int): Number of rows (combinations of dimensions and country).
+        n_years (int): Number of year columns.
+        first_year (int): First year.
+        n_countries (int): Number of countries (including EU28 and EA19).
+        seed (int): Seed for the values.
+    Returns:
+        table (DataFrame)
+    """
+    import pandas as pd
+    rng = np.random.RandomState(seed)
+    countries = ['EU28', 'EA19'] + [f'C{i:02d}' for i in range(n_countries - 2)]
+    table = {dim: [f'{dim.upper()}{i}' for i in rng.randint(n, size=n_rows)]
+             for dim, n in DIMENSIONS.items()}
+    table['geo\\time'] = [countries[i % n_countries] for i in range(n_rows)]
+    values = rng.lognormal(3, 1, size=(n_rows, n_years)).round(1)
+    values[rng.random_sample(values.shape) < 0.2] = np.nan
+    for j in range(n_years):
+        table[first_year + j] = values[:, j]
+    return pd.DataFrame(table)
+
+
+def make_dictionaries():
+    """Eurostat dictionaries for the dimensions of make_wide_table (and some unused codes)."""
+    return {dim: {f'{dim.upper()}{i}': f'{dim} value {i}' for i in range(5*n)}
+            for dim, n in DIMENSIONS.items()}
+
+
+def make_toc(codes):
+    """A eurostat table of contents for these codes."""
+    import pandas as pd
+    return pd.DataFrame({'title': [f'Table {code}' for code in codes], 'code': list(codes),
+                         'type': 'dataset', 'last update of data': '01.01.2020',
+                         'last table structure change': '01.01.2019',
+                         'data start': '1990', 'data end': '2019', 'values': 1000})
+
+
+def make_indicator_tables(n_indicators=30, n_rows=5000, n_years=30, seed=0):
+    """Melted tables and filters for n_indicators indicators.
+
+    Returns:
+        tables, filters (dict, dict): Look-up of code --> melted table, and of code --> filters.
+    """
+    from eis.data.make_eurostat import melt_table
+    tables, filters = {}, {}
+    for k in range(n_indicators):
+        code = f'ind_{k}'
+        tables[code] = melt_table(make_wide_table(n_rows, n_years, seed=seed + k), code)[0]
+        filters[code] = {'unit': ['UNIT0', 'UNIT1'], 'sex': ['SEX0']}
+    return tables, filters
+
+
+# Benchmarks: each function takes the scale and returns (run, cleanup), where run does
+# the work to be measured (on data made in advance) and cleanup is called after the runs
+
+def _scaled(n, scale, minimum=1):
+    return max(minimum, int(round(n*scale)))
+
+
+def bench_discover_course_pages(scale):
+    from eis.data.download_courses import discover_buckets, discover_course_pages
+    disciplines = make_disciplines(_scaled(220, scale))
+    session = FakeSession(make_level_counts(disciplines, _scaled(170000, scale)))
+
+    def run():
+        # As download_courses, which finds the buckets first and then crawls their pages
+        buckets = discover_buckets(session, disciplines)
+        for _ in discover_course_pages(session, disciplines, buckets=buckets):
+            pass
+    return run, None
+
+
+def bench_write_shards(scale):
+    from eis.data.course_shards import JsonShardWriter
+    disciplines = make_disciplines(_scaled(220, scale))
+    level_counts = make_level_counts(disciplines, _scaled(170000, scale))
+    courses, i = {}, 0
+    for (di, lvl), count in level_counts.items():
+        courses[(di, lvl)] = [make_course(i + j, di, lvl) for j in range(count)]
+        i += count
+    path = tempfile.mkdtemp()
+
+    def run():
+        # As download_courses with its default shard writer and flush_count, writing to a temporary directory
+        writer = JsonShardWriter(path)
+        for (di, lvl), batch in courses.items():
+            for start in range(0, len(batch), 1000):
+                writer.write(batch[start:start + 1000], di, lvl, start + 1000)
+            writer.finish(di, lvl)
+        writer.close()
+    return run, lambda: shutil.rmtree(path, ignore_errors=True)
+
+
+def bench_course_index(scale):
+    from array import array
+    from eis.data.course_index import CourseDisciplineIndex
+    from eis.data.download_courses import write_json
+    rng = np.random.RandomState(0)
+    disciplines = make_disciplines(_scaled(220, scale))
+    children = np.array([d['discipline_id'] for d in disciplines if d['parent'] is not None])
+    n_courses = _scaled(170000, scale)
+    # Courses have 1.79 disciplines on average
+    courses = np.concatenate([np.arange(n_courses), rng.randint(n_courses, size=int(0.79*n_courses))])
+    # As collected during the crawl, i.e. a (course, discipline) pair for each course in each shard
+    course_ids, discipline_ids = array('q', courses.tolist()), array('q', rng.choice(children, len(courses)).tolist())
+    path = tempfile.mkdtemp()
+
+    def run():
+        # As download_courses, once the crawl is over
+        index = CourseDisciplineIndex(course_ids, discipline_ids)
+        index.save(f'{path}/course_discipline_index.npz')
+        course_discipline_lookup, discipline_course_lookup = index.to_lookups()
+        write_json(course_discipline_lookup, f'{path}/course_discipline_lookup.json')
+        write_json(discipline_course_lookup, f'{path}/discipline_course_lookup.json')
+    return run, lambda: shutil.rmtree(path, ignore_errors=True)
+
+
+def bench_melt_table(scale):
+    from eis.data.make_eurostat import melt_table
+    table = make_wide_table(_scaled(5000, scale, 40))
+
+    def run():
+        melt_table(table, 'ind_0')
+    return run, None
+
+
+def bench_make_schema(scale):
+    from eis.data import make_eurostat
+    from eis.data.dic_store import DicStore
+    table_long, struct_name, melt_var_name = make_eurostat.melt_table(
+        make_wide_table(_scaled(5000, scale, 40)), 'ind_0')
+    toc_df = make_toc([f'ind_{k}' for k in range(_scaled(5000, scale))] + ['ind_0'])
+    toc_index = make_eurostat.index_toc(toc_df)
+    dic_store = DicStore(make_dictionaries().get)
+
+    def run():
+        with mock.patch.object(make_eurostat, 'dic_store', dic_store):
+            make_eurostat.make_schema(table_long, 'ind_0', toc_df, struct_name, melt_var_name, toc_index)
+    return run, None
+
+
+def bench_indicator_matrices(scale):
+    from eis.transformers.indicators import indicator_matrices
+    tables, filters = make_indicator_tables(_scaled(30, scale), _scaled(5000, scale, 40))
+
+    def run():
+        indicator_matrices(tables, filters, list(tables))
+    return run, None
+
+
+def bench_indicator_correlations(scale):
+    from eis.estimators.correlation import bootstrap_correlations, indicator_correlations
+    from eis.transformers.indicators import indicator_matrices
+    tables, filters = make_indicator_tables(_scaled(30, scale, 2), _scaled(5000, scale, 40))
+    matrices = indicator_matrices(tables, filters, list(tables))
+
+    def run():
+        indicator_correlations(matrices, method='spearman')
+        bootstrap_correlations(matrices, method='pearson', n_boot=_scaled(100, scale, 2), seed=0)
+    return run, None
+
+
+# Look-up of benchmark name --> function, grouped as crawl, transform and analysis
+BENCHMARKS = {'crawl.discover_course_pages': bench_discover_course_pages,
+              'crawl.write_shards': bench_write_shards,
+              'crawl.course_index': bench_course_index,
+              'transform.melt_table': bench_melt_table,
+              'transform.make_schema': bench_make_schema,
+              'analysis.indicator_matrices': bench_indicator_matrices,
+              'analysis.indicator_correlations': bench_indicator_correlations}
+
+
+def measure(run, repeat=3):
+    """Time and peak memory of a function.
+
+    Args:
+        run (function): Function of no arguments.
+        repeat (int): Number of timed runs, of which the fastest is taken.
+    Returns:
+        seconds, peak_mb (float, float): Best time, and peak traced memory (MB) of an untimed run.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    # Tracing slows everything down, so memory is measured in a separate run
+    tracemalloc.start()
+    try:
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak/2**20
+
+
+def run_benchmarks(names=None, scale=1.0, repeat=3):
+    """Run benchmarks.
+
+    Args:
+        names (list of str): Names of the benchmarks (see BENCHMARKS). Defaults to all.
+        scale (float): Size of the synthetic data relative to production.
+        repeat (int): Number of timed runs of each benchmark.
+    Returns:
+        results (dict): The settings and machine, and under 'benchmarks' a look-up of
+                        name --> {'seconds': ..., 'peak_mb': ...}.
+    """
+    if names is None:
+        names = list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f'Unknown benchmarks: {sorted(unknown)}')
+    results = {'scale': scale, 'repeat': repeat, 'python': platform.python_version(),
+               'machine': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'benchmarks': {}}
+    for name in names:
+        run, cleanup = BENCHMARKS[name](scale)
+        try:
+            seconds, peak_mb = measure(run, repeat)
+        finally:
+            if cleanup is not None:
+                cleanup()
+        results['benchmarks'][name] = {'seconds': round(seconds, 4), 'peak_mb': round(peak_mb, 2)}
+        logger.info(f'{name}: {seconds:.3f}s, {peak_mb:.1f}MB')
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE, min_seconds=MIN_SECONDS):
+    """Compare benchmark results with a baseline.
+
+    Args:
+        results (dict): From run_benchmarks.
+        baseline (dict): From run_benchmarks, at the same scale.
+        tolerance (float): Allowed increase in time or memory, as a fraction of the baseline.
+        min_seconds (float): Increases in time smaller than this are never regressions.
+    Returns:
+        regressions (list of str): Descriptions of each regression.
+    """
+    if results['scale'] != baseline['scale']:
+        raise ValueError(f"Results at scale {results['scale']} can't be compared "
+                         f"with a baseline at scale {baseline['scale']}")
+    regressions = []
+    for name, result in results['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        base = baseline['benchmarks'][name]
+        if (result['seconds'] > base['seconds']*(1 + tolerance)
+                and result['seconds'] - base['seconds'] > min_seconds):
+            regressions.append(f"{name}: {result['seconds']:.3f}s, was {base['seconds']:.3f}s")
+        if result['peak_mb'] > base['peak_mb']*(1 + tolerance):
+            regressions.append(f"{name}: {result['peak_mb']:.1f}MB, was {base['peak_mb']:.1f}MB")
+    return regressions
+
+
+def write_results(results, path):
+    """Write benchmark results (or a baseline) to json."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def read_results(path):
+    """Read benchmark results (or a baseline) from json."""
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the crawl, transform and analysis hot paths')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='benchmarks to run (default all)')
+    parser.add_argument('--scale', type=float, default=1.0, help='size of the data relative to production')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each benchmark')
+    parser.add_argument('--output', default=RESULTS_PATH, help='json file for the results')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='json file of the baseline')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='allowed slow down (or extra memory) as a fraction of the baseline')
+    args = parser.parse_args(argv)
+    eis.setup_logging()
+
+    results = run_benchmarks(args.only, args.scale, args.repeat)
+    write_results(results, args.baseline if args.save_baseline else args.output)
+    for name, result in results['benchmarks'].items():
+        print(f"{name:<36}{result['seconds']:>10.3f}s{result['peak_mb']:>10.1f}MB")
+    if args.save_baseline or not os.path.exists(args.baseline):
+        return 0
+    regressions = compare(results, read_results(args.baseline), args.tolerance)
+    for regression in regressions:
+        print(f'Regression in {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,183 @@
+from datetime import datetime
+from functools import wraps
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+import eis
+
+CACHE_PATH = f'{eis.project_dir}/data/interim/http_cache.sqlite'
+MAX_BYTES = 2*1024**3  # 2GB
+DAY = 24*60*60
+
+# The total size is kept up to date by triggers, rather than summed for every eviction
+_SCHEMA = """
+PRAGMA journal_mode = WAL;
+PRAGMA recursive_triggers = ON;
+CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, size INTEGER,
+                                  expires REAL, accessed REAL);
+CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed);
+CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires);
+CREATE TABLE IF NOT EXISTS total (size INTEGER);
+INSERT INTO total SELECT 0 WHERE NOT EXISTS (SELECT * FROM total);
+CREATE TRIGGER IF NOT EXISTS cache_insert AFTER INSERT ON cache
+    BEGIN UPDATE total SET size = size + NEW.size; END;
+CREATE TRIGGER IF NOT EXISTS cache_delete AFTER DELETE ON cache
+    BEGIN UPDATE total SET size = size - OLD.size; END;
+"""
+
+
+class DiskCache:
+    """Persistent, size-bounded key-value cache for responses, stored in sqlite.
+
+    Entries expire after a time-to-live (TTL) set by the longest matching key
+    prefix in ttls (e.g. an endpoint URL), and the least recently used entries
+    are evicted once the total size exceeds max_bytes. The interface matches
+    cachecontrol's BaseCache, so an instance can be passed straight to
+    cachecontrol.CacheControl, and can be shared between threads and processes.
+
+    Args:
+        path (str): Path to the sqlite file.
+        max_bytes (int): Maximum total size of the cached values.
+        ttls (dict): Look-up of key prefix --> TTL in seconds (None for no expiry).
+        default_ttl (float): TTL in seconds for keys with no matching prefix (None for no expiry).
+    """
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES, ttls=None, default_ttl=DAY):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def __getstate__(self):
+        """Only pickle the settings, i.e. for sharing with worker processes"""
+        state = self.__dict__.copy()
+        del state['_lock'], state['_connection'], state['_pid']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def _connect(self):
+        """Connection to the sqlite file, made afresh in each process"""
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False,
+                                               isolation_level=None)
+            self._connection.executescript(_SCHEMA)
+            self._pid = os.getpid()
+        return self._connection
+
+    def ttl(self, key):
+        """TTL in seconds for this key, from the longest matching prefix in ttls"""
+        prefixes = [prefix for prefix in self.ttls if key.startswith(prefix)]
+        if not prefixes:
+            return self.default_ttl
+        return self.ttls[max(prefixes, key=len)]
+
+    def get(self, key):
+        """Cached value for key, or None if missing or expired."""
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute('SELECT value, expires FROM cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires = row
+            if expires is not None and expires < now:
+                connection.execute('DELETE FROM cache WHERE key = ?', (key,))
+                return None
+            connection.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        return value
+
+    def set(self, key, value, expires=None):
+        """Cache value (bytes) under key. The entry expires after the TTL for this key,
+        or sooner if expires (seconds, or a datetime) is given, i.e. by cachecontrol."""
+        now = time.time()
+        ttl = self.ttl(key)
+        expiry = None if ttl is None else now + ttl
+        if isinstance(expires, datetime):
+            expires = expires.timestamp() - now
+        if expires is not None:
+            expiry = now + expires if expiry is None else min(expiry, now + expires)
+        with self._lock:
+            connection = self._connect()
+            connection.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+                               (key, value, len(value), expiry, now))
+            self._evict(connection)
+
+    def delete(self, key):
+        """Remove key from the cache, if present."""
+        with self._lock:
+            self._connect().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def clear(self):
+        """Remove everything from the cache."""
+        with self._lock:
+            self._connect().execute('DELETE FROM cache')
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+
+    def total_bytes(self):
+        """Total size of the cached values."""
+        with self._lock:
+            return self._connect().execute('SELECT size FROM total').fetchone()[0]
+
+    def _evict(self, connection):
+        """Drop expired entries, and then the least recently used until within max_bytes"""
+        connection.execute('DELETE FROM cache WHERE expires < ?', (time.time(),))
+        total = connection.execute('SELECT size FROM total').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evict = []
+        for key, size in connection.execute('SELECT key, size FROM cache ORDER BY accessed'):
+            if total <= self.max_bytes:
+                break
+            evict.append((key,))
+            total -= size
+        connection.executemany('DELETE FROM cache WHERE key = ?', evict)
+
+
+def memoize(cache, namespace):
+    """Decorator for caching the (picklable) return values of a function in a DiskCache,
+    under keys of the form '{namespace}:{function name}:{arguments}', so that TTLs can
+    be set per function by prefix, e.g. 'eurostat:get_dic'.
+
+    The decorated function has an invalidate method, which takes the same arguments
+    and drops the cached value for them, e.g. when the source is known to have changed.
+
+    Args:
+        cache (DiskCache): Cache for the return values.
+        namespace (str): Prefix for the cache keys.
+    """
+    def decorator(func):
+        def make_key(*args, **kwargs):
+            return f'{namespace}:{func.__name__}:{args!r}:{sorted(kwargs.items())!r}'
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(*args, **kwargs)
+            value = cache.get(key)
+            if value is not None:
+                return pickle.loads(value)
+            result = func(*args, **kwargs)
+            cache.set(key, pickle.dumps(result))
+            return result
+
+        def invalidate(*args, **kwargs):
+            cache.delete(make_key(*args, **kwargs))
+
+        wrapper.invalidate = invalidate
+        return wrapper
+    return decorator
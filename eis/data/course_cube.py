@@ -0,0 +1,355 @@
+"""Dense counts of studyportal courses by discipline, degree level, country and
+(optionally) digital skill tag, so that questions like "how many master's courses
+in discipline X are there per country" need a look-up rather than a pass over
+every course file.
+
+The cube can be built in one pass over a zip archive of download_courses output
+(build_cube), or incrementally while crawling, by wrapping the crawl's shard
+writer in a CubeShardWriter. The writer notes the courses in each shard (just
+their ids, countries and tags) in a journal as the shard is flushed, so that
+resumed and incremental crawls give the same cube as a fresh crawl.
+
+Each cell counts distinct courses. A course taught in several countries is
+counted in each of them, and a course with several digital skills under each of
+their tags. Counts for a parent discipline are of the distinct courses under any
+of its children, so a course listed under two children of a parent is counted
+once for the parent (and the children's counts may add up to more).
+"""
+import json
+import os
+import zipfile
+
+import numpy as np
+
+import eis
+from eis.data.read_courses import ZIP_PATH, course_members, read_archive_json
+
+CUBE_PATH = f'{eis.project_dir}/data/processed/course_cube.npz'
+DIMS = ('discipline', 'level', 'country', 'tag')
+ALL, DIGITAL = 'all', 'digital'  # Tags for every course, and for courses with any digital skill
+UNKNOWN_COUNTRY = 'Unknown'
+
+
+def course_countries(course):
+    """Distinct countries a course is taught in (UNKNOWN_COUNTRY if none are given)."""
+    countries = {venue.get('country') for venue in course.get('venues') or [] if venue.get('country')}
+    return sorted(countries) or [UNKNOWN_COUNTRY]
+
+
+def cube_tags(categories=None):
+    """Labels of the tag dimension: just ALL, or also DIGITAL and each category of the
+    digital skill taxonomy (see eis.transformers.digital_skills)."""
+    return [ALL] if categories is None else [ALL, DIGITAL] + list(categories)
+
+
+def shard_courses(courses, matcher=None, tags=None):
+    """Summary of a batch of courses (all of the same discipline and level) for the cube.
+
+    Args:
+        courses (list of dict): Rawish course data, as written by download_courses.
+        matcher (KeywordMatcher): Compiled digital skill taxonomy, or None for no tags.
+        tags (CourseTags): Labels already found in the courses' titles and summaries
+                           (i.e. by tag_corpus), so that only the matcher's look-up of
+                           disciplines is needed. Courses which weren't tagged have none.
+    Returns:
+        summary (list of list): [course id, countries, bitmask of categories] for each course.
+    """
+    if matcher is None:
+        labels = [0]*len(courses)
+    elif tags is None:
+        from eis.transformers.digital_skills import tag_courses
+        _, text_labels, discipline_labels = tag_courses(courses, matcher)
+        labels = (text_labels | discipline_labels).tolist()
+    else:
+        positions = tags.positions([course['id'] for course in courses])
+        text_labels = np.where(positions >= 0, tags.text_labels[np.maximum(positions, 0)], 0) \
+            if len(tags) else np.zeros(len(courses), dtype=int)
+        discipline_labels = matcher.discipline_labels([course.get('discipline_title') for course in courses])
+        labels = (text_labels | discipline_labels).tolist()
+    return [[course['id'], course_countries(course), label] for course, label in zip(courses, labels)]
+
+
+def _parent_id(discipline):
+    """Id of the parent of a discipline, which may be given as the parent's dictionary"""
+    parent = discipline['parent']
+    return parent['discipline_id'] if isinstance(parent, dict) else parent
+
+
+def _count_distinct(cells, shape):
+    """Counts from (position in each dimension..., course id) rows, counting each course once per cell"""
+    counts = np.zeros(shape, dtype=np.int32)
+    if len(cells):
+        cells = np.unique(cells, axis=0)
+        np.add.at(counts, tuple(cells[:, :-1].T), 1)
+    return counts
+
+
+class CourseCube:
+    """Dense array of course counts, with dimensions DIMS, and the same counts for the
+    parent disciplines.
+
+    Args:
+        counts (array): discipline x level x country x tag counts.
+        disciplines (list of int): Discipline ids, for the first dimension.
+        levels (list of str): Degree levels.
+        countries (list of str): Countries.
+        tags (list of str): Tags, see cube_tags.
+        parents (list of int): Parent discipline id of each discipline (None for no parent).
+        parent_counts (array): parent x level x country x tag counts, with the parents
+                               in order of their ids.
+        titles (dict): Look-up of discipline id --> title, for disciplines and parents.
+    """
+    def __init__(self, counts, disciplines, levels, countries, tags, parents, parent_counts, titles=None):
+        self.counts = np.asarray(counts)
+        self.labels = {'discipline': [int(di) for di in disciplines], 'level': list(levels),
+                       'country': list(countries), 'tag': list(tags)}
+        self.parents = [None if parent is None else int(parent) for parent in parents]
+        self.parent_ids = sorted({parent for parent in self.parents if parent is not None})
+        self.parent_counts = np.asarray(parent_counts)
+        if self.parent_counts.shape != (len(self.parent_ids),) + self.counts.shape[1:]:
+            raise ValueError(f'Parent counts of shape {self.parent_counts.shape} for {len(self.parent_ids)} '
+                             f'parents and counts of shape {self.counts.shape}')
+        self.titles = {} if titles is None else {int(di): title for di, title in titles.items()}
+        self._positions = {dim: {label: i for i, label in enumerate(labels)}
+                           for dim, labels in self.labels.items()}
+        self._parent_positions = {parent: i for i, parent in enumerate(self.parent_ids)}
+
+    @property
+    def shape(self):
+        return self.counts.shape
+
+    def _index(self, dim, label, positions=None):
+        """Index into a dimension for a label, a list of labels, or None for all"""
+        positions = self._positions[dim] if positions is None else positions
+        if label is None:
+            return slice(None)
+        if isinstance(label, (list, tuple, np.ndarray)):
+            return np.array([positions[item] for item in label], dtype=np.intp)
+        return positions[label]
+
+    def select(self, discipline=None, level=None, country=None, tag=ALL, parent=None):
+        """Counts for the given labels of each dimension, with the dimensions given a
+        single label dropped, e.g. select(discipline=331, level='master') is an array
+        of counts by country.
+
+        Args:
+            discipline (int or list of int): Discipline id(s), or None for all.
+            level (str or list of str): Degree level(s), or None for all.
+            country (str or list of str): Countries, or None for all.
+            tag (str or list of str): Tag(s), or None for all. Defaults to ALL, i.e. every course.
+            parent (int or list of int): Parent discipline id(s), instead of discipline, to
+                                         select from the counts for the parents.
+        Returns:
+            counts (array or int)
+        Raises:
+            KeyError: For an unknown label.
+        """
+        if parent is not None:
+            if discipline is not None:
+                raise ValueError('Select either disciplines or parents, not both')
+            counts, first = self.parent_counts, self._index('discipline', parent, self._parent_positions)
+        else:
+            counts, first = self.counts, self._index('discipline', discipline)
+        index = (first, self._index('level', level), self._index('country', country), self._index('tag', tag))
+        # Index each dimension in turn, as numpy would otherwise broadcast lists of labels together
+        for axis in reversed(range(len(index))):
+            counts = counts[(slice(None),)*axis + (index[axis],)]
+        return counts
+
+    def count(self, discipline=None, level=None, country=None, tag=ALL, parent=None):
+        """Sum of the counts for the given labels (see select). Courses in more than one
+        of the cells selected are counted in each."""
+        return int(np.sum(self.select(discipline, level, country, tag, parent)))
+
+    def children(self, parent):
+        """Ids of the disciplines under a parent discipline."""
+        return [di for di, p in zip(self.labels['discipline'], self.parents) if p == parent]
+
+    def rollup(self):
+        """The cube for the parent disciplines."""
+        return CourseCube(self.parent_counts, self.parent_ids, self.labels['level'], self.labels['country'],
+                          self.labels['tag'], [None]*len(self.parent_ids),
+                          np.zeros((0,) + self.parent_counts.shape[1:], dtype=self.parent_counts.dtype),
+                          self.titles)
+
+    def to_frame(self):
+        """Long DataFrame of the non-zero counts, with a column for each dimension (and
+        the discipline's title and parent)."""
+        import pandas as pd
+        nonzero = np.nonzero(self.counts)
+        frame = pd.DataFrame({dim: np.asarray(self.labels[dim], dtype=object)[nonzero[axis]]
+                              for axis, dim in enumerate(DIMS)})
+        frame.insert(1, 'discipline_title', frame['discipline'].map(self.titles))
+        frame.insert(2, 'parent', np.asarray(self.parents, dtype=object)[nonzero[0]])
+        frame['n_courses'] = self.counts[nonzero]
+        return frame
+
+    def to_xarray(self):
+        """The cube as an xarray.DataArray (xarray must be installed)."""
+        import xarray as xr
+        coords = {dim: self.labels[dim] for dim in DIMS}
+        coords['parent'] = ('discipline', [-1 if parent is None else parent for parent in self.parents])
+        return xr.DataArray(self.counts, coords=coords, dims=DIMS, name='n_courses')
+
+    def save(self, path=CUBE_PATH):
+        """Save the cube to a .npz file."""
+        np.savez_compressed(path, counts=self.counts, parent_counts=self.parent_counts,
+                            labels=json.dumps({'labels': self.labels, 'parents': self.parents,
+                                               'titles': self.titles}))
+
+    @classmethod
+    def load(cls, path=CUBE_PATH):
+        """Load a cube saved with save."""
+        with np.load(path) as arrays:
+            meta = json.loads(arrays['labels'].item())
+            counts, parent_counts = arrays['counts'], arrays['parent_counts']
+        labels = meta['labels']
+        return cls(counts, labels['discipline'], labels['level'], labels['country'], labels['tag'],
+                   meta['parents'], parent_counts, meta['titles'])
+
+    @classmethod
+    def from_shards(cls, shards, disciplines, categories=None):
+        """Make a cube from the courses in each shard.
+
+        Args:
+            shards (iterable of tuple): (di, lvl, summary) for each shard, summary as from shard_courses.
+            disciplines (list of dict): As in discipline_dictionary.json. Every discipline
+                                        with a parent has a place in the cube.
+            categories (list of str): Categories of the digital skill taxonomy which the
+                                      summaries were tagged with, or None for no tags.
+        Returns:
+            cube (CourseCube)
+        """
+        shards = list(shards)
+        tags = cube_tags(categories)
+        children = sorted({d['discipline_id'] for d in disciplines if d['parent'] is not None}
+                          | {di for di, _, _ in shards})
+        parent_ids = {d['discipline_id']: _parent_id(d) for d in disciplines if d['parent'] is not None}
+        parents = [parent_ids.get(di) for di in children]
+        parent_positions = {parent: i for i, parent in enumerate(sorted(set(parents) - {None}))}
+        levels = sorted({lvl for _, lvl, _ in shards})
+        countries = sorted({country for _, _, summary in shards for _, course_countries, _ in summary
+                            for country in course_countries})
+        positions = [{label: i for i, label in enumerate(labels)} for labels in (children, levels, countries)]
+        # A row for each (discipline, parent, level, country, tag, course), so that courses
+        # which appear more than once in a cell (i.e. under two children of a parent) are
+        # counted once
+        cells = []
+        for di, lvl, summary in shards:
+            i, j = positions[0][di], positions[1][lvl]
+            p = parent_positions.get(parents[i], -1)
+            for course_id, course_countries, labels in summary:
+                course_tags = [0]
+                if labels:
+                    course_tags += [1] + [2 + bit for bit in range(len(tags) - 2) if labels >> bit & 1]
+                for country in course_countries:
+                    k = positions[2][country]
+                    cells.extend((i, p, j, k, t, course_id) for t in course_tags)
+        cells = np.array(cells, dtype=np.int64).reshape(-1, 6)
+        shape = (len(levels), len(countries), len(tags))
+        counts = _count_distinct(cells[:, [0, 2, 3, 4, 5]], (len(children),) + shape)
+        cells = cells[cells[:, 1] >= 0]
+        parent_counts = _count_distinct(cells[:, [1, 2, 3, 4, 5]], (len(parent_positions),) + shape)
+        titles = {d['discipline_id']: d['discipline_title'] for d in disciplines}
+        return cls(counts, children, levels, countries, tags, parents, parent_counts, titles)
+
+
+def build_cube(path=ZIP_PATH, matcher=None, tags=None):
+    """Build a cube in one pass over a zip archive of download_courses output.
+
+    Args:
+        path (str): Path to the zip archive.
+        matcher (KeywordMatcher): Compiled digital skill taxonomy, to count courses by
+                                  tag (see eis.transformers.digital_skills), or None.
+        tags (CourseTags): Labels of the courses' text from the same taxonomy (i.e. from
+                           tag_corpus), so that the text isn't scanned again.
+    Returns:
+        cube (CourseCube)
+    """
+    if tags is not None and matcher is not None and tags.categories != matcher.categories:
+        raise ValueError(f'Tags for categories {tags.categories}, not {matcher.categories}')
+    shards = []
+    with zipfile.ZipFile(path) as archive:
+        for name, di, lvl in course_members(archive):
+            with archive.open(name) as f:
+                shards.append((di, lvl, shard_courses(json.load(f), matcher, tags)))
+    return CourseCube.from_shards(shards, read_archive_json('discipline_dictionary.json', path),
+                                  None if matcher is None else matcher.categories)
+
+
+def read_cube_journal(path):
+    """Courses in each shard recorded in a CubeShardWriter journal.
+
+    Args:
+        path (str): Path to the journal.
+    Returns:
+        shards, categories (list, list): (di, lvl, summary) for each shard still on disk,
+                                         and the categories the courses were tagged with.
+    """
+    from eis.data.download_courses import read_json_lines
+    shards, categories = {}, None
+    for record in read_json_lines(path):
+        if 'categories' in record:
+            categories = record['categories']
+        elif 'remove' in record:
+            di, lvl = record['remove']
+            shards = {key: shard for key, shard in shards.items() if key[:2] != (di, lvl)}
+        else:
+            # Keyed by the count, which is unique to each shard of a (di, lvl), so that
+            # shards which are written again (i.e. on resuming) replace the earlier ones
+            shards[(record['di'], record['lvl'], record['count'])] = record['courses']
+    return [(di, lvl, summary) for (di, lvl, _), summary in shards.items()], categories
+
+
+class CubeShardWriter:
+    """Shard writer (see eis.data.course_shards) which passes each shard on to another
+    writer, and records its courses for the cube in a journal as it is written.
+
+    Args:
+        writer (shard writer): Writer for the shards themselves.
+        path (str): Path to the journal.
+        matcher (KeywordMatcher): Compiled digital skill taxonomy, to count courses by tag, or None.
+        reset (bool): Start a new journal, i.e. for a fresh crawl, rather than adding to it.
+    """
+    def __init__(self, writer, path, matcher=None, reset=True):
+        from eis.data.download_courses import append_json_lines
+        self.writer = writer
+        self.path = path
+        self.matcher = matcher
+        self._append = append_json_lines
+        if reset or not os.path.exists(path):
+            open(path, 'w').close()
+            self._append([{'categories': None if matcher is None else matcher.categories}], path)
+
+    @property
+    def durable(self):
+        return self.writer.durable
+
+    def write(self, courses, di, lvl, count):
+        if courses and type(courses[0]) is int:
+            raise ValueError('The cube needs the course data, not just the ids (i.e. not dedup=True)')
+        self._append([{'di': di, 'lvl': lvl, 'count': count, 'courses': shard_courses(courses, self.matcher)}],
+                     self.path)
+        return self.writer.write(courses, di, lvl, count)
+
+    def finish(self, di, lvl):
+        return self.writer.finish(di, lvl)
+
+    def shards(self, di, lvl):
+        return self.writer.shards(di, lvl)
+
+    def remove(self, di, lvl):
+        self._append([{'remove': [di, lvl]}], self.path)
+        self.writer.remove(di, lvl)
+
+    def close(self):
+        self.writer.close()
+
+    def cube(self, disciplines):
+        """The cube for every shard in the journal.
+
+        Args:
+            disciplines (list of dict): As in discipline_dictionary.json.
+        """
+        shards, categories = read_cube_journal(self.path)
+        return CourseCube.from_shards(shards, disciplines, categories)
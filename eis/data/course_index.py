@@ -0,0 +1,162 @@
+from functools import reduce
+import numpy as np
+
+
+class CourseDisciplineIndex:
+    """Compact two-way look-up between course ids and discipline ids.
+
+    Each direction is stored in compressed sparse row (CSR) form: a sorted array
+    of unique keys, an array of offsets and a flat array of values, so that the
+    values for the i-th key are values[offsets[i]:offsets[i+1]], sorted and
+    unique. Positions of keys are held in dense arrays indexed by id, so that
+    both look-ups are O(1).
+
+    Args:
+        course_ids (array-like of int): Course id for each (course, discipline) pair.
+        discipline_ids (array-like of int): Discipline id for each (course, discipline) pair.
+    """
+    _fields = ('course_keys', 'course_offsets', 'course_disciplines',
+               'discipline_keys', 'discipline_offsets', 'discipline_courses')
+
+    def __init__(self, course_ids, discipline_ids):
+        pairs = np.unique(np.column_stack([np.asarray(course_ids, dtype=np.int64),
+                                           np.asarray(discipline_ids, dtype=np.int64)]), axis=0)
+        self.course_keys, self.course_offsets, self.course_disciplines = _csr(pairs[:, 0], pairs[:, 1])
+        self.discipline_keys, self.discipline_offsets, self.discipline_courses = _csr(pairs[:, 1], pairs[:, 0])
+        self._make_positions()
+
+    @classmethod
+    def from_lookup(cls, course_discipline_lookup):
+        """Build the index from a look-up of course_id --> [discipline ids],
+        i.e. as in course_discipline_lookup.json (json keys are converted to int).
+
+        Args:
+            course_discipline_lookup (dict): Look-up of course_id --> [discipline ids].
+        Returns:
+            index (CourseDisciplineIndex)
+        """
+        lengths = [len(dis) for dis in course_discipline_lookup.values()]
+        course_ids = np.repeat(np.array([int(ci) for ci in course_discipline_lookup], dtype=np.int64),
+                               lengths)
+        discipline_ids = np.fromiter((di for dis in course_discipline_lookup.values() for di in dis),
+                                     dtype=np.int64, count=sum(lengths))
+        return cls(course_ids, discipline_ids)
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with save.
+
+        Args:
+            path (str): Path to the .npz file.
+        Returns:
+            index (CourseDisciplineIndex)
+        """
+        index = cls.__new__(cls)
+        with np.load(path) as arrays:
+            for field in cls._fields:
+                setattr(index, field, arrays[field])
+        index._make_positions()
+        return index
+
+    def save(self, path):
+        """Save the index to an uncompressed .npz file.
+
+        Args:
+            path (str): Path to the .npz file.
+        """
+        np.savez(path, **{field: getattr(self, field) for field in self._fields})
+
+    def _make_positions(self):
+        """Dense arrays of id --> position in the keys arrays (-1 if missing)"""
+        self._course_positions = _positions(self.course_keys)
+        self._discipline_positions = _positions(self.discipline_keys)
+
+    def __len__(self):
+        """Number of (course, discipline) pairs"""
+        return len(self.course_disciplines)
+
+    @property
+    def n_courses(self):
+        return len(self.course_keys)
+
+    @property
+    def n_disciplines(self):
+        return len(self.discipline_keys)
+
+    def courses_for(self, discipline_id):
+        """Sorted array of course ids for this discipline (empty if unknown)."""
+        i = _position(self._discipline_positions, discipline_id)
+        if i < 0:
+            return self.discipline_courses[:0]
+        return self.discipline_courses[self.discipline_offsets[i]:self.discipline_offsets[i+1]]
+
+    def disciplines_for(self, course_id):
+        """Sorted array of discipline ids for this course (empty if unknown)."""
+        i = _position(self._course_positions, course_id)
+        if i < 0:
+            return self.course_disciplines[:0]
+        return self.course_disciplines[self.course_offsets[i]:self.course_offsets[i+1]]
+
+    def discipline_counts(self):
+        """Number of courses per discipline, aligned with discipline_keys."""
+        return np.diff(self.discipline_offsets)
+
+    def union(self, discipline_ids):
+        """Sorted array of course ids in any of these disciplines."""
+        courses = [self.courses_for(di) for di in discipline_ids]
+        if not courses:
+            return self.discipline_courses[:0]
+        return np.unique(np.concatenate(courses))
+
+    def intersection(self, discipline_ids):
+        """Sorted array of course ids in all of these disciplines."""
+        courses = sorted((self.courses_for(di) for di in discipline_ids), key=len)
+        if not courses:
+            return self.discipline_courses[:0]
+        return reduce(lambda a, b: np.intersect1d(a, b, assume_unique=True), courses)
+
+    def difference(self, discipline_ids, other_discipline_ids):
+        """Sorted array of course ids in any of discipline_ids, but none of other_discipline_ids."""
+        return np.setdiff1d(self.union(discipline_ids), self.union(other_discipline_ids),
+                            assume_unique=True)
+
+    def to_lookups(self):
+        """Export to the json-ready look-up tables of download_courses.
+
+        Returns:
+            course_discipline_lookup, discipline_course_lookup (dict, dict):
+                Look-ups of course_id --> [discipline ids] and discipline_id --> [course ids].
+        """
+        return (_to_lookup(self.course_keys, self.course_offsets, self.course_disciplines),
+                _to_lookup(self.discipline_keys, self.discipline_offsets, self.discipline_courses))
+
+
+def _csr(keys, values):
+    """CSR arrays for unique (key, value) pairs, keeping values in their given order within each key"""
+    order = np.argsort(keys, kind='stable')
+    keys, values = keys[order], values[order]
+    unique_keys, starts = np.unique(keys, return_index=True)
+    offsets = np.append(starts, len(keys)).astype(np.int64)
+    return unique_keys, offsets, values
+
+
+def _positions(keys):
+    """Dense array of id --> position in keys (-1 if missing)"""
+    positions = np.full(int(keys[-1]) + 1 if len(keys) else 0, -1, dtype=np.int32)
+    positions[keys] = np.arange(len(keys), dtype=np.int32)
+    return positions
+
+
+def _position(positions, key):
+    """Position of key, from a dense array made by _positions (-1 if missing)"""
+    key = int(key)
+    if key < 0 or key >= len(positions):
+        return -1
+    return positions[key]
+
+
+def _to_lookup(keys, offsets, values):
+    """Dict of key --> list of values, from CSR arrays"""
+    values = values.tolist()
+    return {key: values[start:stop]
+            for key, start, stop in zip(keys.tolist(), offsets[:-1].tolist(), offsets[1:].tolist())}
@@ -0,0 +1,181 @@
+"""Pluggable writers for the batches of courses flushed by download_courses,
+and the reader for the Parquet output.
+
+A shard writer implements:
+
+    write(courses, di, lvl, count) --> path of the shard, relative to the writer's path
+    finish(di, lvl) --> path of a shard which only became readable on finishing, or None
+    shards(di, lvl) --> paths of all shards on disk for (di, lvl)
+    remove(di, lvl) --> delete all shards on disk for (di, lvl)
+    close()
+
+and has a 'durable' attribute, which is True if each shard can be read back
+as soon as write returns (rather than after finish).
+"""
+import glob
+import json
+import os
+import shutil
+
+# Course fields with a fixed type in the Parquet schema. Any other fields
+# are kept as a json string in the 'extra' column. The discipline id and
+# level are held in the partition path, rather than in the file.
+PARQUET_FIELDS = ('id', 'title', 'summary', 'degree', 'tuition_fee', 'fulltime_duration',
+                  'parttime_duration', 'density', 'methods', 'organisation_id', 'organisation',
+                  'venues', 'discipline_title')
+PARTITION_FIELDS = ('discipline_id', 'level')
+
+
+def course_schema():
+    """Stable Parquet schema for studyportal course data.
+
+    Returns:
+        schema (pyarrow.Schema)
+    """
+    import pyarrow as pa
+    duration = pa.struct([('value', pa.float64()), ('unit', pa.string())])
+    return pa.schema([('id', pa.int64()),
+                      ('title', pa.string()),
+                      ('summary', pa.string()),
+                      ('degree', pa.string()),
+                      ('tuition_fee', pa.struct([('value', pa.float64()),
+                                                 ('unit', pa.string()),
+                                                 ('currency', pa.string())])),
+                      ('fulltime_duration', duration),
+                      ('parttime_duration', duration),
+                      ('density', pa.struct([('parttime', pa.bool_()),
+                                             ('fulltime', pa.bool_())])),
+                      ('methods', pa.struct([('face2face', pa.bool_()),
+                                             ('online', pa.bool_()),
+                                             ('blended', pa.bool_())])),
+                      ('organisation_id', pa.int64()),
+                      ('organisation', pa.string()),
+                      ('venues', pa.list_(pa.struct([('city', pa.string()),
+                                                     ('country', pa.string()),
+                                                     ('area', pa.string()),
+                                                     ('display_area', pa.bool_())]))),
+                      ('discipline_title', pa.string()),
+                      ('extra', pa.string())])
+
+
+def _parquet_row(course):
+    """Split course data into the fixed schema fields, and json for everything else"""
+    row = {field: course.get(field) for field in PARQUET_FIELDS}
+    extra = {k: v for k, v in course.items() if k not in PARQUET_FIELDS and k not in PARTITION_FIELDS}
+    row['extra'] = json.dumps(extra) if extra else None
+    return row
+
+
+class JsonShardWriter:
+    """Writes each batch of courses to its own json file, under the path di/lvl/di-lvl-count.json
+
+    Args:
+        path (str): Output directory.
+    """
+    durable = True
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, courses, di, lvl, count):
+        shard = f'{di}/{lvl}/{di}-{lvl}-{count}.json'
+        os.makedirs(f'{self.path}/{di}/{lvl}', exist_ok=True)
+        with open(f'{self.path}/{shard}', 'w') as f:
+            f.write(json.dumps(courses))
+        return shard
+
+    def finish(self, di, lvl):
+        return None
+
+    def shards(self, di, lvl):
+        return glob.glob(f'{self.path}/{di}/{lvl}/{di}-{lvl}-*.json')
+
+    def remove(self, di, lvl):
+        shutil.rmtree(f'{self.path}/{di}/{lvl}', ignore_errors=True)
+
+    def close(self):
+        pass
+
+
+class ParquetShardWriter:
+    """Streams courses into a Parquet dataset, partitioned by discipline id and level, i.e.
+    under the path discipline_id=di/level=lvl/di-lvl.parquet. Each batch of courses is
+    appended as a row group, and each file is completed when its (di, lvl) is finished.
+
+    Batches of course ids (i.e. from download_courses(dedup=True)) are written
+    with only an id column.
+
+    Args:
+        path (str): Output directory.
+    """
+    durable = False
+
+    def __init__(self, path):
+        import pyarrow  # noqa: F401 (fail early if pyarrow is not installed)
+        self.path = path
+        self._writers = {}
+
+    def _bucket_path(self, di, lvl):
+        return f'discipline_id={di}/level={lvl}'
+
+    def write(self, courses, di, lvl, count):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if courses and type(courses[0]) is int:
+            table = pa.table({'id': pa.array(courses, type=pa.int64())})
+        else:
+            # Column by column, as Table.from_pylist needs pyarrow>=7 (which needs python>=3.7)
+            schema = course_schema()
+            rows = [_parquet_row(course) for course in courses]
+            table = pa.Table.from_pydict({name: [row.get(name) for row in rows] for name in schema.names},
+                                         schema=schema)
+        shard = f'{self._bucket_path(di, lvl)}/{di}-{lvl}.parquet'
+        if (di, lvl) not in self._writers:
+            os.makedirs(f'{self.path}/{self._bucket_path(di, lvl)}', exist_ok=True)
+            self._writers[(di, lvl)] = pq.ParquetWriter(f'{self.path}/{shard}', table.schema)
+        self._writers[(di, lvl)].write_table(table)
+        return shard
+
+    def finish(self, di, lvl):
+        writer = self._writers.pop((di, lvl), None)
+        if writer is None:
+            return None
+        writer.close()
+        return f'{self._bucket_path(di, lvl)}/{di}-{lvl}.parquet'
+
+    def shards(self, di, lvl):
+        return glob.glob(f'{self.path}/{self._bucket_path(di, lvl)}/*.parquet')
+
+    def remove(self, di, lvl):
+        shutil.rmtree(f'{self.path}/{self._bucket_path(di, lvl)}', ignore_errors=True)
+
+    def close(self):
+        for di, lvl in list(self._writers):
+            self.finish(di, lvl)
+
+
+def read_parquet_courses(path, columns=None, disciplines=None, levels=None):
+    """Read course data written by ParquetShardWriter, reading only the requested
+    columns, and only the files for the requested disciplines and levels.
+
+    Args:
+        path (str): Directory of the Parquet dataset.
+        columns (list of str): Columns to read, which may include 'discipline_id' and
+                               'level'. Defaults to all columns.
+        disciplines (list of int): Discipline ids to read. Defaults to all.
+        levels (list of str): Degree levels to read. Defaults to all.
+    Returns:
+        courses (pandas.DataFrame)
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    partitioning = ds.partitioning(pa.schema([('discipline_id', pa.int64()),
+                                              ('level', pa.string())]), flavor='hive')
+    dataset = ds.dataset(path, format='parquet', partitioning=partitioning)
+    condition = None
+    for field, values in (('discipline_id', disciplines), ('level', levels)):
+        if values is None:
+            continue
+        this_condition = ds.field(field).isin(list(values))
+        condition = this_condition if condition is None else condition & this_condition
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
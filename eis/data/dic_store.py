@@ -0,0 +1,109 @@
+from datetime import datetime, timezone
+import pickle
+import threading
+import time
+
+STRUCTURE_CHANGE = 'last table structure change'  # Column of the eurostat table of contents
+
+
+def parse_toc_date(value):
+    """Timestamp (seconds) of a date from the eurostat table of contents, which are
+    either dd.mm.yyyy or ISO 8601 depending on the version of the API.
+
+    Args:
+        value (str): Date from the table of contents.
+    Returns:
+        timestamp (float): Seconds since the epoch, or None if missing or unparseable.
+    """
+    if not isinstance(value, str) or not value.strip():
+        return None
+    try:
+        return datetime.strptime(value.strip(), '%d.%m.%Y').replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        pass
+    import pandas as pd
+    try:
+        timestamp = pd.Timestamp(value)
+    except ValueError:
+        return None
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return timestamp.timestamp()
+
+
+def structure_changed(toc_rows):
+    """Latest structure change of the tables in some rows of the table of contents.
+
+    Args:
+        toc_rows (DataFrame): Rows of the table of contents, i.e. for one table code.
+    Returns:
+        timestamp (float): Seconds since the epoch, or None if not known.
+    """
+    if STRUCTURE_CHANGE not in toc_rows.columns:
+        return None
+    timestamps = [t for t in map(parse_toc_date, toc_rows[STRUCTURE_CHANGE]) if t is not None]
+    return max(timestamps, default=None)
+
+
+class DicStore:
+    """Store of eurostat dictionaries (the code lists for each dimension, e.g. geo or unit),
+    which are shared by most tables and so should only be downloaded once. Dictionaries are
+    held in memory and, if a cache is given, on disk. A dictionary is downloaded again only
+    if a table's structure has changed since the dictionary was downloaded, according to the
+    table of contents.
+
+    Args:
+        fetch (function): Downloads the dictionary for a dimension, i.e. eurostat.get_dic.
+        cache (DiskCache): Cache for the dictionaries between runs, or None to only keep them in memory.
+        namespace (str): Prefix for the cache keys.
+    """
+    def __init__(self, fetch, cache=None, namespace='eurostat:dic'):
+        self.fetch = fetch
+        self.cache = cache
+        self.namespace = namespace
+        self._dics = {}  # dimension --> (fetched, dictionary)
+        self._make_locks()
+
+    def _make_locks(self):
+        """A lock for each dimension, held while its dictionary is looked up or fetched, so
+        that it is fetched once however many tables ask for it, while other dimensions are
+        looked up freely. The store's lock only guards the dict of locks."""
+        self._lock = threading.Lock()
+        self._dim_locks = {}
+
+    def _dim_lock(self, dim):
+        with self._lock:
+            return self._dim_locks.setdefault(dim, threading.Lock())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock'], state['_dim_locks']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._make_locks()
+
+    def get(self, dim, changed=None):
+        """Dictionary for a dimension.
+
+        Args:
+            dim (str): Name of the dimension, e.g. 'geo'.
+            changed (float): When the requesting table's structure last changed (seconds since
+                             the epoch, see structure_changed), or None to accept any stored
+                             dictionary.
+        Returns:
+            dic (dict): Look-up of code --> description.
+        """
+        with self._dim_lock(dim):
+            entry = self._dics.get(dim)
+            if entry is None and self.cache is not None:
+                value = self.cache.get(f'{self.namespace}:{dim}')
+                if value is not None:
+                    entry = self._dics[dim] = pickle.loads(value)
+            if entry is not None and (changed is None or changed <= entry[0]):
+                return entry[1]
+            entry = self._dics[dim] = (time.time(), self.fetch(dim))
+            if self.cache is not None:
+                self.cache.set(f'{self.namespace}:{dim}', pickle.dumps(entry))
+            return entry[1]
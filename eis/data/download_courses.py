@@ -1,16 +1,71 @@
 import requests
 import cachecontrol
+import cachecontrol.heuristics
 from bs4 import BeautifulSoup
-from sortedcontainers import SortedList
+from array import array
 from collections import defaultdict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
 import os
 import json
 
+import eis
+from eis.data.cache import DAY
+from eis.data.cache import DiskCache
+from eis.data.course_index import CourseDisciplineIndex
+from eis.data.course_shards import JsonShardWriter
+from eis.data.fetch import CachedThrottledAdapter
+from eis.metrics import SIZE_BUCKETS
+from eis.metrics import metrics
+
 DATA_PATH = '../../data/raw/courses/'  # Path for writing data to
-BACHELOR_DISCIPLINES_URL = "https://www.bachelorsportal.com/disciplines/"
-SEARCH_FACETS_URL = "https://search-facets.prtl.co"
-SEARCH_URL = "https://search.prtl.co/2018-07-23/"
+PORTAL_DISCIPLINES_URL = "https://www.bachelorsportal.com/disciplines/"  # Where the discipline pages link to
+# Base URLs can be pointed at a stand-in through the environment (see eis.data.replay)
+BACHELOR_DISCIPLINES_URL = os.environ.get('EIS_BACHELOR_DISCIPLINES_URL', PORTAL_DISCIPLINES_URL)
+SEARCH_FACETS_URL = os.environ.get('EIS_SEARCH_FACETS_URL', "https://search-facets.prtl.co")
+SEARCH_URL = os.environ.get('EIS_SEARCH_URL', "https://search.prtl.co/2018-07-23/")
 PAGE_SIZE = 10  # This is fixed, nothing I can do about it
+CACHE_TTLS = {BACHELOR_DISCIPLINES_URL: 7*DAY,  # Time-to-live (seconds) of cached responses, by URL
+              SEARCH_FACETS_URL: DAY,
+              SEARCH_URL: DAY}
+
+
+def make_session(cache=None):
+    """Make a session for studyportal requests, with responses cached on disk, and
+    with requests rate limited and retried (see eis.data.fetch).
+
+    Args:
+        cache (DiskCache or cachecontrol cache): Response cache. Defaults to
+                                                 the shared DiskCache, with CACHE_TTLS.
+    Returns:
+        session (requests.Session)
+    """
+    if cache is None:
+        cache = DiskCache(ttls=CACHE_TTLS)
+    # studyportal doesn't send caching headers, so cache everything and let the TTLs decide
+    heuristic = cachecontrol.heuristics.ExpiresAfter(seconds=max(CACHE_TTLS.values()))
+    return cachecontrol.CacheControl(requests.Session(), cache=cache, heuristic=heuristic,
+                                     adapter_class=CachedThrottledAdapter)
+
+
+def discipline_url(url, href):
+    """URL of a discipline page linked from the page at url. The portal's own links
+    are followed under BACHELOR_DISCIPLINES_URL, so that they are also served by any
+    stand-in for the portal (see eis.data.replay).
+
+    Args:
+        url (str): URL of the page with the link.
+        href (str): The link.
+    Returns:
+        url (str)
+    """
+    if url.startswith(BACHELOR_DISCIPLINES_URL):  # Resolve relative links against the portal itself
+        url = PORTAL_DISCIPLINES_URL + url[len(BACHELOR_DISCIPLINES_URL):]
+    href = urljoin(url, href)
+    if href.startswith(PORTAL_DISCIPLINES_URL):
+        return BACHELOR_DISCIPLINES_URL + href[len(PORTAL_DISCIPLINES_URL):]
+    return href
 
 
 def discover_disciplines(session, url, section_id='DisciplineSpotlight', parent=None):
@@ -41,7 +96,7 @@ def discover_disciplines(session, url, section_id='DisciplineSpotlight', parent=
         disciplines.append(this_discipline)
         # For disciplines (rather than subdisciplines), extract subdisciplines
         if parent is None:
-            disciplines += discover_disciplines(session, href,
+            disciplines += discover_disciplines(session, discipline_url(url, href),
                                                 section_id='SubdisciplinesList', parent=this_discipline)
     return disciplines
 
@@ -63,6 +118,38 @@ def discover_level_count(session, discipline_id):
         yield degree_level, count
 
 
+def _query_string(di, lvl):
+    """Build the studyportal search query string for this combination of (di, lvl)."""
+    return '|'.join((f'di-{di}',   # Discipline
+                     'en-3002',    # Don't know what this is, could be a mechanism for rate limiting
+                     f'lv-{lvl}',  # Degree level
+                     'tc-EUR',     # Currency
+                     'uc-30',      # Don't know what this is
+                     'ur-38'))     # Don't know what this is
+
+
+def _n_pages(total):
+    """Number of PAGE_SIZE pages required to cover total results."""
+    return (total // PAGE_SIZE) + (total % PAGE_SIZE > 0)
+
+
+def _fetch_page(session, di, lvl, page):
+    """Hidden method for fetching a single page of courses from studyportal.
+
+    Args:
+        session (requests.Session, or equivalent): session for making requests.
+        di (int): Discipline id number.
+        lvl (str): Degree level string (e.g. bachelor, master, etc)
+        page (int): Page number, counting from zero.
+    Returns:
+        courses (list of dict): Raw course data for this page, for this degree level only.
+    """
+    r = session.get(SEARCH_URL, params={'start': page*PAGE_SIZE, 'q': _query_string(di, lvl)})
+    r.raise_for_status()
+    # Don't double count sublevels (e.g. preparation is a level & also incl under bachelor)
+    return [course for course in r.json() if course['level'] == lvl]
+
+
 def _discover_courses(session, di, lvl, total):
     """Hidden method for discovering courses on studyportal.
 
@@ -74,23 +161,40 @@ def _discover_courses(session, di, lvl, total):
     Yields:
         course (dict): Raw course data, for an individual course from studyportal.
     """
-    query_string = '|'.join((f'di-{di}',   # Discipline
-                             'en-3002',    # Don't know what this is, could be a mechanism for rate limiting
-                             f'lv-{lvl}',  # Degree level
-                             'tc-EUR',     # Currency
-                             'uc-30',      # Don't know what this is
-                             'ur-38'))     # Don't know what this is
-    n_pages = (total // PAGE_SIZE) + (total % PAGE_SIZE > 0)
-    for page in range(0, n_pages):
-        r = session.get(SEARCH_URL, params={'start': page*PAGE_SIZE, 'q': query_string})
-        r.raise_for_status()
-        for course in r.json():
-            # Don't double count sublevels (e.g. preparation is a level & also incl under bachelor)
-            if course['level'] != lvl:
-                continue
+    for page in range(0, _n_pages(total)):
+        for course in _fetch_page(session, di, lvl, page):
             yield course
 
 
+def _ordered_map(func, iterable, n_workers, max_in_flight=None):
+    """Lazily map func over iterable using a bounded pool of worker threads,
+    yielding results in the same order as the inputs. With a single worker
+    this is exactly the builtin map, and no threads are started.
+
+    Args:
+        func (callable): Function of a single argument.
+        iterable (iterable): Arguments to map func over.
+        n_workers (int): Maximum number of concurrent calls to func.
+        max_in_flight (int): Maximum number of submitted but unconsumed calls.
+                             Defaults to 4*n_workers, which bounds memory use.
+    Yields:
+        result: func(item) for each item in iterable, in order.
+    """
+    if n_workers <= 1:
+        yield from map(func, iterable)
+        return
+    if max_in_flight is None:
+        max_in_flight = 4*n_workers
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        in_flight = deque()
+        for item in iterable:
+            in_flight.append(executor.submit(func, item))
+            if len(in_flight) >= max_in_flight:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
 def write_json(data, path_to_filename):
     """Write data to json at a given path.
 
@@ -112,10 +216,21 @@ def flush(courses, di, lvl, count):
         lvl (str): Degree level string (e.g. bachelor, master, etc)
         count (int): Count to label the output file with.
     """
-    path = f'{DATA_PATH}/{di}/{lvl}/'
-    if not os.path.exists(path):
-        os.makedirs(path)
-    write_json(courses[(di, lvl)], f'{path}/{di}-{lvl}-{count}.json')
+    JsonShardWriter(DATA_PATH).write(courses[(di, lvl)], di, lvl, count)
+
+
+def _tidy_course(course, discipline, boring_fields):
+    """Drop boring fields from course data (in place) and append discipline metadata."""
+    # Ignore boring fields
+    for field in boring_fields:
+        try:
+            course.pop(field)
+        except KeyError:
+            pass
+    # Append discipline metadata
+    course['discipline_title'] = discipline['discipline_title']
+    course['discipline_id'] = discipline['discipline_id']
+    return course
 
 
 def discover_courses(session, disciplines, boring_fields=("listing_type", "enhanced", "logo")):
@@ -140,24 +255,240 @@ def discover_courses(session, disciplines, boring_fields=("listing_type", "enhan
         for degree_level, count in discover_level_count(session, di):
             key = (di, degree_level)
             for course in _discover_courses(session, di, degree_level, count):
-                # Ignore boring fields
-                for field in boring_fields:
-                    try:
-                        course.pop(field)
-                    except KeyError:
-                        pass
-                # Append discipline metadata
-                course['discipline_title'] = d['discipline_title']
-                course['discipline_id'] = di
-                yield key, course
+                yield key, _tidy_course(course, d, boring_fields)
+
+
+def discover_buckets(session, disciplines, n_workers=1):
+    """Discover the course count for every (discipline, degree level) combination,
+    i.e. every bucket of courses that is crawled. Parent disciplines are ignored.
+
+    Args:
+        session (requests.Session or equivalent): session for making requests.
+        disciplines (list of dict): As returned from discover_disciplines.
+        n_workers (int): Maximum number of concurrent requests.
+    Returns:
+        buckets (list of tuple): (discipline, degree_level, count) for each bucket, where
+                                 discipline is the discipline metadata (dict).
+    """
+    disciplines = [d for d in disciplines if d['parent'] is not None]
+
+    def level_counts(d):
+        return list(discover_level_count(session, d['discipline_id']))
+
+    return [(d, degree_level, count)
+            for d, counts in zip(disciplines, _ordered_map(level_counts, disciplines, n_workers))
+            for degree_level, count in counts]
+
+
+def discover_course_pages(session, disciplines, boring_fields=("listing_type", "enhanced", "logo"),
+                          n_workers=1, start_pages=None, buckets=None):
+    """
+    Discover all courses on study portal, page by page. Pages are fetched by up to
+    n_workers concurrent requests, both within and across (discipline, level) pairs,
+    but are always yielded in the same order as the serial crawl.
+
+    Args:
+        session (requests.Session or equivalent): session for making requests.
+                                                  Must be safe to share between threads
+                                                  if n_workers > 1.
+        disciplines (list of dict): As returned from discover_disciplines.
+        boring_fields (tuple): Iterable of keys to ignore in the course data.
+        n_workers (int): Maximum number of concurrent requests.
+        start_pages (dict): Optional look-up of (discipline id, degree level) --> first page to
+                            fetch, for skipping pages which have already been processed.
+                            A value of None skips that (discipline id, degree level) entirely.
+        buckets (list of tuple): As returned from discover_buckets, if already known.
+    yields:
+        (key, page, courses) (tuple, int, list): A composite key indicating the discipline id
+                                                 and degree level, the page number, and the
+                                                 rawish course data (as for discover_courses)
+                                                 for each course on that page.
+    """
+    if start_pages is None:
+        start_pages = {}
+    if buckets is None:
+        # The level counts are cheap (one request per discipline) so collect them up front
+        buckets = discover_buckets(session, disciplines, n_workers)
+
+    def fetch(job):
+        d, degree_level, page = job
+        courses = _fetch_page(session, d['discipline_id'], degree_level, page)
+        return job, [_tidy_course(course, d, boring_fields) for course in courses]
+
+    jobs = ((d, degree_level, page)
+            for d, degree_level, count in buckets
+            if start_pages.get((d['discipline_id'], degree_level), 0) is not None
+            for page in range(start_pages.get((d['discipline_id'], degree_level), 0), _n_pages(count)))
+    for (d, degree_level, page), courses in _ordered_map(fetch, jobs, n_workers):
+        yield (d['discipline_id'], degree_level), page, courses
+
+
+def fingerprint_bucket(session, di, lvl, count):
+    """Summarise the current state of a (discipline, degree level) bucket, for
+    detecting changes between crawls: the course count, and the course ids on
+    the first and last pages.
+
+    Args:
+        session (requests.Session or equivalent): session for making requests.
+        di (int): Discipline id number.
+        lvl (str): Degree level string (e.g. bachelor, master, etc)
+        count (int): The total number of courses for this combination of (di, lvl).
+    Returns:
+        fingerprint (dict): Course count, and first and last page course ids.
+    """
+    last_page = _n_pages(count) - 1
+    first_ids = [course['id'] for course in _fetch_page(session, di, lvl, 0)] if count else []
+    if last_page > 0:
+        last_ids = [course['id'] for course in _fetch_page(session, di, lvl, last_page)]
+    else:
+        last_ids = first_ids
+    return {'count': count, 'first_ids': first_ids, 'last_ids': last_ids}
+
+
+def changed_buckets(session, buckets, manifest, n_workers=1):
+    """Compare the current state of each bucket with a manifest from a previous crawl.
+
+    Args:
+        session (requests.Session or equivalent): session for making requests.
+        buckets (list of tuple): As returned from discover_buckets.
+        manifest (dict): Look-up of 'di/lvl' --> fingerprint, from a previous crawl.
+        n_workers (int): Maximum number of concurrent requests.
+    Returns:
+        changed, new_manifest (set, dict): The (discipline id, degree level) keys of
+                                           buckets which are new or have changed,
+                                           and the manifest for the current state.
+    """
+    def fingerprint(bucket):
+        d, degree_level, count = bucket
+        return fingerprint_bucket(session, d['discipline_id'], degree_level, count)
+
+    changed, new_manifest = set(), {}
+    for (d, degree_level, _), fp in zip(buckets, _ordered_map(fingerprint, buckets, n_workers)):
+        name = f"{d['discipline_id']}/{degree_level}"
+        if fp != manifest.get(name):
+            changed.add((d['discipline_id'], degree_level))
+        new_manifest[name] = fp
+    return changed, new_manifest
+
+
+def journal_path():
+    """Path to the checkpoint journal, which lives next to DATA_PATH."""
+    return f'{os.path.normpath(DATA_PATH)}.journal.jsonl'
+
+
+def cube_journal_path():
+    """Path to the journal of course counts for the cube (see eis.data.course_cube),
+    which lives next to DATA_PATH."""
+    return f'{os.path.normpath(DATA_PATH)}.cube.jsonl'
+
+
+def append_json_lines(records, path_to_filename):
+    """Durably append records to a file, one line of json per record.
+
+    Args:
+        records (list of json-like): Records to append.
+        path_to_filename (str): Path to the filename, including the filename.
+    """
+    with open(path_to_filename, 'a') as f:
+        f.write(''.join(json.dumps(record) + '\n' for record in records))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_json_lines(path_to_filename):
+    """Read all complete records from a file written by append_json_lines.
+
+    Args:
+        path_to_filename (str): Path to the filename, including the filename.
+    Yields:
+        record (json-like): Records, in the order they were written. A truncated
+                            final record (i.e. from a crash mid-write) is ignored.
+    """
+    if not os.path.exists(path_to_filename):
+        return
+    with open(path_to_filename) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                break
+
+
+def append_journal(record):
+    """Durably append a record to the checkpoint journal.
+
+    Args:
+        record (dict): Checkpoint record.
+    """
+    append_json_lines([record], journal_path())
+
+
+def read_journal():
+    """Read all complete records from the checkpoint journal.
+
+    Returns:
+        records (list of dict): Checkpoint records, in the order they were written.
+    """
+    return list(read_json_lines(journal_path()))
+
+
+def course_store_path():
+    """Path to the deduplicated course store, which holds each course only once."""
+    return f'{DATA_PATH}/course_store.jsonl'
+
+
+def read_course_store():
+    """Read the deduplicated course store, written by download_courses(dedup=True).
+
+    Returns:
+        courses (dict): Look-up of course id --> course data, where the discipline
+                        fields have been dropped in favour of the look-up tables.
+                        Where a course has been stored more than once
+                        (i.e. by an incremental crawl) the latest is kept.
+    """
+    return {course['id']: course for course in read_json_lines(course_store_path())}
+
+
+def manifest_path():
+    """Path to the manifest of bucket fingerprints from the last complete crawl."""
+    return f'{DATA_PATH}/crawl_manifest.json'
+
+
+def read_json(path_to_filename):
+    """Read json data from a given path.
+
+    Args:
+        path_to_filename (str): Path to the filename, including the filename.
+    Returns:
+        data (json-like): Data read from json.
+    """
+    with open(path_to_filename) as f:
+        return json.load(f)
+
+
+def load_shard_ids(path_to_filename):
+    """Read the course ids from a course file written by flush.
+
+    Args:
+        path_to_filename (str): Path to the filename, including the filename.
+    Returns:
+        ids (list of int): Course ids in this file.
+    """
+    if path_to_filename.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        return pq.read_table(path_to_filename, columns=['id'])['id'].to_pylist()
+    return [course if type(course) is int else course['id']  # Deduplicated files only have ids
+            for course in read_json(path_to_filename)]
 
 
 def standardise_ddsl(ddsl):
-    """Converts defauldict(SortedList) to dict of list, ready for json serialization"""
+    """Converts a look-up of key --> sequence of values (e.g. array('q') of ids, or tuples)
+    to a dict of lists, ready for json serialization"""
     return {k: list(v) for k, v in ddsl.items()}
 
 
-def download_courses(flush_count=1000):
+def download_courses(flush_count=1000, n_workers=1, resume=False, incremental=False, dedup=False,
+                     lookup_json=True, shard_writer=None, cache=None, cube=False):
     """Downloads all studyportal course data to the global DATA_PATH path,
     including metadata for convenience analysis of course data. The output
     directory structure under DATA_PATH/courses will look like:
@@ -189,47 +520,221 @@ def download_courses(flush_count=1000):
     2) course_discipline_lookup.json: Look-up table of course_id --> [discipline ids]
     3) discipline_course_lookup.json: Look-up table of discipline_id --> [course ids]
 
+    The look-up tables are also saved, far more compactly, in both directions
+    as course_discipline_index.npz (see CourseDisciplineIndex.load), in which
+    case the json files can be skipped with lookup_json=False.
+
+    The batches of courses can instead be written in other formats by passing a
+    shard_writer from eis.data.course_shards, e.g. ParquetShardWriter for a
+    Parquet dataset partitioned by discipline and level.
+
+    Pages are fetched by up to n_workers concurrent requests. The output is
+    identical for any value of n_workers.
+
+    Every file written is recorded, along with the (page, offset) position
+    reached in its (discipline id, degree level) crawl, in a checkpoint journal
+    next to DATA_PATH (see journal_path). With resume=True, pages which have
+    already been flushed are skipped and the look-up tables are rebuilt from
+    the files already on disk, so that a failed crawl can be picked up where
+    it left off.
+
+    A manifest of every (discipline id, degree level) bucket's course count,
+    and of the course ids on its first and last pages, is also saved at the
+    end of each crawl. With incremental=True, only buckets which have changed
+    since the manifest was saved are crawled again, and their files are merged
+    into the existing output.
+
+    With dedup=True, each course is instead stored only once, in
+    course_store.jsonl (see read_course_store), without its discipline fields,
+    and the files under each discipline hold only the course ids.
+
+    With cube=True, the number of courses by discipline, level, country and
+    digital skill is also counted, and saved as course_cube.npz (see
+    eis.data.course_cube). The courses in each file (their ids, countries and
+    tags) are noted in a journal next to DATA_PATH as the file is written, so
+    that the counts survive resumed and incremental crawls.
+
     Args:
         flush_count (int): Maximum number of courses in any file saved to disk.
+        n_workers (int): Maximum number of concurrent requests to studyportal.
+        resume (bool): Resume from the checkpoint journal of a previous run,
+                       which must have used the same flush_count.
+        incremental (bool): Only crawl buckets which have changed since the last crawl,
+                            which must have used the same flush_count.
+        dedup (bool): Store each course only once, rather than once per discipline.
+        lookup_json (bool): Also save the look-up tables as json.
+        shard_writer (object): Writer for the batches of courses, see eis.data.course_shards.
+                               Defaults to JsonShardWriter(DATA_PATH).
+        cache (DiskCache or cachecontrol cache): Response cache, see make_session.
+        cube (bool): Also count the courses by discipline, level, country and digital skill.
     """
     if not os.path.exists(DATA_PATH):
         raise OSError(f'Output path {DATA_PATH} does not exist')
-
-    session = cachecontrol.CacheControl(requests.Session())
-    disciplines = discover_disciplines(session, BACHELOR_DISCIPLINES_URL)
+    if cube and dedup:
+        raise ValueError('cube=True needs the full courses in each file, so cannot be used with dedup=True')
+
+    if shard_writer is None:
+        shard_writer = JsonShardWriter(DATA_PATH)
+    if cube:
+        from eis.data.course_cube import CubeShardWriter
+        from eis.transformers.digital_skills import KeywordMatcher, read_taxonomy
+        shard_writer = CubeShardWriter(shard_writer, cube_journal_path(), KeywordMatcher(read_taxonomy()),
+                                       reset=not (resume or incremental))
+    session = make_session(cache)
+    with metrics.stage('courses.disciplines'):
+        disciplines = discover_disciplines(session, BACHELOR_DISCIPLINES_URL)
+    with metrics.stage('courses.buckets'):
+        buckets = discover_buckets(session, disciplines, n_workers)
 
     # Output containers
     courses = defaultdict(list)  # Flushable course container
     course_count = defaultdict(int)  # Count of all courses, for book-keeping
-    course_discipline_lookup = defaultdict(SortedList)  # Course-discipline look-up
-    discipline_course_lookup = defaultdict(SortedList)  # ...and the reverse look-up
-    for (di, lvl), course in discover_courses(session, disciplines):
-        key = (di, lvl)
-        ci = course['id']
-        courses[key].append(course)
-        course_discipline_lookup[ci].add(di)
-        discipline_course_lookup[di].add(ci)
-        # Flush if threshold count is reached
-        if len(courses[key]) == flush_count:
-            course_count[key] += flush_count
-            flush(courses, di, lvl, course_count[key])
-            del courses[key]  # Now we've flushed, free up some memory
-    # Flush remaining collections of courses that never went over flush threshold
-    for (di, lvl) in courses:
-        key = (di, lvl)
-        flush(courses, di, lvl, course_count[key] + flush_count)
-        del courses[key]  # Not really necessary, but not unnecessary
-
-    # Reformat defaultdict(SortedList) ready for json serialization
-    course_discipline_lookup = standardise_ddsl(course_discipline_lookup)
-    discipline_course_lookup = standardise_ddsl(discipline_course_lookup)
+    course_ids, discipline_ids = array('q'), array('q')  # (course, discipline) pairs for the look-ups
+    start_pages = {}  # First page to fetch, for resumed (di, lvl)
+    offsets = {}  # Number of courses already flushed from that first page
+    manifest = {}  # Bucket fingerprints, for the next incremental crawl
+    stored = set()  # Ids of courses in the course store
+    unstored = defaultdict(list)  # New courses for the course store, flushed with their ids
+
+    # Pick up from the checkpoint journal, or start a new one
+    records = read_journal() if resume else []
+    if not resume:
+        open(journal_path(), 'w').close()
+    if dedup and resume:
+        stored.update(read_course_store())
+    elif dedup and not incremental:
+        open(course_store_path(), 'w').close()
+    for record in records:
+        key = (record['di'], record['lvl'])
+        if 'shard' in record:
+            ids = load_shard_ids(f"{DATA_PATH}/{record['shard']}")
+            course_ids.extend(ids)
+            discipline_ids.extend([record['di']]*len(ids))
+        if record.get('done'):
+            start_pages[key] = None
+        else:
+            course_count[key] = record['count']
+            start_pages[key] = record['page']
+            offsets[key] = record['offset']
+
+    # Skip unchanged buckets, and clear out any others which haven't been started yet
+    if incremental:
+        previous_manifest = read_json(manifest_path()) if os.path.exists(manifest_path()) else {}
+        changed, manifest = changed_buckets(session, buckets, previous_manifest, n_workers)
+        for name in previous_manifest.keys() - manifest.keys():
+            di, lvl = name.split('/')
+            shard_writer.remove(int(di), lvl)
+        for d, lvl, _ in buckets:
+            di = d['discipline_id']
+            key = (di, lvl)
+            if key in start_pages:
+                continue  # Already (re)crawled according to the journal
+            if key in changed:
+                shard_writer.remove(di, lvl)
+                continue
+            start_pages[key] = None
+            for shard in shard_writer.shards(di, lvl):
+                ids = load_shard_ids(shard)
+                course_ids.extend(ids)
+                discipline_ids.extend([di]*len(ids))
+
+    def write(key, count):
+        """Write the courses for this (di, lvl) to a file, and free up the memory"""
+        # Make sure that all courses in the file are in the store before writing it
+        if dedup:
+            append_json_lines(unstored.pop(key, []), course_store_path())
+        metrics.observe('courses.flush_size', len(courses[key]), SIZE_BUCKETS)
+        return shard_writer.write(courses.pop(key), key[0], key[1], count)
+
+    def checkpoint(key, count, page, offset):
+        """Flush, and then record the file and crawl progress in the journal"""
+        shard = write(key, count)
+        if shard_writer.durable:
+            append_journal({'di': key[0], 'lvl': key[1], 'count': count,
+                            'shard': shard, 'page': page, 'offset': offset})
+
+    def finish(key):
+        """Flush the remaining courses that never went over flush threshold"""
+        record = {'di': key[0], 'lvl': key[1], 'done': True}
+        if courses.get(key):
+            record['shard'] = write(key, course_count[key] + flush_count)
+            course_count[key] += flush_count  # In case (di, lvl) is ever crawled again
+        # Some writers only complete a file when (di, lvl) is finished
+        shard = shard_writer.finish(*key)
+        if shard is not None:
+            record['shard'] = shard
+        append_journal(record)
+
+    with metrics.stage('courses.crawl') as crawl_stage:
+        current_key = None
+        n_pages, n_courses = 0, 0
+        counts = {(d['discipline_id'], lvl): count for d, lvl, count in buckets}
+        crawl = discover_course_pages(session, disciplines, n_workers=n_workers,
+                                      start_pages=start_pages, buckets=buckets)
+        for key, page, page_courses in crawl:
+            n_pages += 1
+            n_courses += len(page_courses)
+            metrics.incr('courses.pages')
+            metrics.incr('courses.courses', len(page_courses))
+            # Note the bucket fingerprint as we go, rather than re-requesting the pages later
+            if not incremental:
+                fingerprint = manifest.setdefault(f'{key[0]}/{key[1]}', {'count': counts[key]})
+                if page == 0:
+                    fingerprint['first_ids'] = [course['id'] for course in page_courses]
+                if page == _n_pages(counts[key]) - 1:
+                    fingerprint['last_ids'] = [course['id'] for course in page_courses]
+            # Pages arrive in order, so (di, lvl) is finished once the key changes
+            if key != current_key:
+                if current_key is not None:
+                    finish(current_key)
+                current_key = key
+            di, lvl = key
+            for offset in range(offsets.pop(key, 0), len(page_courses)):
+                course = page_courses[offset]
+                ci = course['id']
+                if dedup:
+                    if ci not in stored:
+                        stored.add(ci)
+                        unstored[key].append({k: v for k, v in course.items()
+                                              if k not in ('discipline_title', 'discipline_id')})
+                    course = ci
+                courses[key].append(course)
+                course_ids.append(ci)
+                discipline_ids.append(di)
+                # Flush if threshold count is reached
+                if len(courses[key]) == flush_count:
+                    course_count[key] += flush_count
+                    checkpoint(key, course_count[key], page=page, offset=offset + 1)
+        if current_key is not None:
+            finish(current_key)
+        shard_writer.close()
+    metrics.gauge('courses.pages_per_second', n_pages/crawl_stage['wall_seconds'])
+    metrics.gauge('courses.courses_per_second', n_courses/crawl_stage['wall_seconds'])
+
+    # Fill in the fingerprints of any buckets that weren't seen in full (i.e. due to resuming)
+    for d, lvl, count in buckets:
+        name = f"{d['discipline_id']}/{lvl}"
+        if not {'first_ids', 'last_ids'} <= manifest.get(name, {}).keys():
+            manifest[name] = fingerprint_bucket(session, d['discipline_id'], lvl, count)
 
     # Save the handy lookup tables
-    write_json(course_discipline_lookup, f'{DATA_PATH}/course_discipline_lookup.json')
-    write_json(discipline_course_lookup, f'{DATA_PATH}/discipline_course_lookup.json')
+    with metrics.stage('courses.lookups'):
+        index = CourseDisciplineIndex(course_ids, discipline_ids)
+        index.save(f'{DATA_PATH}/course_discipline_index.npz')
+        if lookup_json:
+            course_discipline_lookup, discipline_course_lookup = index.to_lookups()
+            write_json(course_discipline_lookup, f'{DATA_PATH}/course_discipline_lookup.json')
+            write_json(discipline_course_lookup, f'{DATA_PATH}/discipline_course_lookup.json')
     write_json(disciplines, f'{DATA_PATH}/discipline_dictionary.json')
+    if cube:
+        shard_writer.cube(disciplines).save(f'{DATA_PATH}/course_cube.npz')
+    write_json(manifest, manifest_path())
 
 
 if __name__ == '__main__':
     # Example of how to run this script...
-    download_courses()
+    eis.setup_logging()
+    try:
+        download_courses(n_workers=8)
+    finally:
+        metrics.write_summary('download_courses')
@@ -0,0 +1,211 @@
+from functools import wraps
+from urllib.parse import urlparse
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from cachecontrol.adapter import CacheControlAdapter
+
+from eis.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 6
+BACKOFF = 1.0  # Base backoff in seconds, doubled on each retry
+MAX_BACKOFF = 120.0
+
+
+class Throttle:
+    """Token-bucket rate limiter with a cap on concurrent requests, which adapts
+    its rate to the responses: the rate is halved whenever the server pushes back
+    (e.g. with 429 or 5xx) or responses are slower than target_latency, and
+    otherwise creeps back up (additive increase, multiplicative decrease).
+
+    Use as a context manager around each request, and report the outcome with
+    success or backoff.
+
+    Args:
+        rate (float): Initial rate, in requests per second.
+        min_rate (float): Lowest rate to back off to.
+        max_rate (float): Highest rate to increase to.
+        max_concurrency (int): Maximum number of requests in flight.
+        target_latency (float): Back off if responses take longer than this (seconds).
+        increase (float): Rate increase (requests per second) per successful request.
+    """
+    def __init__(self, rate=5.0, min_rate=0.1, max_rate=50.0, max_concurrency=8,
+                 target_latency=10.0, increase=0.05):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.target_latency = target_latency
+        self.increase = increase
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()  # When the next token is available
+        self._paused_until = 0.0
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        self.wait()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._semaphore.release()
+
+    def wait(self):
+        """Block until the next request is allowed."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now, self._paused_until)
+            self._next_slot = slot + 1/self.rate
+        time.sleep(max(0.0, slot - now))
+
+    def success(self, latency=None):
+        """Report a successful request, and its latency (seconds)."""
+        with self._lock:
+            if latency is not None and self.target_latency is not None and latency > self.target_latency:
+                self.rate = max(self.min_rate, self.rate/2)
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def backoff(self, retry_after=None):
+        """Report that the server pushed back, optionally with a Retry-After (seconds)."""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate/2)
+            if retry_after is not None:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        logger.debug(f'Backing off to {self.rate:.2f} requests per second')
+
+
+# Throttles are shared by everything in the process which hits the same host
+_throttles = {}
+_throttles_lock = threading.Lock()
+HOST_SETTINGS = {'search.prtl.co': {'rate': 10.0, 'max_concurrency': 16},
+                 'search-facets.prtl.co': {'rate': 10.0, 'max_concurrency': 16},
+                 'ec.europa.eu': {'rate': 2.0, 'max_concurrency': 4}}
+
+
+def get_throttle(host):
+    """The shared Throttle for this host, with settings from HOST_SETTINGS."""
+    with _throttles_lock:
+        if host not in _throttles:
+            _throttles[host] = Throttle(**HOST_SETTINGS.get(host, {}))
+        return _throttles[host]
+
+
+def backoff_delay(attempt, base=BACKOFF, cap=MAX_BACKOFF):
+    """Exponential backoff with full jitter, for the given retry attempt (counting from 0)."""
+    return random.uniform(0, min(cap, base*2**attempt))
+
+
+def _retry_after(response):
+    """Retry-After header in seconds, if given as such"""
+    try:
+        return float(response.headers['Retry-After'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _is_transient(exception):
+    """Whether an exception from a request is worth retrying"""
+    if isinstance(exception, requests.HTTPError):
+        return exception.response is not None and exception.response.status_code in RETRY_STATUSES
+    return isinstance(exception, (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError))
+
+
+class ThrottledAdapter(HTTPAdapter):
+    """Transport adapter which sends every request through the shared Throttle for its
+    host, retrying transient failures (connection errors, timeouts and RETRY_STATUSES)
+    with jittered exponential backoff. After the last retry the last response is returned,
+    or the last exception raised.
+
+    Args:
+        retries (int): Maximum number of retries per request.
+        *args, **kwargs: As for requests.adapters.HTTPAdapter
+    """
+    def __init__(self, *args, retries=MAX_RETRIES, **kwargs):
+        self.retries = retries
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, *args, **kwargs):
+        host = urlparse(request.url).netloc
+        throttle = get_throttle(host)
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            with throttle:
+                start = time.monotonic()
+                metrics.incr(f'http.{host}.requests')
+                try:
+                    response = super().send(request, *args, **kwargs)
+                    if not kwargs.get('stream'):
+                        # Read the body now (as requests would), so that it is in the latency and size
+                        metrics.incr(f'http.{host}.bytes', len(response.content))
+                except (requests.ConnectionError, requests.Timeout) as exception:
+                    metrics.incr(f'http.{host}.errors')
+                    throttle.backoff()
+                    if last_attempt:
+                        raise
+                    metrics.incr(f'http.{host}.retries')
+                    logger.warning(f'Retrying {request.url} after {exception!r}')
+                else:
+                    latency = time.monotonic() - start
+                    metrics.observe(f'http.{host}.latency', latency)
+                    if response.status_code not in RETRY_STATUSES:
+                        throttle.success(latency)
+                        return response
+                    metrics.incr(f'http.{host}.status_{response.status_code}')
+                    throttle.backoff(_retry_after(response))
+                    if last_attempt:
+                        return response
+                    metrics.incr(f'http.{host}.retries')
+                    logger.warning(f'Retrying {request.url} after status {response.status_code}')
+                    response.close()
+            time.sleep(backoff_delay(attempt))
+
+
+class CachedThrottledAdapter(CacheControlAdapter, ThrottledAdapter):
+    """As for ThrottledAdapter, but serving responses from the cachecontrol cache
+    where possible, so that cached responses are never throttled."""
+
+
+def throttled(host, retries=MAX_RETRIES):
+    """Decorator for sending a function which makes requests (i.e. from a third party
+    package) through the shared Throttle for host, retrying transient failures with
+    jittered exponential backoff.
+
+    Args:
+        host (str): Host to share a Throttle with.
+        retries (int): Maximum number of retries per call.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            throttle = get_throttle(host)
+            for attempt in range(retries + 1):
+                with throttle:
+                    start = time.monotonic()
+                    metrics.incr(f'http.{host}.requests')
+                    try:
+                        result = func(*args, **kwargs)
+                    except Exception as exception:
+                        metrics.incr(f'http.{host}.errors')
+                        if not _is_transient(exception):
+                            raise
+                        response = getattr(exception, 'response', None)
+                        throttle.backoff(None if response is None else _retry_after(response))
+                        if attempt == retries:
+                            raise
+                        metrics.incr(f'http.{host}.retries')
+                        logger.warning(f'Retrying {func.__name__}{args!r} after {exception!r}')
+                    else:
+                        latency = time.monotonic() - start
+                        metrics.observe(f'http.{host}.latency', latency)
+                        throttle.success(latency)
+                        return result
+                time.sleep(backoff_delay(attempt))
+        return wrapper
+    return decorator
@@ -1,17 +1,94 @@
-import eurostat
 import eis
 import yaml
-import ratelim
-import time
-from eis.utils.data_processing import flatten_list
+import argparse
+import json
 import logging
 import os
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from eis.data.cache import DAY, DiskCache, memoize
+from eis.data.dic_store import DicStore, structure_changed
+from eis.data.toc_index import TocIndex, load_toc_index
+from eis.metrics import metrics
 
 project_dir = eis.project_dir 
 
 target_dir = f'{project_dir}/data/raw/eurostat'
 
-def make_eurostat_table(code,toc_df,path=target_dir):
+#Responses from the eurostat API are cached on disk, with a time-to-live (seconds) per function
+cache_ttls = {'eurostat:get_toc_df': DAY,
+              'eurostat:get_data_df': 7*DAY,
+              'eurostat:dic': None}
+
+cache = DiskCache(ttls=cache_ttls)
+
+#Calls which miss the cache are rate limited and retried
+eurostat_host = 'ec.europa.eu'
+
+#Base URL of a stand-in for the eurostat API (see eis.data.replay), e.g. for running offline
+eurostat_url = os.environ.get('EIS_EUROSTAT_URL')
+
+#Output formats for the melted tables (the schemas are always yaml)
+output_formats = ['csv','parquet']
+
+def throttled_eurostat(name):
+    '''
+    Gets a function from the eurostat package, rate limited and retried. The package
+    (and pandas) are only imported when first needed, so that importing this module is cheap
+
+    Args:
+        name (str) is the name of the function, e.g. get_data_df
+
+    '''
+    import eurostat
+    from eis.data.fetch import throttled
+
+    if eurostat_url:
+        use_eurostat_url(eurostat_url)
+    return(throttled(eurostat_host)(getattr(eurostat,name)))
+
+
+def use_eurostat_url(url):
+    '''
+    Points the eurostat package at a stand-in for its API, which serves
+    https://ec.europa.eu/... at {url}/ec.europa.eu/... (see eis.data.replay.proxied_url)
+
+    Args:
+        url (str) is the base URL of the stand-in
+
+    '''
+    from eurostat.eurostat import __Uri__
+    from eis.data.replay import proxied_url
+
+    for urls in (__Uri__.BASE_URL,__Uri__.BASE_ASYNC_URL):
+        for provider,base in urls.items():
+            if not base.startswith(url):
+                urls[provider] = proxied_url(base,url)
+
+
+@memoize(cache, 'eurostat')
+def get_toc_df():
+    '''Gets the eurostat table of contents'''
+    return(throttled_eurostat('get_toc_df')())
+
+
+@memoize(cache, 'eurostat')
+def get_data_df(code):
+    '''Gets a eurostat table'''
+    return(throttled_eurostat('get_data_df')(code))
+
+
+def get_dic(col):
+    '''Gets the eurostat dictionary for a dimension'''
+    return(throttled_eurostat('get_dic')(col))
+
+
+#Dictionaries are shared by most tables, so they are downloaded once and kept until the
+#table of contents shows a structure change
+dic_store = DicStore(get_dic, cache)
+
+def make_eurostat_table(code,toc_df,path=target_dir,toc_index=None):
     '''
 
     This function extracts and saves a eurostat table with a readable name together with 
@@ -21,45 +98,158 @@ def make_eurostat_table(code,toc_df,path=target_dir):
         code (str) is the code for the table
         toc_df (df) is a dataframe with a table of contents (we use it to create the schema)
         path (str) is the destination for storing data and schema
+        toc_index (dict) is an index of toc_df from index_toc (optional, built if not given)
     
     '''
+    if toc_index is None:
+        toc_index = index_toc(toc_df)
+
     try:
-        table = eurostat.get_data_df(code)
+        table = get_data_df(code)
     
-        if 'time\geo' in table.columns:
+        transform_table(table,code,toc_df.iloc[toc_index.get(code,[])],[path])
+            
+    except Exception:
+        #A small number of eurostat tables don't work with this package.
+        logging.exception(f'{code}: API failure')
+        metrics.incr('eurostat.tables_failed')
 
-            struct_name = 'time\geo'
-            melt_var_name = 'geo'
 
-            meta_cols = [x for x in table.columns if ((len(x)>2)&(not any(name in x for name in 
-                                                                      ['EU','EA'])))]
+def table_structure(table):
+    '''
+    Works out how a wide eurostat table is laid out
 
-        else:
-            struct_name = 'geo\\time'
-            melt_var_name = 'time'
+    Args:
+        table (df) is the table as returned by eurostat.get_data_df
+
+    Returns:
+        struct_name (str), melt_var_name (str), meta_cols (list) where struct_name is the
+            name of the variable telling us whether the columns have years or countries,
+            melt_var_name is the name of the variable in the other columns and meta_cols
+            are the columns which are kept when melting
+
+    '''
+    if 'time\\geo' in table.columns:
 
-            meta_cols = [x for x in table.columns if type(x)!=int]
+        struct_name = 'time\\geo'
+        melt_var_name = 'geo'
 
-        table_long = table.melt(id_vars=meta_cols,
-                                    var_name=melt_var_name,
-                                    value_name=code)
+        meta_cols = [x for x in table.columns if ((len(x)>2)&(not any(name in x for name in 
+                                                                  ['EU','EA'])))]
 
-        #Create schema
+    else:
+        struct_name = 'geo\\time'
+        melt_var_name = 'time'
+
+        meta_cols = [x for x in table.columns if type(x)!=int]
+
+    return(struct_name,melt_var_name,meta_cols)
+
+
+def download_table(code,toc_rows):
+    '''
+    Downloads a eurostat table and the dictionaries for its dimensions, so that it can be
+    transformed without any further requests (i.e. in a worker process)
+
+    Args:
+        code (str) is the code for the table
+        toc_rows (df) are the rows of the table of contents for the table
+
+    Returns:
+        table (df), dics (dict) where dics maps each dimension of the table to its dictionary
+
+    '''
+    table = get_data_df(code)
+
+    struct_name,_,meta_cols = table_structure(table)
+
+    changed = structure_changed(toc_rows)
+
+    dics = {col:dic_store.get(col,changed) for col in meta_cols if col not in [code,struct_name]}
+
+    return(table,dics)
+
+
+def melt_table(table,code):
+    '''
+    Melts a wide eurostat table (with either years or countries as columns) into long format
+
+    Args:
+        table (df) is the table as returned by eurostat.get_data_df
+        code (str) is the code for the table (used as the name of the value column)
+
+    Returns:
+        table_long (df), struct_name (str), melt_var_name (str) where struct_name is the
+            name of the variable telling us whether the columns have years or countries
+            and melt_var_name is the name of the variable that we have melted
+
+    '''
+    struct_name,melt_var_name,meta_cols = table_structure(table)
 
-        sch= make_schema(table_long,code,toc_df,struct_name,melt_var_name)
+    table_long = table.melt(id_vars=meta_cols,
+                                var_name=melt_var_name,
+                                value_name=code)
 
-        #Save table and schema
-        table_long.to_csv(f'{path}/{code}.csv',index=False)
+    return(table_long,struct_name,melt_var_name)
+
+
+def transform_table(table,code,toc_df,paths,output_format='csv',dics=None):
+    '''
+    Melts a eurostat table, creates its schema and saves both (as csv or parquet, and yaml)
+    in each of the destination paths. Only the rows of toc_df for this code are needed.
+
+    Args:
+        table (df) is the table as returned by eurostat.get_data_df
+        code (str) is the code for the table
+        toc_df (df) is a dataframe with a table of contents (we use it to create the schema)
+        paths (list) are the destinations for storing data and schema
+        output_format (str) is one of output_formats
+        dics (dict) maps each dimension of the table to its dictionary (optional, otherwise
+            they are got from dic_store)
+
+    '''
+    table_long,struct_name,melt_var_name = melt_table(table,code)
+
+    #Create schema
+
+    sch= make_schema(table_long,code,toc_df,struct_name,melt_var_name,dics=dics)
+
+    if output_format=='parquet':
+        #Parquet tables are typed panels (see eis.data.panel_store)
+        from eis.data.panel_store import to_panel, write_panel
+
+        panel = to_panel(table_long,code)
+
+    #Save table and schema
+    for path in paths:
+
+        if output_format=='parquet':
+            write_panel(panel,code,path)
+        else:
+            table_long.to_csv(f'{path}/{code}.csv',index=False)
 
         with open(f'{path}/{code}.yaml','w') as outfile:
             yaml.dump(sch,outfile)
-            
-    except:
-        #A small number of eurostat tables don't work with this package.
-        print('   API failure')
+
+    return(code)
 
 
-def make_schema(table,code,toc_df,struct_name,melt_var_name):
+def index_toc(toc_df):
+    '''
+    Indexes the table of contents by code, so that the rows for a table can be found
+    without scanning the whole table of contents
+
+    Args:
+        toc_df (df) is the table of contents df
+
+    Returns:
+        toc_index (dict) mapping each code to the positions of its rows in toc_df
+
+    '''
+    return(toc_df.groupby('code',sort=False).indices)
+
+
+def make_schema(table,code,toc_df,struct_name,melt_var_name,toc_index=None,dics=None):
     '''
     Creates a schema for a table. The schema contains some basic information about
     the table from the toc df and the data dict for all relevant columns.
@@ -72,8 +262,12 @@ def make_schema(table,code,toc_df,struct_name,melt_var_name):
             years or countries
         melt_var_name (str) is the name of the variable that we have melted (could be country
             or year)
+        toc_index (dict) is an index of toc_df from index_toc (optional, to avoid scanning it)
+        dics (dict) maps each dimension of the table to its dictionary (optional, otherwise
+            they are got from dic_store)
         
     '''
+    import pandas as pd
     
     #Create schema
     
@@ -82,88 +276,435 @@ def make_schema(table,code,toc_df,struct_name,melt_var_name):
     sch['schema'] = {}
     
     #Add metadata from table of contents
-    metadata = toc_df.loc[toc_df['code']==code].to_dict()
-    
-    for k,v in metadata.items():
+    if toc_index is None:
+        toc_rows = toc_df.loc[toc_df['code']==code]
+    else:
+        toc_rows = toc_df.iloc[toc_index.get(code,[])]
+
+    for k,v in toc_rows.to_dict().items():
         
         sch[k] = v
     
-    #Add category codes from df columns
+    changed = structure_changed(toc_rows)
+
+    #Add category codes from df columns. Each column is reduced to its unique values once
     for col in table.columns:
         
         if col not in [code,struct_name,melt_var_name]:
             
             #The dict considers all potential values for a variable. We focus on those
             #that are actually present
-            potential_values = eurostat.get_dic(col)
+            potential_values = dic_store.get(col,changed) if dics is None else dics[col]
             
-            actual_values = set(potential_values.keys()) & set(table[col])        
-            actual_dict = {k:v for k,v in potential_values.items() if k in actual_values}
+            actual_dict = {k:potential_values[k] for k in pd.unique(table[col]).tolist()
+                           if k in potential_values}
             
             sch['schema'][col] = actual_dict
             
-        sch['schema'][melt_var_name] = list(set(table[melt_var_name]))
+    sch['schema'][melt_var_name] = list(set(pd.unique(table[melt_var_name]).tolist()))
         
-        sch['schema'][struct_name.split('\\')[0]] = list(set(table[struct_name]))
+    sch['schema'][struct_name.split('\\')[0]] = list(set(pd.unique(table[struct_name]).tolist()))
         
     return(sch)
-    
-def collect_data_for_topic(toc_df,keywords,target_path,delay=0.5):
+
+
+def topic_codes(toc_df,keywords,toc_index=None):
+    '''
+    Finds the codes of the datasets for a topic (based on whether a keyword appears on it)
+
+    Args:
+        toc_df (df) is the table of contents df
+        keywords (list) is a list of keywords to query
+        toc_index (TocIndex) is a keyword index of toc_df (optional, built if not given)
+
+    Returns:
+        codes (set) of dataset codes
+
+    '''
+    if toc_index is None:
+        toc_index = TocIndex(toc_df)
+
+    return(toc_index.search(keywords))
+
+
+def collect_data_for_topic(toc_df,keywords,target_path):
     '''
     Collects data for a topic (based on whether a keyword appears on it)
     
     Args:
         toc_df (df) is the table of contents df
         keywords (list) is a list of keywords to query 
-        delay (float) is the second delay in queries that we introduce
-        target ()
+        target_path (str) is the destination for storing data and schemas
     
     '''
-    codes = []
-    
-    for k in keywords:
-        
-        data_codes = [x['code'] 
-                     for rid,x in eurostat.subset_toc_df(
-                         toc_df,k).iterrows() if x['type']=='dataset']
-        codes.append(data_codes)
-    
-    codes_flat = set(flatten_list(codes))
+    codes_flat = topic_codes(toc_df,keywords)
     
-    print(codes_flat)
+    logging.info(f'Tables for {keywords}: {sorted(codes_flat)}')
+
+    #Indexed once, rather than scanning toc_df for each table
+    toc_index = index_toc(toc_df)
     
     for c in codes_flat:
         
-        time.sleep(delay)
-        
         logging.info(f'Making {c}')
         
-        make_eurostat_table(c,toc_df,target_path)
- 
-########   
-#Collect data
-########
+        make_eurostat_table(c,toc_df,target_path,toc_index)
+
+
+def collect_tables(toc_df,targets,n_threads=8,n_processes=None,max_in_flight=16,
+                   output_format='csv'):
+    '''
+    Collects many tables in parallel. The downloads (of each table and the dictionaries
+    for its dimensions) run in a pool of threads and the melting, schemas and saving in
+    a pool of processes, with at most max_in_flight tables being downloaded or transformed
+    at any one time. Each table is downloaded once, however
+    many destinations it has.
+
+    Args:
+        toc_df (df) is the table of contents df
+        targets (dict) maps each table code to a list of destination paths
+        n_threads (int) is the number of concurrent downloads
+        n_processes (int) is the number of worker processes (defaults to the number of CPUs).
+            With n_processes=0 the tables are transformed in this process instead
+        max_in_flight (int) is the maximum number of tables being downloaded or transformed
+        output_format (str) is one of output_formats
+
+    Returns:
+        failed (list) of the codes for tables which could not be collected
+
+    '''
+    codes = iter(list(targets))
+
+    toc_index = index_toc(toc_df)
+
+    failed = []
 
-with open(f"{project_dir}/model_config.yaml",'r') as infile:
-    table_codes = yaml.load(infile)['eurostat_inventory']
+    #The worker processes are started before the download threads (see eis.process_pool)
+    processes = eis.process_pool(n_processes) if n_processes!=0 else None
 
-print(table_codes)
+    with ThreadPoolExecutor(n_threads) as threads:
 
-toc_df = eurostat.get_toc_df()
+        if processes is None:
+            processes = threads
 
-#For the table codes we collect the data
-if os.path.exists(f"{target_dir}/selected_tables")==False:
-    os.mkdir(f"{target_dir}/selected_tables")
+        with processes:
 
-for c in table_codes:
-    make_eurostat_table(c,toc_df,f"{target_dir}/selected_tables")
+            pending = {}
 
-#For each of these topics collect the data and save in its own special directory
-for topic in ['skills','innovation','digital','education']:
+            def submit_download():
+
+                code = next(codes,None)
+
+                if code is not None:
+                    logging.info(f'Making {code}')
+                    toc_rows = toc_df.iloc[toc_index.get(code,[])]
+                    pending[threads.submit(download_table,code,toc_rows)] = ('download',code,
+                                                                            time.monotonic())
+
+            for _ in range(max_in_flight):
+                submit_download()
+
+            while pending:
+
+                done,_ = wait(pending,return_when=FIRST_COMPLETED)
+
+                for future in done:
+
+                    stage,code,started = pending.pop(future)
+
+                    #Time from submission, so including any wait for a worker
+                    metrics.observe(f'eurostat.{stage}_seconds',time.monotonic()-started)
+
+                    try:
+                        result = future.result()
+
+                    except Exception as e:
+                        #A small number of eurostat tables don't work with this package.
+                        logging.warning(f'{code}: {stage} failed with {e!r}')
+                        metrics.incr('eurostat.tables_failed')
+                        failed.append(code)
+                        submit_download()
+                        continue
+
+                    if stage=='download':
+                        #The workers get the dictionaries too, so they never make a request
+                        table,dics = result
+                        metrics.incr('eurostat.rows_downloaded',len(table))
+                        toc_rows = toc_df.iloc[toc_index.get(code,[])]
+                        pending[processes.submit(transform_table,table,code,toc_rows,
+                                                 targets[code],output_format,dics)] = ('transform',code,
+                                                                                      time.monotonic())
+                    else:
+                        metrics.incr('eurostat.tables_collected')
+                        submit_download()
+
+    return(failed)
+
+
+#Columns of the table of contents which tell us whether a table has changed
+version_columns = ['last update of data','last table structure change']
+
+
+def table_version(toc_rows):
+    '''
+    Gets the version of a table from the table of contents, i.e. when its data and
+    structure were last updated
+
+    Args:
+        toc_rows (df) are the rows of the table of contents for the table
+
+    Returns:
+        version (dict) with the dates in version_columns, or None if the table of contents
+            doesn't tell us (in which case the table is always collected)
+
+    '''
+    if len(toc_rows)==0 or not set(version_columns) <= set(toc_rows.columns):
+        return(None)
+
+    return({col:str(toc_rows[col].iloc[0]) for col in version_columns})
+
+
+def read_manifest(path):
+    '''
+    Reads the manifest of tables collected by sync_tables (an empty one if there isn't one yet)
+
+    Args:
+        path (str) is the path to the manifest
+
+    '''
+    if os.path.exists(path)==False:
+        return({})
+
+    with open(path,'r') as infile:
+        return(json.load(infile))
+
+
+def write_manifest(manifest,path):
+    '''
+    Writes the manifest of tables collected by sync_tables, replacing the old one in one go
+
+    Args:
+        manifest (dict) maps each table code to its version, destinations and when it was fetched
+        path (str) is the path to the manifest
+
+    '''
+    with open(f'{path}.tmp','w') as outfile:
+        json.dump(manifest,outfile,indent=1,sort_keys=True)
+
+    os.replace(f'{path}.tmp',path)
+
+
+def changed_tables(toc_df,targets,manifest,toc_index=None,output_format='csv'):
+    '''
+    Finds the tables which have to be collected again: those which are new, have been updated
+    in the table of contents since they were collected, have new destinations or formats or are
+    missing from any of their destinations.
+
+    Args:
+        toc_df (df) is the table of contents df
+        targets (dict) maps each table code to a list of destination paths
+        manifest (dict) is the manifest from the previous sync
+        toc_index (dict) is an index of toc_df from index_toc (optional)
+        output_format (str) is one of output_formats
+
+    Returns:
+        changed (set) of table codes
+
+    '''
+    if toc_index is None:
+        toc_index = index_toc(toc_df)
+
+    changed = set()
+
+    for code,paths in targets.items():
+
+        version = table_version(toc_df.iloc[toc_index.get(code,[])])
+        entry = manifest.get(code)
+
+        if ((version is None) or (entry is None) or (entry['version']!=version) or
+            (entry.get('format','csv')!=output_format) or (not set(paths) <= set(entry['paths'])) or
+            (not all(os.path.exists(f'{path}/{code}.{ext}') for path in paths
+                     for ext in [output_format,'yaml']))):
+
+            changed.add(code)
+
+    return(changed)
+
+
+def sync_tables(toc_df,targets,manifest_path=None,full=False,output_format='csv',**kwargs):
+    '''
+    Collects only the tables which have changed since the last sync (see changed_tables),
+    leaving the outputs for the others untouched, and records what was collected in a
+    manifest for the next sync.
+
+    Args:
+        toc_df (df) is the table of contents df
+        targets (dict) maps each table code to a list of destination paths
+        manifest_path (str) is the path to the manifest (defaults to target_dir/manifest.json)
+        full (bool) collects every table, whether it has changed or not
+        output_format (str) is one of output_formats
+        kwargs are passed to collect_tables
+
+    Returns:
+        changed (set) of the codes for tables which were collected, and failed (list) of
+            those which could not be
+
+    '''
+    if manifest_path is None:
+        manifest_path = f'{target_dir}/manifest.json'
+
+    manifest = read_manifest(manifest_path)
+
+    toc_index = index_toc(toc_df)
+
+    if full:
+        changed = set(targets)
+    else:
+        changed = changed_tables(toc_df,targets,manifest,toc_index,output_format)
+
+    logging.info(f'{len(changed)} of {len(targets)} tables have changed')
+
+    for code in changed:
+        #The cached table could be out of date
+        get_data_df.invalidate(code)
+
+    failed = collect_tables(toc_df,{code:targets[code] for code in targets if code in changed},
+                            output_format=output_format,**kwargs)
+
+    fetched = time.time()
+
+    for code in changed:
+
+        if code in failed:
+            manifest.pop(code,None)
+
+        else:
+            manifest[code] = {'version':table_version(toc_df.iloc[toc_index.get(code,[])]),
+                              'paths':sorted(targets[code]),
+                              'format':output_format,
+                              'fetched':fetched}
+
+    write_manifest(manifest,manifest_path)
+
+    return(changed,failed)
+
+
+#Topics whose tables are collected, each in its own directory
+default_topics = ['skills','innovation','digital','education']
+
+
+def make_targets(toc_df,codes,topics,path=target_dir,toc_index=None):
+    '''
+    Works out where each table is saved: the tables in codes go in path/selected_tables, and
+    the tables for each topic (based on whether the topic appears in their title) in
+    path/topic. Each table is collected once, and saved in every directory it belongs to.
+
+    Args:
+        toc_df (df) is the table of contents df
+        codes (list) are the codes of the tables to select
+        topics (list) are the topics to collect tables for
+        path (str) is the directory for all the outputs
+        toc_index (TocIndex) is a keyword index of toc_df (optional, loaded if not given)
+
+    Returns:
+        targets (dict) mapping each table code to a list of destination paths
+
+    '''
+    targets = defaultdict(list)
+
+    for c in codes:
+        targets[c].append(f"{path}/selected_tables")
+
+    if topics:
+
+        if toc_index is None:
+            toc_index = load_toc_index(toc_df)
+
+        for topic,codes_for_topic in toc_index.search_topics({topic:[topic] for topic in topics}).items():
+
+            for c in sorted(codes_for_topic):
+                targets[c].append(f"{path}/{topic}")
+
+    return(dict(targets))
+
+
+def parse_args(argv=None):
+    '''
+    Parses the command line arguments for main
+
+    Args:
+        argv (list) are the arguments (defaults to sys.argv)
+
+    '''
+    parser = argparse.ArgumentParser(description='Collects eurostat tables (with a yaml schema each) '
+                                                 'for the inventory in model_config.yaml and for some topics')
+    parser.add_argument('--codes',nargs='*',default=None,
+                        help='codes of the tables to select (defaults to the eurostat_inventory)')
+    parser.add_argument('--topics',nargs='*',default=default_topics,
+                        help='topics to collect tables for (default: %(default)s)')
+    parser.add_argument('--target-dir',default=target_dir,help='directory for the outputs')
+    parser.add_argument('--threads',type=int,default=8,help='number of concurrent downloads')
+    parser.add_argument('--processes',type=int,default=None,
+                        help='number of processes for melting and saving tables (0 for none)')
+    parser.add_argument('--format',choices=output_formats,default='csv',help='format of the tables')
+    parser.add_argument('--full',action='store_true',help='collect every table, even if unchanged')
+    parser.add_argument('--dry-run',action='store_true',
+                        help='list the tables which would be collected, without collecting them')
+
+    return(parser.parse_args(argv))
+
+
+def main(argv=None):
+    '''
+    Collects eurostat tables, as set out by the command line arguments (see parse_args)
+
+    Args:
+        argv (list) are the arguments (defaults to sys.argv)
+
+    '''
+    args = parse_args(argv)
+
+    eis.setup_logging()
+
+    codes = eis.config['eurostat_inventory'] if args.codes is None else args.codes
+
+    with metrics.stage('eurostat.toc'):
+        toc_df = get_toc_df()
+
+        targets = make_targets(toc_df,codes,args.topics,args.target_dir)
+
+    manifest_path = f'{args.target_dir}/manifest.json'
+
+    if args.dry_run:
+
+        if args.full:
+            changed = set(targets)
+        else:
+            changed = changed_tables(toc_df,targets,read_manifest(manifest_path),
+                                     output_format=args.format)
+
+        for code in sorted(changed):
+            print(code,' '.join(targets[code]))
+
+        print(f'{len(changed)} of {len(targets)} tables would be collected')
+
+        return
+
+    for path in set(p for paths in targets.values() for p in paths):
+
+        if os.path.exists(path)==False:
+            os.makedirs(path)
+
+    try:
+        with metrics.stage('eurostat.sync'):
+            changed,failed = sync_tables(toc_df,targets,manifest_path,full=args.full,
+                                         output_format=args.format,n_threads=args.threads,
+                                         n_processes=args.processes)
+    finally:
+        metrics.write_summary('make_eurostat')
 
-    if os.path.exists(f"{target_dir}/{topic}")==False:
-        os.mkdir(f"{target_dir}/{topic}")
+    logging.info(f'Collected {len(changed)-len(failed)} tables, {len(failed)} failed')
 
-    target_2 = f"{target_dir}/{topic}"
-    collect_data_for_topic(toc_df,[topic],target_2)
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""Store of melted eurostat tables as typed panels in Parquet, one file per table.
+
+Each panel has the table's dimensions (e.g. unit, sex, age) as categoricals,
+then the keys geo (categorical) and time (int16 for annual data, otherwise
+categorical), the value as float32 and eurostat's flag for the value (e.g. 'e'
+for estimated, ':' for not available) as a categorical, which is empty for
+plain values.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import eis
+
+PANEL_PATH = f'{eis.project_dir}/data/processed/eurostat_panel'
+KEYS = ('geo', 'time')
+# Columns holding the countries or years which make_eurostat melted from, by name
+STRUCT_COLUMNS = {'geo\\time': 'geo', 'time\\geo': 'time'}
+
+
+def parse_values(values):
+    """Split eurostat values, which may carry a flag (e.g. '12.3 e' or ': c'), into
+    numbers and flags. Missing values are flagged ':' if not flagged otherwise.
+
+    Args:
+        values (Series): Values from a melted eurostat table.
+    Returns:
+        value, flag (Series, Series): float32 values, and categorical flags.
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        value = values.astype(np.float32)
+        flag = pd.Series('', index=values.index)
+    else:
+        parts = values.fillna('').astype(str).str.strip().str.partition(' ')
+        number, flag = parts[0], parts[2].str.strip()
+        missing = number == ':'
+        flag = flag.where(~missing, (': ' + flag).str.strip())
+        value = pd.to_numeric(number.where(~missing), errors='coerce').astype(np.float32)
+    flag = flag.where(value.notnull() | (flag != ''), ':')
+    return value, flag.astype('category')
+
+
+def to_panel(table_long, code):
+    """Convert a table melted by make_eurostat (with string dimensions, a 'geo\\time'
+    or 'time\\geo' column and the values in a column named code) into a panel.
+
+    Args:
+        table_long (DataFrame): Melted eurostat table.
+        code (str): Code of the table.
+    Returns:
+        panel (DataFrame): Columns for each dimension, geo, time, value and flag.
+    """
+    columns = {}
+    for col in table_long.columns:
+        if col == code:
+            continue
+        key = STRUCT_COLUMNS.get(col, col)
+        if key == 'time':
+            time = table_long[col]
+            as_int = pd.to_numeric(time, errors='coerce')
+            if as_int.notnull().all() and (as_int % 1 == 0).all():
+                columns[key] = as_int.astype(np.int16)
+            else:
+                columns[key] = time.astype(str).astype('category')
+        else:
+            columns[key] = table_long[col].astype('category')
+    dimensions = [col for col in columns if col not in KEYS]
+    panel = pd.DataFrame({col: columns[col] for col in dimensions + [k for k in KEYS if k in columns]})
+    panel['value'], panel['flag'] = parse_values(table_long[code])
+    return panel
+
+
+def panel_path(code, path=PANEL_PATH):
+    """Path to the Parquet file for a table."""
+    return f'{path}/{code}.parquet'
+
+
+def write_panel(panel, code, path=PANEL_PATH):
+    """Write a panel to the store, replacing any previous version in one go.
+
+    Args:
+        panel (DataFrame): Panel, from to_panel.
+        code (str): Code of the table.
+        path (str): Directory of the store.
+    """
+    os.makedirs(path, exist_ok=True)
+    filename = panel_path(code, path)
+    panel.to_parquet(f'{filename}.tmp', index=False, engine='pyarrow')
+    os.replace(f'{filename}.tmp', filename)
+
+
+def panel_codes(path=PANEL_PATH):
+    """Sorted codes of the tables in the store."""
+    if not os.path.exists(path):
+        return []
+    return sorted(name[:-len('.parquet')] for name in os.listdir(path) if name.endswith('.parquet'))
+
+
+def read_panel(code, path=PANEL_PATH, columns=None, filters=None):
+    """Read a panel from the store, only decoding the columns and rows which are needed.
+
+    Args:
+        code (str): Code of the table.
+        path (str): Directory of the store.
+        columns (list of str): Columns to read. Defaults to all.
+        filters (dict): Look-up of column --> values to keep, which is applied while
+                        reading (e.g. {'sex': ['T'], 'unit': ['PC']}). Defaults to all rows.
+    Returns:
+        panel (DataFrame)
+    """
+    import pyarrow.parquet as pq
+    if columns is not None:
+        available = pq.read_schema(panel_path(code, path)).names
+        columns = [col for col in columns if col in available]
+    if filters:
+        filters = [(col, 'in', list(values)) for col, values in filters.items()]
+    return pd.read_parquet(panel_path(code, path), columns=columns, filters=filters or None,
+                           engine='pyarrow')
+
+
+def read_panels(codes=None, path=PANEL_PATH, columns=None):
+    """Read many panels from the store, i.e. in place of reading every csv.
+
+    Args:
+        codes (list of str): Codes of the tables to read. Defaults to all.
+        path (str): Directory of the store.
+        columns (list of str): Columns to read from each table (where present). Defaults to all.
+    Returns:
+        panels (dict): Look-up of code --> panel.
+    """
+    if codes is None:
+        codes = panel_codes(path)
+    return {code: read_panel(code, path, columns) for code in codes}
+
+
+def csvs_to_panels(csv_path, path=PANEL_PATH):
+    """Convert the csv tables written by make_eurostat (e.g. in selected_tables) into panels.
+
+    Args:
+        csv_path (str): Directory of the csv tables.
+        path (str): Directory of the store.
+    Returns:
+        codes (list of str): Codes of the converted tables.
+    """
+    codes = sorted(name[:-len('.csv')] for name in os.listdir(csv_path) if name.endswith('.csv'))
+    for code in codes:
+        table_long = pd.read_csv(f'{csv_path}/{code}.csv', dtype={code: object}, keep_default_na=False)
+        write_panel(to_panel(table_long, code), code, path)
+    return codes
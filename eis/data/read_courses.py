@@ -0,0 +1,131 @@
+import json
+import re
+import zipfile
+
+import eis
+
+ZIP_PATH = f'{eis.project_dir}/data/raw/courses.zip'
+# Course files are laid out as {di}/{lvl}/{di}-{lvl}-{count}.json by download_courses,
+# optionally under a top level directory (e.g. courses/)
+MEMBER_PATTERN = re.compile(r'(?:^|/)(\d+)/([^/]+)/\1-\2-\d+\.json$')
+
+
+def parse_member(name):
+    """Extract the discipline id and degree level from the path of a course file.
+
+    Args:
+        name (str): Path of an archive member.
+    Returns:
+        (di, lvl) (int, str): Discipline id and degree level, or None if the
+                              member is not a course file.
+    """
+    match = MEMBER_PATTERN.search(name)
+    if match is None:
+        return None
+    return int(match.group(1)), match.group(2)
+
+
+def course_members(archive, disciplines=None, levels=None):
+    """List the course files in an archive, for the requested disciplines and levels.
+
+    Args:
+        archive (zipfile.ZipFile): Archive of download_courses output.
+        disciplines (iterable of int): Discipline ids to keep. Defaults to all.
+        levels (iterable of str): Degree levels to keep. Defaults to all.
+    Returns:
+        members (list of tuple): (name, di, lvl) for each matching course file.
+    """
+    disciplines = None if disciplines is None else set(disciplines)
+    levels = None if levels is None else set(levels)
+    members = []
+    for name in archive.namelist():
+        key = parse_member(name)
+        if key is None:
+            continue
+        di, lvl = key
+        if disciplines is not None and di not in disciplines:
+            continue
+        if levels is not None and lvl not in levels:
+            continue
+        members.append((name, di, lvl))
+    return members
+
+
+def iter_courses(path=ZIP_PATH, disciplines=None, levels=None):
+    """Iterate over courses straight from a zip archive of download_courses output,
+    without extracting it. Members are selected from their path alone, so that
+    files for other disciplines and levels are never decompressed, and only one
+    file is held in memory at a time.
+
+    Args:
+        path (str): Path to the zip archive.
+        disciplines (iterable of int): Discipline ids to keep. Defaults to all.
+        levels (iterable of str): Degree levels to keep. Defaults to all.
+    Yields:
+        course (dict): Rawish course data, as written by download_courses.
+    """
+    with zipfile.ZipFile(path) as archive:
+        for name, _, _ in course_members(archive, disciplines, levels):
+            with archive.open(name) as f:
+                courses = json.load(f)
+            yield from courses
+
+
+def _arrow_table(rows):
+    """pyarrow.Table of some dicts, with a column for every key (column by column, as
+    Table.from_pylist needs pyarrow>=7, which needs python>=3.7)"""
+    import pyarrow as pa
+    names = list(dict.fromkeys(name for row in rows for name in row))
+    return pa.Table.from_pydict({name: [row.get(name) for row in rows] for name in names})
+
+
+def iter_course_batches(path=ZIP_PATH, disciplines=None, levels=None, batch_size=10000,
+                        output='pandas'):
+    """Iterate over batches of courses from a zip archive of download_courses output,
+    as for iter_courses.
+
+    Args:
+        path (str): Path to the zip archive.
+        disciplines (iterable of int): Discipline ids to keep. Defaults to all.
+        levels (iterable of str): Degree levels to keep. Defaults to all.
+        batch_size (int): Maximum number of courses per batch.
+        output (str): One of 'pandas' (DataFrame), 'arrow' (pyarrow.Table) or 'records' (list of dict).
+    Yields:
+        batch: Up to batch_size courses.
+    """
+    if output == 'pandas':
+        import pandas as pd
+        convert = pd.DataFrame.from_records
+    elif output == 'arrow':
+        convert = _arrow_table
+    elif output == 'records':
+        convert = list
+    else:
+        raise ValueError(f"output must be one of 'pandas', 'arrow' or 'records', not '{output}'")
+    batch = []
+    for course in iter_courses(path, disciplines, levels):
+        batch.append(course)
+        if len(batch) == batch_size:
+            yield convert(batch)
+            batch = []
+    if batch:
+        yield convert(batch)
+
+
+def read_archive_json(filename, path=ZIP_PATH):
+    """Read one of the metadata files (e.g. discipline_dictionary.json,
+    course_discipline_lookup.json, discipline_course_lookup.json) from
+    a zip archive of download_courses output.
+
+    Args:
+        filename (str): Name of the file, without any directory.
+        path (str): Path to the zip archive.
+    Returns:
+        data (json-like): Contents of the file.
+    """
+    with zipfile.ZipFile(path) as archive:
+        for name in archive.namelist():
+            if name.split('/')[-1] == filename:
+                with archive.open(name) as f:
+                    return json.load(f)
+    raise KeyError(f'{filename} not found in {path}')
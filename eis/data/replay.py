@@ -0,0 +1,289 @@
+"""Record and replay of HTTP responses, for running the crawlers offline.
+
+ReplayServer is a local HTTP stand-in which serves a FixtureArchive of recorded
+responses, with configurable latency, error injection and rate limits. In
+record mode it forwards each request to the real host and records the response.
+Requests are routed by host, so that https://search.prtl.co/2018-07-23/?q=x is
+served as {server url}/search.prtl.co/2018-07-23/?q=x (see proxied_url).
+
+To point the crawlers at a server, set the base URLs in the environment before
+importing them, e.g. for a server on port 8000:
+
+    EIS_BACHELOR_DISCIPLINES_URL=http://127.0.0.1:8000/www.bachelorsportal.com/disciplines/
+    EIS_SEARCH_FACETS_URL=http://127.0.0.1:8000/search-facets.prtl.co
+    EIS_SEARCH_URL=http://127.0.0.1:8000/search.prtl.co/2018-07-23/
+    EIS_EUROSTAT_URL=http://127.0.0.1:8000
+
+or use ReplayServer.environ(). Run python -m eis.data.replay --help to serve or
+record from the command line.
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl, urlencode, urlsplit
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import zipfile
+
+# Headers which are not replayed, as they describe the connection or the original encoding
+SKIPPED_HEADERS = {'connection', 'content-encoding', 'content-length', 'keep-alive',
+                   'transfer-encoding', 'date', 'server'}
+
+
+def proxied_url(url, server_url):
+    """URL at which a ReplayServer serves url.
+
+    Args:
+        url (str): Original URL, e.g. https://search.prtl.co/2018-07-23/
+        server_url (str): Base URL of the server, e.g. http://127.0.0.1:8000
+    Returns:
+        url (str): e.g. http://127.0.0.1:8000/search.prtl.co/2018-07-23/
+    """
+    parts = urlsplit(url)
+    return f"{server_url.rstrip('/')}/{parts.netloc}{parts.path}" + (f'?{parts.query}' if parts.query else '')
+
+
+def request_key(method, path):
+    """Key of a request in a FixtureArchive, with the query parameters sorted."""
+    parts = urlsplit(path)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return f"{method} {parts.path}" + (f'?{query}' if query else '')
+
+
+class FixtureArchive:
+    """Recorded responses, keyed by request (see request_key), stored in a zip file
+    with an index.json of the statuses and headers, and one member per body.
+
+    Args:
+        path (str): Path to the zip file, which is read if it exists.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.responses = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with zipfile.ZipFile(path) as archive:
+                index = json.loads(archive.read('index.json'))
+                for key, response in index.items():
+                    self.responses[key] = (response['status'], response['headers'],
+                                           archive.read(response['body']))
+
+    def __len__(self):
+        return len(self.responses)
+
+    def get(self, key):
+        """(status, headers, body) recorded for key, or None."""
+        return self.responses.get(key)
+
+    def put(self, key, status, headers, body):
+        """Record a response.
+
+        Args:
+            key (str): Key of the request, from request_key.
+            status (int): Status code.
+            headers (dict): Response headers.
+            body (bytes): Decoded response body.
+        """
+        headers = {k: v for k, v in headers.items() if k.lower() not in SKIPPED_HEADERS}
+        with self._lock:
+            self.responses[key] = (status, headers, body)
+
+    def save(self):
+        """Write the archive to its zip file."""
+        with self._lock:
+            index = {}
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with zipfile.ZipFile(f'{self.path}.tmp', 'w', zipfile.ZIP_DEFLATED) as archive:
+                for key, (status, headers, body) in sorted(self.responses.items()):
+                    name = f"bodies/{hashlib.sha1(key.encode()).hexdigest()}"
+                    archive.writestr(name, body)
+                    index[key] = {'status': status, 'headers': headers, 'body': name}
+                archive.writestr('index.json', json.dumps(index, indent=1, sort_keys=True))
+            os.replace(f'{self.path}.tmp', self.path)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.replay.handle(self)
+
+    do_POST = do_HEAD = do_GET
+
+
+class ReplayServer:
+    """Local HTTP stand-in for the hosts which the crawlers request.
+
+    Args:
+        archive (FixtureArchive): Responses to serve (or to record into).
+        record (bool): Forward requests to the real hosts and record the responses,
+                       rather than serving recorded responses.
+        latency (float): Seconds to wait before each response.
+        jitter (float): Up to this many seconds are added to the latency at random.
+        error_rate (float): Fraction of requests which get error_status instead.
+        error_status (int): Status code of the injected errors.
+        rate (float): Maximum requests per second, beyond which requests get 429 with
+                      Retry-After, or None for no limit.
+        burst (int): Number of requests allowed at once, beyond the rate.
+        host (str): Interface to listen on.
+        port (int): Port to listen on (0 for any free port).
+        upstream_scheme (str): Scheme for forwarding requests in record mode.
+        seed (int): Seed for the latency jitter and error injection.
+    """
+    def __init__(self, archive, record=False, latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_status=503, rate=None, burst=1, host='127.0.0.1', port=0,
+                 upstream_scheme='https', seed=None):
+        self.archive = archive
+        self.record = record
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rate = rate
+        self.burst = burst
+        self.upstream_scheme = upstream_scheme
+        self.stats = dict.fromkeys(['requests', 'served', 'recorded', 'missing', 'errors', 'rate_limited'], 0)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._server = _Server((host, port), _Handler)
+        self._server.replay = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def environ(self):
+        """Environment variables which point download_courses and make_eurostat at this server."""
+        from eis.data import download_courses
+        return {'EIS_BACHELOR_DISCIPLINES_URL': proxied_url(download_courses.BACHELOR_DISCIPLINES_URL, self.url),
+                'EIS_SEARCH_FACETS_URL': proxied_url(download_courses.SEARCH_FACETS_URL, self.url),
+                'EIS_SEARCH_URL': proxied_url(download_courses.SEARCH_URL, self.url),
+                'EIS_EUROSTAT_URL': self.url}
+
+    def start(self):
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving, and save the archive if recording."""
+        self._server.shutdown()
+        self._server.server_close()
+        if self.record:
+            self.archive.save()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _allow(self):
+        """Whether the rate limit allows another request now (token bucket)"""
+        if self.rate is None:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last)*self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def handle(self, handler):
+        """Respond to a request"""
+        self._count('requests')
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+        if not self._allow():
+            self._count('rate_limited')
+            return self._send(handler, 429, {'Retry-After': '1'}, b'Rate limited')
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            error = self._random.random() < self.error_rate
+        time.sleep(delay)
+        if error:
+            self._count('errors')
+            return self._send(handler, self.error_status, {}, b'Injected error')
+        key = request_key(handler.command, handler.path)
+        response = self._forward(handler, body) if self.record else self.archive.get(key)
+        if response is None:
+            self._count('missing')
+            return self._send(handler, 404, {}, f'No recorded response for {key}'.encode())
+        if self.record:
+            self.archive.put(key, *response)
+            self._count('recorded')
+        else:
+            self._count('served')
+        self._send(handler, *response)
+
+    def _forward(self, handler, body):
+        """Make the request of the real host, returning (status, headers, body)"""
+        import requests
+        host, _, path = handler.path.lstrip('/').partition('/')
+        headers = {k: v for k, v in handler.headers.items() if k.lower() not in ('host', 'content-length')}
+        r = requests.request(handler.command, f'{self.upstream_scheme}://{host}/{path}',
+                             headers=headers, data=body or None, allow_redirects=False)
+        return r.status_code, dict(r.headers), r.content
+
+    def _send(self, handler, status, headers, body):
+        handler.send_response(status)
+        for k, v in headers.items():
+            if k.lower() not in SKIPPED_HEADERS:
+                handler.send_header(k, v)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        if handler.command != 'HEAD':
+            handler.wfile.write(body)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve (or record) responses for the crawlers')
+    parser.add_argument('archive', help='path to the fixture archive (zip)')
+    parser.add_argument('--record', action='store_true', help='record responses from the real hosts')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra latency, up to this')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests which fail')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--rate', type=float, default=None, help='maximum requests per second')
+    parser.add_argument('--burst', type=int, default=1)
+    args = parser.parse_args(argv)
+    server = ReplayServer(FixtureArchive(args.archive), args.record, args.latency, args.jitter,
+                          args.error_rate, args.error_status, args.rate, args.burst, port=args.port)
+    for name, value in server.environ().items():
+        print(f'{name}={value}')
+    server.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(json.dumps(server.stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+from collections import defaultdict
+from functools import reduce
+import hashlib
+import os
+import pickle
+import re
+
+import eis
+
+TOC_INDEX_PATH = f'{eis.project_dir}/data/interim/eurostat_toc_index.pkl'
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+# Columns of the table of contents which, if changed, mean that the index must be rebuilt
+FINGERPRINT_COLUMNS = ('code', 'title', 'type', 'last update of data', 'last table structure change')
+
+
+def toc_fingerprint(toc_df):
+    """Hash of the contents of the table of contents, to tell whether it has changed.
+
+    Args:
+        toc_df (DataFrame): Eurostat table of contents, i.e. from get_toc_df.
+    Returns:
+        fingerprint (str)
+    """
+    import pandas as pd
+    columns = [col for col in FINGERPRINT_COLUMNS if col in toc_df.columns]
+    hashes = pd.util.hash_pandas_object(toc_df[columns], index=False)
+    return hashlib.sha1(hashes.values.tobytes()).hexdigest()
+
+
+class TocIndex:
+    """Keyword search over the titles of the eurostat table of contents.
+
+    Titles are split into lower case alphanumeric tokens held in an inverted index
+    (token --> rows), so a keyword is answered from the tokens which contain it rather
+    than by scanning every title. Matches are case insensitive substrings of the title,
+    as for eurostat.subset_toc_df, and the results of each keyword are memoized.
+    Only rows of the requested types (by default datasets) are indexed.
+
+    Args:
+        toc_df (DataFrame): Eurostat table of contents, i.e. from get_toc_df.
+        types (tuple of str): Types of row to index, or None for all.
+    """
+    def __init__(self, toc_df, types=('dataset',)):
+        if types is not None:
+            toc_df = toc_df.loc[toc_df['type'].isin(types)]
+        self.types = types
+        self.fingerprint = None
+        self.codes = toc_df['code'].tolist()
+        self.titles = toc_df['title'].fillna('').str.lower().tolist()
+        self.positions = {code: i for i, code in enumerate(self.codes)}
+        postings = defaultdict(set)
+        for i, title in enumerate(self.titles):
+            for token in TOKEN_PATTERN.findall(title):
+                postings[token].add(i)
+        self.postings = {token: frozenset(rows) for token, rows in postings.items()}
+        self._matches = {}
+
+    def __getstate__(self):
+        """Don't pickle the memoized keywords"""
+        state = self.__dict__.copy()
+        state['_matches'] = {}
+        return state
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self.positions
+
+    def title(self, code):
+        """Title of a table (in lower case), by code."""
+        return self.titles[self.positions[code]]
+
+    def _rows(self, keyword):
+        """Rows whose title contains keyword (memoized)"""
+        keyword = keyword.lower()
+        if keyword not in self._matches:
+            tokens = TOKEN_PATTERN.findall(keyword)
+            if not tokens:
+                rows = frozenset(i for i, title in enumerate(self.titles) if keyword in title)
+            else:
+                # Candidates contain every token of the keyword within one of their own tokens
+                candidates = [frozenset().union(*(rows for token, rows in self.postings.items() if part in token))
+                              for part in tokens]
+                rows = reduce(frozenset.intersection, candidates)
+                if keyword != tokens[0]:
+                    # The keyword spans several tokens or includes punctuation, so check the titles
+                    rows = frozenset(i for i in rows if keyword in self.titles[i])
+            self._matches[keyword] = rows
+        return self._matches[keyword]
+
+    def search(self, keywords, match='any'):
+        """Codes of the tables whose titles contain any (or all) of the keywords.
+
+        Args:
+            keywords (str or list of str): Keywords to search for.
+            match (str): 'any' (OR) or 'all' (AND).
+        Returns:
+            codes (set of str)
+        """
+        if isinstance(keywords, str):
+            keywords = [keywords]
+        if match == 'any':
+            rows = frozenset().union(*(self._rows(keyword) for keyword in keywords))
+        elif match == 'all':
+            rows = reduce(frozenset.intersection, (self._rows(keyword) for keyword in keywords))
+        else:
+            raise ValueError(f"match must be 'any' or 'all', not '{match}'")
+        return {self.codes[i] for i in rows}
+
+    def search_topics(self, topics, match='any'):
+        """Codes of the tables for many topics at once.
+
+        Args:
+            topics (dict): Look-up of topic --> keywords.
+            match (str): 'any' (OR) or 'all' (AND) of each topic's keywords.
+        Returns:
+            codes (dict): Look-up of topic --> set of codes.
+        """
+        return {topic: self.search(keywords, match) for topic, keywords in topics.items()}
+
+
+def load_toc_index(toc_df, path=TOC_INDEX_PATH, types=('dataset',)):
+    """Load the TocIndex saved at path, or build (and save) it afresh if the table
+    of contents has changed since it was saved.
+
+    Args:
+        toc_df (DataFrame): Current eurostat table of contents, i.e. from get_toc_df.
+        path (str): Path to the saved index.
+        types (tuple of str): Types of row to index, or None for all.
+    Returns:
+        index (TocIndex)
+    """
+    fingerprint = toc_fingerprint(toc_df)
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            index = pickle.load(f)
+        if index.fingerprint == fingerprint and index.types == types:
+            return index
+    index = TocIndex(toc_df, types)
+    index.fingerprint = fingerprint
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f'{path}.tmp', 'wb') as f:
+        pickle.dump(index, f)
+    os.replace(f'{path}.tmp', path)
+    return index
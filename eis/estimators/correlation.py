@@ -0,0 +1,149 @@
+"""Correlations between indicators across countries, for many years (and bootstrap
+resamples of the countries) at once.
+
+Indicators are stacked into a year x country x indicator array, and each pair of
+indicators is correlated over the countries where both are present, as for
+pandas.DataFrame.corr.
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+METHODS = ('pearson', 'spearman')
+
+
+def stack_panel(matrices, years=None):
+    """Stack country x year matrices (e.g. from eis.transformers.indicators.indicator_matrices)
+    into a year x country x indicator array.
+
+    Args:
+        matrices (dict): Look-up of indicator --> matrix with countries as index and years as columns.
+        years (iterable of int): Years to keep. Defaults to every year in any matrix.
+    Returns:
+        values, years, countries, indicators (array, list, list, list): The array (NaN where
+            missing), and the labels of its axes.
+    """
+    indicators = list(matrices)
+    countries = sorted(set().union(*(matrix.index for matrix in matrices.values())))
+    if years is None:
+        years = sorted(set().union(*(matrix.columns for matrix in matrices.values())))
+    years = list(years)
+    values = np.full((len(years), len(countries), len(indicators)), np.nan)
+    for k, indicator in enumerate(indicators):
+        matrix = matrices[indicator].reindex(index=countries, columns=years)
+        values[:, :, k] = matrix.values.astype(float).T
+    return values, years, countries, indicators
+
+
+def _pairwise_ranks(values, valid):
+    """Average ranks (from 1) of each indicator over the countries where each pair is present.
+
+    Args:
+        values (array): ... x country x indicator.
+        valid (array of bool): ... x country x indicator x indicator, where both are present.
+    Returns:
+        ranks (array): ... x country x indicator x indicator, the rank of the first indicator.
+    """
+    x = values[..., :, None, :]  # ... x country x 1 x indicator
+    y = values[..., None, :, :]  # ... x 1 x country' x indicator
+    with np.errstate(invalid='ignore'):
+        below = (y < x) + 0.5*(y == x)  # ... x country x country' x indicator
+    return np.einsum('...abk,...bkl->...akl', below, valid.astype(float)) + 0.5
+
+
+def batched_corr(values, method='pearson', min_periods=1):
+    """Correlations between all pairs of indicators, using the countries where both are
+    present, for any number of leading dimensions (e.g. years and resamples) at once.
+
+    Args:
+        values (array): ... x country x indicator, with NaN where missing.
+        method (str): 'pearson' or 'spearman'.
+        min_periods (int): Minimum number of countries for a correlation (otherwise NaN).
+    Returns:
+        corr (array): ... x indicator x indicator.
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}, not '{method}'")
+    present = ~np.isnan(values)
+    valid = present[..., :, :, None] & present[..., :, None, :]  # ... x country x indicator x indicator
+    if method == 'spearman':
+        x = _pairwise_ranks(values, valid)
+        y = np.swapaxes(x, -1, -2)
+    else:
+        x = np.broadcast_to(values[..., :, :, None], valid.shape)
+        y = np.broadcast_to(values[..., :, None, :], valid.shape)
+    x, y = np.where(valid, x, 0), np.where(valid, y, 0)
+    n = valid.sum(axis=-3)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dx = np.where(valid, x - x.sum(axis=-3, keepdims=True)/n[..., None, :, :], 0)
+        dy = np.where(valid, y - y.sum(axis=-3, keepdims=True)/n[..., None, :, :], 0)
+        corr = (dx*dy).sum(axis=-3)/np.sqrt((dx*dx).sum(axis=-3)*(dy*dy).sum(axis=-3))
+    corr[n < max(min_periods, 1)] = np.nan
+    return np.clip(corr, -1, 1)
+
+
+def average_corr(corr):
+    """Average correlations over the first axis (e.g. years), ignoring missing values,
+    with ones on the diagonal.
+
+    Args:
+        corr (array): year x ... x indicator x indicator.
+    Returns:
+        mean (array): ... x indicator x indicator.
+    """
+    present = ~np.isnan(corr)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(present, corr, 0).sum(axis=0)/present.sum(axis=0)
+    k = corr.shape[-1]
+    mean[..., np.arange(k), np.arange(k)] = 1
+    return mean
+
+
+def indicator_correlations(matrices, years=range(2010, 2020), method='pearson', min_periods=1):
+    """Correlations between indicators across countries, averaged over years.
+
+    Args:
+        matrices (dict): Look-up of indicator --> country x year matrix.
+        years (iterable of int): Years to average over.
+        method (str): 'pearson' or 'spearman'.
+        min_periods (int): Minimum number of countries for a correlation in a year.
+    Returns:
+        corr (DataFrame): Indicator x indicator.
+    """
+    values, _, _, indicators = stack_panel(matrices, years)
+    mean = average_corr(batched_corr(values, method, min_periods))
+    return pd.DataFrame(mean, index=indicators, columns=indicators)
+
+
+def bootstrap_correlations(matrices, years=range(2010, 2020), method='pearson', n_boot=500,
+                           ci=0.95, min_periods=1, batch_size=50, seed=None):
+    """Bootstrap confidence intervals for indicator_correlations, resampling the
+    countries (with replacement, the same for every year).
+
+    Args:
+        matrices (dict): Look-up of indicator --> country x year matrix.
+        years (iterable of int): Years to average over.
+        method (str): 'pearson' or 'spearman'.
+        n_boot (int): Number of resamples.
+        ci (float): Coverage of the intervals.
+        min_periods (int): Minimum number of countries for a correlation in a year.
+        batch_size (int): Number of resamples computed at once (bounds the memory used).
+        seed (int): Seed for the random resamples.
+    Returns:
+        low, high (DataFrame, DataFrame): Indicator x indicator bounds of the intervals.
+    """
+    values, _, countries, indicators = stack_panel(matrices, years)
+    rng = np.random.RandomState(seed)
+    samples = rng.randint(len(countries), size=(n_boot, len(countries)))
+    means = []
+    for start in range(0, n_boot, batch_size):
+        batch = values[:, samples[start:start + batch_size], :]  # year x resample x country x indicator
+        means.append(average_corr(batched_corr(batch, method, min_periods)))
+    means = np.concatenate(means)
+    alpha = (1 - ci)/2
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # i.e. pairs which are never present
+        low, high = np.nanpercentile(means, [100*alpha, 100*(1 - alpha)], axis=0)
+    return (pd.DataFrame(low, index=indicators, columns=indicators),
+            pd.DataFrame(high, index=indicators, columns=indicators))
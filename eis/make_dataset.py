@@ -1,21 +1,133 @@
 # -*- coding: utf-8 -*-
 import logging
+import os
 from dotenv import find_dotenv, load_dotenv
 # Important to import the module
-# This configures logging, file-paths, model config variables
+# This defines file-paths and model config variables
 import eis
+from eis.pipeline import PIPELINE_PATH, Stage, run_pipeline
+from eis.data.course_cube import CUBE_PATH
+from eis.data.panel_store import PANEL_PATH
+from eis.data.read_courses import ZIP_PATH
+from eis.metrics import metrics
+from eis.transformers.digital_skills import TAGS_PATH, TAXONOMY_PATH
+from eis.transformers.indicators import CLEAN_NAMES_PATH, FILTERS_PATH
 
 
 logger = logging.getLogger(__name__)
 
-def main():
+# Where the final outputs of the pipeline are written, by stage
+OUTPUTS = {'indicator_correlations': f'{eis.project_dir}/data/processed/indicator_correlations.csv',
+           'discipline_counts': f'{eis.project_dir}/data/processed/discipline_counts.csv',
+           'digital_skills': TAGS_PATH,
+           'course_cube': CUBE_PATH}
+
+
+def eurostat_toc():
+    """Eurostat table of contents (checked every run, but cached for a day)"""
+    from eis.data.make_eurostat import get_toc_df
+    return get_toc_df()
+
+
+def eurostat_tables(eurostat_toc):
+    """Sync the inventory tables into the panel store, returning their versions"""
+    from eis.data.make_eurostat import read_manifest, sync_tables
+    targets = {code: [PANEL_PATH] for code in eis.config['eurostat_inventory']}
+    os.makedirs(PANEL_PATH, exist_ok=True)
+    manifest_path = f'{PANEL_PATH}/manifest.json'
+    sync_tables(eurostat_toc, targets, manifest_path, output_format='parquet')
+    manifest = read_manifest(manifest_path)
+    return {code: manifest[code]['version'] for code in targets if code in manifest}
+
+
+def indicator_matrices(eurostat_tables):
+    """Country x year matrix for each indicator, filtered as in eis_filters.yaml"""
+    from eis.transformers.indicators import load_indicator_matrices, read_clean_names
+    codes = [code for code in read_clean_names() if code in eurostat_tables]
+    return load_indicator_matrices(PANEL_PATH, codes=codes)
+
+
+def indicator_correlations(indicator_matrices):
+    """Correlations between indicators across countries, averaged over years"""
+    from eis.estimators.correlation import bootstrap_correlations, indicator_correlations
+    config = eis.config['correlations']
+    matrices = {k: v for k, v in indicator_matrices.items() if k not in config.get('exclude', [])}
+    years = range(config['first_year'], config['last_year'] + 1)
+    corr = indicator_correlations(matrices, years, config['method'])
+    if config.get('n_boot'):
+        low, high = bootstrap_correlations(matrices, years, config['method'], config['n_boot'], seed=0)
+        corr = corr.stack().to_frame('corr').assign(low=low.stack(), high=high.stack())
+    return corr
+
+
+def course_index():
+    """Two-way look-up between courses and disciplines, from the course archive"""
+    from eis.data.course_index import CourseDisciplineIndex
+    from eis.data.read_courses import read_archive_json
+    return CourseDisciplineIndex.from_lookup(read_archive_json('course_discipline_lookup.json'))
+
+
+def discipline_counts(course_index):
+    """Number of courses per discipline, with the disciplines' titles"""
+    import pandas as pd
+    from eis.data.read_courses import read_archive_json
+    titles = {d['discipline_id']: d['discipline_title'] for d in read_archive_json('discipline_dictionary.json')}
+    return pd.DataFrame({'discipline_id': course_index.discipline_keys,
+                         'discipline_title': [titles.get(di) for di in course_index.discipline_keys],
+                         'n_courses': course_index.discipline_counts()}).set_index('discipline_id')
+
+
+def digital_skills():
+    """Digital skill labels for every course, from the keyword taxonomy"""
+    from eis.transformers.digital_skills import tag_corpus
+    return tag_corpus(ZIP_PATH)
+
+
+def course_cube(digital_skills):
+    """Number of courses by discipline, level, country and digital skill, from the
+    digital skill labels (only the taxonomy's look-up of disciplines is used again)"""
+    from eis.data.course_cube import build_cube
+    from eis.transformers.digital_skills import KeywordMatcher, read_taxonomy
+    return build_cube(ZIP_PATH, KeywordMatcher(read_taxonomy()), tags=digital_skills)
+
+
+STAGES = [Stage('eurostat_toc', eurostat_toc, always_run=True),
+          Stage('eurostat_tables', eurostat_tables, inputs=['eurostat_toc'], config='eurostat_inventory',
+                processes=True),
+          Stage('indicator_matrices', indicator_matrices, inputs=['eurostat_tables'],
+                files=[FILTERS_PATH, CLEAN_NAMES_PATH]),
+          Stage('indicator_correlations', indicator_correlations, inputs=['indicator_matrices'],
+                config='correlations'),
+          Stage('course_index', course_index, files=[ZIP_PATH]),
+          Stage('discipline_counts', discipline_counts, inputs=['course_index'], files=[ZIP_PATH]),
+          Stage('digital_skills', digital_skills, files=[ZIP_PATH, TAXONOMY_PATH], processes=True),
+          Stage('course_cube', course_cube, inputs=['digital_skills'], files=[ZIP_PATH, TAXONOMY_PATH])]
+
+
+def main(targets=None, force=(), n_workers=4, cache_dir=PIPELINE_PATH):
     """ Runs data processing scripts to turn raw data from (../raw) into
         cleaned data ready to be analyzed (saved in ../processed).
+
+        Stages whose inputs, code and config are unchanged since the last run
+        are loaded from data/interim/pipeline rather than run again.
+
+        Args:
+            targets (list of str): Names of the stages wanted, or None for all.
+            force (iterable of str): Names of stages to run even if unchanged.
+            n_workers (int): Maximum number of stages run at once.
+            cache_dir (str): Directory for the cached outputs of the stages.
+        Returns:
+            outputs (dict): Look-up of stage name --> output.
     """
+    outputs = run_pipeline(STAGES, targets, cache_dir, n_workers, force)
 
-    config = eis.config
+    for name, path in OUTPUTS.items():
+        if name in outputs:
+            # DataFrames are saved as csv, and anything else with its own save method
+            output = outputs[name]
+            output.save(path) if hasattr(output, 'save') else output.to_csv(path)
 
-    return
+    return outputs
 
 
 
@@ -27,6 +139,8 @@ if __name__ == "__main__":
     # load up the .env entries as environment variables
     load_dotenv(find_dotenv())
 
+    eis.setup_logging()
+
     try:
         msg = f"Making datasets..."
         logger.info(msg)
@@ -34,3 +148,5 @@ if __name__ == "__main__":
     except (Exception, KeyboardInterrupt) as e:
         logger.exception("make_dataset failed", stack_info=True)
         raise e
+    finally:
+        metrics.write_summary('make_dataset')
@@ -0,0 +1,215 @@
+"""Metrics for runs of the crawlers and the pipeline: counters (e.g. requests, retries
+and bytes downloaded), histograms (e.g. request latency and flush sizes), gauges
+(e.g. pages per second) and the wall and CPU time of each stage.
+
+Stages are logged as they finish, as structured records on the eis.metrics logger
+(the message is the record as json, which is also attached as record.metrics), and
+summary() (or write_summary, at the end of a script) gathers everything for the run.
+
+Setting the EIS_PROFILE environment variable turns on profiling of each stage:
+'cpu' for cProfile, 'memory' for tracemalloc, or 'all' (or '1') for both. Profiles
+are written to PROFILE_PATH, one file per stage, and can be read with pstats (or
+snakeviz) for cpu, or as text for memory.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+import eis
+
+METRICS_PATH = f'{eis.project_dir}/data/interim/metrics'
+PROFILE_PATH = f'{eis.project_dir}/data/interim/profiles'
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)  # Seconds
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000, math.inf)
+PROFILERS = ('cpu', 'memory')
+
+logger = logging.getLogger(__name__)
+
+
+def profilers(setting=None):
+    """Profilers turned on by the EIS_PROFILE environment variable (or setting).
+
+    Returns:
+        profilers (set of str): Some of PROFILERS.
+    """
+    if setting is None:
+        setting = os.environ.get('EIS_PROFILE', '')
+    names = {name.strip().lower() for name in setting.split(',') if name.strip()}
+    if names & {'1', 'all', 'true'}:
+        return set(PROFILERS)
+    return names & set(PROFILERS)
+
+
+class Histogram:
+    """Counts of values in buckets, with their sum, min and max.
+
+    Args:
+        buckets (tuple of float): Upper bounds of the buckets, ending with inf.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0]*len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value):
+        self.counts[min(bisect_left(self.buckets, value), len(self.buckets) - 1)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile (or the max, if lower)."""
+        if not self.count:
+            return None
+        rank, seen = q*self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        return {'count': self.count, 'sum': self.sum, 'mean': self.sum/self.count,
+                'min': self.min, 'max': self.max, 'p50': self.quantile(0.5),
+                'p90': self.quantile(0.9), 'p99': self.quantile(0.99),
+                'buckets': {str(bound): count for bound, count in zip(self.buckets, self.counts) if count}}
+
+
+class Metrics:
+    """Thread safe store of the metrics of a run. The module's metrics instance is
+    shared by everything in the process."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget everything recorded so far, i.e. for a new run."""
+        with self._lock:
+            self.started = time.time()
+            self.counters = defaultdict(float)
+            self.histograms = {}
+            self.gauges = {}
+            self.stages = []
+
+    def incr(self, name, value=1):
+        """Add value to a counter."""
+        with self._lock:
+            self.counters[name] += value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        """Add a value to a histogram, which is made with buckets on first use."""
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(buckets)
+            self.histograms[name].observe(value)
+
+    def gauge(self, name, value):
+        """Set a value, e.g. a rate."""
+        with self._lock:
+            self.gauges[name] = value
+
+    @contextmanager
+    def stage(self, name, profile=None):
+        """Time a stage of a run, and log it as it finishes (even if it fails).
+
+        Args:
+            name (str): Name of the stage.
+            profile (iterable of str): Profilers to run (see PROFILERS). Defaults to
+                                       those set by the EIS_PROFILE environment variable.
+        Yields:
+            record (dict): The stage's record, which is filled in when it finishes,
+                           with wall_seconds, cpu_seconds (for the whole process, so
+                           including any other threads) and the paths of any profiles.
+        """
+        record = {'stage': name}
+        profile = profilers() if profile is None else set(profile)
+        cpu_profiler, traced = None, False
+        if 'cpu' in profile:
+            import cProfile
+            cpu_profiler = cProfile.Profile()
+            try:
+                cpu_profiler.enable()
+            except ValueError:  # i.e. another stage is being profiled at the same time
+                logger.warning(f'{name}: not profiled, as another profiler is running')
+                cpu_profiler = None
+        if 'memory' in profile:
+            import tracemalloc
+            # tracemalloc traces the whole process, so only the outermost stage is traced
+            traced = not tracemalloc.is_tracing()
+            if traced:
+                tracemalloc.start(10)
+        start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        except BaseException as exception:
+            record['error'] = repr(exception)
+            raise
+        finally:
+            record['wall_seconds'] = time.perf_counter() - start
+            record['cpu_seconds'] = time.process_time() - cpu_start
+            if cpu_profiler is not None:
+                cpu_profiler.disable()
+                record['cpu_profile'] = self._profile_path(name, 'prof')
+                cpu_profiler.dump_stats(record['cpu_profile'])
+            if traced:
+                record['traced_peak_mb'] = tracemalloc.get_traced_memory()[1]/2**20
+                record['memory_profile'] = self._profile_path(name, 'txt')
+                stats = tracemalloc.take_snapshot().statistics('traceback')
+                tracemalloc.stop()
+                with open(record['memory_profile'], 'w') as f:
+                    for stat in stats[:25]:
+                        f.write(f'{stat}\n' + '\n'.join(stat.traceback.format()) + '\n\n')
+            with self._lock:
+                self.stages.append(record)
+            logger.info(json.dumps(record, default=str), extra={'metrics': record})
+
+    def _profile_path(self, name, extension):
+        os.makedirs(PROFILE_PATH, exist_ok=True)
+        started = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started))
+        return f"{PROFILE_PATH}/{started}-{name.replace('/', '_')}.{extension}"
+
+    def summary(self):
+        """Everything recorded in the run, as a json-serialisable dict."""
+        with self._lock:
+            return {'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                    'wall_seconds': time.time() - self.started,
+                    'counters': dict(self.counters),
+                    'histograms': {name: h.summary() for name, h in self.histograms.items()},
+                    'gauges': dict(self.gauges),
+                    'stages': list(self.stages)}
+
+    def write_summary(self, name='run', path=None):
+        """Log the summary of the run, and write it to json.
+
+        Args:
+            name (str): Name of the run, for the filename.
+            path (str): Path to write to. Defaults to METRICS_PATH/{name}-{time started}.json
+        Returns:
+            path (str)
+        """
+        summary = self.summary()
+        if path is None:
+            started = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started))
+            path = f'{METRICS_PATH}/{name}-{started}.json'
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2, default=str)
+        logger.info(f'{name} summary: {json.dumps(summary, default=str)}',
+                    extra={'metrics': summary})
+        return path
+
+
+metrics = Metrics()
@@ -0,0 +1,244 @@
+"""A small declarative stage graph, in which each stage's output is cached on disk
+under a key which hashes everything it depends on, so that only the stages whose
+inputs have changed are run again.
+
+A stage's key is a hash of its name, the source code of its function and of
+every eis module it imports (directly or not), an optional version string, its
+section of model_config.yaml, the size and modification time of any files it
+reads, and the content hashes of the outputs of its input stages. Since the keys
+depend on the content of the inputs rather than on whether they ran, stages below
+one which re-ran but gave the same output are still skipped.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import ast
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pickle
+import textwrap
+
+import eis
+from eis.metrics import metrics
+
+PIPELINE_PATH = f'{eis.project_dir}/data/interim/pipeline'
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """A stage of a pipeline.
+
+    Args:
+        name (str): Name of the stage, which other stages use to refer to its output.
+        func (function): Computes the stage's (picklable) output, given the outputs of
+                         its inputs as keyword arguments named after the input stages.
+        inputs (tuple of str): Names of the stages whose outputs are needed.
+        config (str): Section of model_config.yaml (eis.config) which the stage depends on.
+        files (tuple of str): Paths of files which the stage reads.
+        version (str): Changing this forces the stage to run again, i.e. when code outside
+                       eis which it calls has changed.
+        always_run (bool): Run the stage every time (its output still keys the stages
+                           below it), i.e. for a stage which checks a remote source.
+        processes (bool): The stage starts worker processes, so it is run on its own in
+                          the main thread rather than alongside other stages.
+    """
+    def __init__(self, name, func, inputs=(), config=None, files=(), version=None, always_run=False,
+                 processes=False):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.config = config
+        self.files = tuple(files)
+        self.version = version
+        self.always_run = always_run
+        self.processes = processes
+
+    def __repr__(self):
+        return f'Stage({self.name!r}, inputs={self.inputs!r})'
+
+    def key(self, input_hashes):
+        """Hash of everything the stage's output depends on.
+
+        Args:
+            input_hashes (dict): Look-up of input stage name --> content hash of its output.
+        Returns:
+            key (str)
+        """
+        try:
+            source = inspect.getsource(self.func)
+        except (OSError, TypeError):
+            source = getattr(self.func, '__qualname__', repr(self.func))
+        config = None if self.config is None else eis.config.get(self.config)
+        files = []
+        for path in self.files:
+            if os.path.exists(path):
+                stat = os.stat(path)
+                files.append((path, stat.st_size, stat.st_mtime_ns))
+            else:
+                files.append((path, None, None))
+        state = json.dumps({'name': self.name, 'source': source, 'modules': module_hashes(source),
+                            'version': self.version, 'config': config, 'files': files,
+                            'inputs': [input_hashes[name] for name in self.inputs]},
+                           sort_keys=True, default=str)
+        return hashlib.sha1(state.encode()).hexdigest()
+
+
+def _module_path(name):
+    """Path of the source of an eis module, without importing it (None if it isn't one)"""
+    path = os.path.join(os.path.dirname(eis.__file__), *name.split('.')[1:])
+    for path in (f'{path}.py', os.path.join(path, '__init__.py')):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _eis_imports(source):
+    """Names of the eis modules (or possibly their attributes) imported in some source code"""
+    try:
+        tree = ast.parse(textwrap.dedent(source))
+    except SyntaxError:
+        return  # i.e. the source of a lambda, which comes with the rest of its line
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            # From a package, the names may be modules too
+            names = [node.module] + [f'{node.module}.{alias.name}' for alias in node.names]
+        else:
+            continue
+        for name in names:
+            if name == 'eis' or name.startswith('eis.'):
+                yield name
+
+
+def module_hashes(source):
+    """Hashes of the source of every eis module which some source code imports, directly
+    or through other eis modules.
+
+    Args:
+        source (str): Source code, i.e. of a stage's function.
+    Returns:
+        hashes (dict): Look-up of module name --> hash of its source.
+    """
+    hashes, names = {}, list(_eis_imports(source))
+    while names:
+        name = names.pop()
+        path = _module_path(name)
+        if name in hashes or path is None:
+            continue
+        with open(path, 'rb') as f:
+            module_source = f.read()
+        hashes[name] = hashlib.sha1(module_source).hexdigest()
+        names.extend(_eis_imports(module_source.decode()))
+    return hashes
+
+
+def content_hash(value):
+    """Hash of a picklable value."""
+    return hashlib.sha1(pickle.dumps(value, protocol=4)).hexdigest()
+
+
+def sort_stages(stages, targets=None):
+    """Check a pipeline, and order its stages so that each comes after its inputs.
+
+    Args:
+        stages (list of Stage): Stages of the pipeline.
+        targets (list of str): Names of the stages wanted, or None for all. Only
+                               these and the stages they depend on are returned.
+    Returns:
+        stages (list of Stage)
+    Raises:
+        ValueError: For duplicate or unknown stage names, or a cycle.
+    """
+    by_name = {}
+    for stage in stages:
+        if stage.name in by_name:
+            raise ValueError(f'Duplicate stage {stage.name}')
+        by_name[stage.name] = stage
+    ordered, done, visiting = [], set(), set()
+
+    def visit(name, path):
+        if name not in by_name:
+            raise ValueError(f"Unknown stage {name}{' needed by ' + path[-1] if path else ''}")
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Cycle in stages: {' -> '.join(path + [name])}")
+        visiting.add(name)
+        for input_name in by_name[name].inputs:
+            visit(input_name, path + [name])
+        visiting.discard(name)
+        done.add(name)
+        ordered.append(by_name[name])
+
+    for name in (by_name if targets is None else targets):
+        visit(name, [])
+    return ordered
+
+
+def _run_stage(stage, inputs, input_hashes, cache_dir, force):
+    """Load the stage's output from the cache, or run it and cache the output"""
+    key = stage.key(input_hashes)
+    path = f'{cache_dir}/{stage.name}-{key}.pkl'
+    if os.path.exists(path) and not (force or stage.always_run):
+        logger.info(f'{stage.name}: unchanged, loading from the cache')
+        metrics.incr('pipeline.cached')
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    logger.info(f'{stage.name}: running')
+    with metrics.stage(f'pipeline.{stage.name}'):
+        output = stage.func(**inputs)
+    output_hash = content_hash(output)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(f'{path}.tmp', 'wb') as f:
+        pickle.dump((output_hash, output), f, protocol=4)
+    os.replace(f'{path}.tmp', path)
+    return output_hash, output
+
+
+def run_pipeline(stages, targets=None, cache_dir=PIPELINE_PATH, n_workers=4, force=()):
+    """Run a pipeline, skipping stages whose cached output is up to date and running
+    independent stages in parallel (in threads). Stages which start worker processes
+    are run in the main thread once no other stage is running, so that no thread is
+    holding a lock when the workers start.
+
+    Args:
+        stages (list of Stage): Stages of the pipeline.
+        targets (list of str): Names of the stages wanted, or None for all.
+        cache_dir (str): Directory for the cached outputs.
+        n_workers (int): Maximum number of stages run at once.
+        force (iterable of str): Names of stages to run even if their output is cached.
+    Returns:
+        outputs (dict): Look-up of stage name --> output, for the targets and the stages they depend on.
+    """
+    stages = sort_stages(stages, targets)
+    force = set(force)
+    outputs, hashes = {}, {}
+    waiting = list(stages)
+    with ThreadPoolExecutor(n_workers) as executor:
+        running = {}
+        while waiting or running:
+            ready = [s for s in waiting if all(name in hashes for name in s.inputs)]
+            for stage in ready:
+                inputs = {name: outputs[name] for name in stage.inputs}
+                input_hashes = {name: hashes[name] for name in stage.inputs}
+                if stage.processes:
+                    if running:
+                        continue  # Until the other stages have finished
+                    waiting.remove(stage)
+                    hashes[stage.name], outputs[stage.name] = _run_stage(stage, inputs, input_hashes,
+                                                                         cache_dir, stage.name in force)
+                    break  # Other stages may now be ready
+                waiting.remove(stage)
+                running[executor.submit(_run_stage, stage, inputs, input_hashes, cache_dir,
+                                        stage.name in force)] = stage
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                # Raises the stage's exception, after the running stages have finished
+                hashes[stage.name], outputs[stage.name] = future.result()
+    return outputs
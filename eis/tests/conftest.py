@@ -0,0 +1,7 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def no_log_files(monkeypatch):
+    """Scripts' main functions set up logging, which shouldn't write to info.log and errors.log"""
+    monkeypatch.setenv('EIS_LOG_FILES', '0')
@@ -0,0 +1,56 @@
+import json
+import pytest
+
+# things we're testing
+from eis.benchmark import BENCHMARKS
+from eis.benchmark import FakeSession
+from eis.benchmark import compare
+from eis.benchmark import main
+from eis.benchmark import make_disciplines
+from eis.benchmark import make_level_counts
+from eis.benchmark import run_benchmarks
+from eis.data.download_courses import discover_course_pages
+
+
+def test_fake_session_serves_every_course():
+    disciplines = make_disciplines(10, n_parents=2)
+    level_counts = make_level_counts(disciplines, 1000)
+    courses = [course for _, _, page in discover_course_pages(FakeSession(level_counts), disciplines)
+               for course in page]
+    assert len(courses) == sum(level_counts.values())
+    assert len({course['id'] for course in courses}) == len(courses)
+
+
+def test_run_benchmarks():
+    results = run_benchmarks(scale=0.01, repeat=1)
+    assert set(results['benchmarks']) == set(BENCHMARKS)
+    for result in results['benchmarks'].values():
+        assert result['seconds'] >= 0 and result['peak_mb'] >= 0
+    with pytest.raises(ValueError):
+        run_benchmarks(['crawl.nothing'])
+
+
+def test_compare():
+    baseline = {'scale': 1, 'benchmarks': {'a': {'seconds': 1.0, 'peak_mb': 10.0},
+                                           'b': {'seconds': 0.001, 'peak_mb': 10.0}}}
+    results = {'scale': 1, 'benchmarks': {'a': {'seconds': 1.2, 'peak_mb': 20.0},
+                                          'b': {'seconds': 0.005, 'peak_mb': 10.0},
+                                          'new': {'seconds': 9.0, 'peak_mb': 9.0}}}
+    assert compare(results, baseline) == ['a: 20.0MB, was 10.0MB']  # b is within timer noise
+    assert len(compare(results, baseline, tolerance=0.1)) == 2
+    with pytest.raises(ValueError):
+        compare(dict(results, scale=0.5), baseline)
+
+
+def test_main(tmp_path, capsys):
+    baseline, output = str(tmp_path / 'baseline.json'), str(tmp_path / 'latest.json')
+    args = ['--only', 'crawl.course_index', '--scale', '0.01', '--repeat', '1',
+            '--baseline', baseline, '--output', output]
+    assert main(args + ['--save-baseline']) == 0
+    with open(baseline) as f:
+        saved = json.load(f)
+    saved['benchmarks']['crawl.course_index']['peak_mb'] = 0.0  # i.e. memory use has since grown
+    with open(baseline, 'w') as f:
+        json.dump(saved, f)
+    assert main(args) == 1
+    assert 'Regression in crawl.course_index' in capsys.readouterr().out
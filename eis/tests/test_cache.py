@@ -0,0 +1,90 @@
+import pickle
+from datetime import datetime, timedelta
+from unittest import mock
+
+# things we're testing
+from eis.data.cache import DiskCache
+from eis.data.cache import memoize
+
+PATH = 'eis.data.cache.{}'  # For mocking
+
+
+def test_get_set_delete(tmp_path):
+    cache = DiskCache(tmp_path / 'cache.sqlite')
+    assert cache.get('a') is None
+    cache.set('a', b'value')
+    assert cache.get('a') == b'value'
+    cache.set('a', b'new value')
+    assert cache.get('a') == b'new value'
+    assert cache.total_bytes() == len(b'new value')
+    cache.delete('a')
+    assert cache.get('a') is None
+    assert cache.total_bytes() == 0
+
+
+def test_persistent(tmp_path):
+    DiskCache(tmp_path / 'cache.sqlite').set('a', b'value')
+    assert DiskCache(tmp_path / 'cache.sqlite').get('a') == b'value'
+
+
+def test_ttl_by_prefix(tmp_path):
+    cache = DiskCache(tmp_path / 'cache.sqlite', default_ttl=10,
+                      ttls={'https://a.com/': 100, 'https://a.com/slow/': None})
+    assert cache.ttl('https://b.com/') == 10
+    assert cache.ttl('https://a.com/?q=1') == 100
+    assert cache.ttl('https://a.com/slow/?q=1') is None
+    with mock.patch(PATH.format('time.time'), return_value=0):
+        cache.set('https://b.com/', b'b')
+        cache.set('https://a.com/', b'a')
+        cache.set('https://a.com/slow/', b'slow')
+        cache.set('https://a.com/soon', b'soon', expires=5)  # i.e. from cachecontrol
+        cache.set('https://a.com/later', b'later', expires=datetime.fromtimestamp(0) + timedelta(seconds=500))
+    with mock.patch(PATH.format('time.time'), return_value=50):
+        assert cache.get('https://b.com/') is None
+        assert cache.get('https://a.com/soon') is None
+        assert cache.get('https://a.com/') == b'a'
+        assert cache.get('https://a.com/later') == b'later'  # Capped at the TTL, which is still to come
+    with mock.patch(PATH.format('time.time'), return_value=10**9):
+        assert cache.get('https://a.com/') is None
+        assert cache.get('https://a.com/later') is None
+        assert cache.get('https://a.com/slow/') == b'slow'
+
+
+def test_lru_eviction(tmp_path):
+    cache = DiskCache(tmp_path / 'cache.sqlite', max_bytes=30, default_ttl=None)
+    for i, key in enumerate('abc'):
+        with mock.patch(PATH.format('time.time'), return_value=i):
+            cache.set(key, b'0123456789')
+    with mock.patch(PATH.format('time.time'), return_value=3):
+        cache.get('a')  # 'b' is now the least recently used
+    with mock.patch(PATH.format('time.time'), return_value=4):
+        cache.set('d', b'0123456789')
+    assert cache.get('b') is None
+    assert all(cache.get(key) is not None for key in 'acd')
+    assert cache.total_bytes() == 30
+
+
+def test_pickle(tmp_path):
+    cache = DiskCache(tmp_path / 'cache.sqlite', ttls={'a': 1})
+    cache.set('a', b'value')
+    unpickled = pickle.loads(pickle.dumps(cache))
+    assert unpickled.ttls == {'a': 1}
+    assert unpickled.get('a') == b'value'
+
+
+def test_memoize(tmp_path):
+    cache = DiskCache(tmp_path / 'cache.sqlite', ttls={'test:square': None})
+    calls = []
+
+    @memoize(cache, 'test')
+    def square(x, offset=0):
+        calls.append(x)
+        return {'result': x*x + offset}
+
+    assert square(3) == square(3) == {'result': 9}
+    assert square(3, offset=1) == {'result': 10}
+    assert calls == [3, 3]
+    square.invalidate(3)
+    assert square(3) == {'result': 9}
+    assert calls == [3, 3, 3]
+    assert cache.ttl("test:square:(3,):[]") is None
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# things we're testing
+from eis.estimators.correlation import batched_corr
+from eis.estimators.correlation import bootstrap_correlations
+from eis.estimators.correlation import indicator_correlations
+from eis.estimators.correlation import stack_panel
+
+
+@pytest.fixture
+def matrices():
+    rng = np.random.RandomState(0)
+    countries = [f'C{i}' for i in range(12)]
+    matrices = {}
+    for name in ['a', 'b', 'c']:
+        values = rng.randint(0, 6, (12, 4)).astype(float)
+        values[rng.rand(12, 4) < 0.2] = np.nan
+        matrices[name] = pd.DataFrame(values, index=countries, columns=[2010, 2011, 2012, 2013])
+    matrices['c'] = matrices['c'].drop('C0')
+    return matrices
+
+
+def notebook_corr(matrices, years, method):
+    """The original per-year correlations, averaged over years one pair at a time"""
+    es_merged = pd.concat([m.reset_index().melt(id_vars='index', var_name='year', value_name=k)
+                           .set_index(['index', 'year']) for k, m in matrices.items()], axis=1).reset_index()
+    corrs = [es_merged.loc[es_merged['year'] == y].drop(columns='year').set_index('index').corr(method=method)
+             for y in years]
+    return pd.DataFrame({v: {w: 1.0 if v == w else np.nanmean([c.loc[v, w] for c in corrs]) for w in matrices}
+                         for v in matrices})
+
+
+def test_stack_panel(matrices):
+    values, years, countries, indicators = stack_panel(matrices, years=[2011, 2012, 2020])
+    assert values.shape == (3, 12, 3)
+    assert np.isnan(values[2]).all() and np.isnan(values[:, 0, 2]).all()
+    assert values[0, 1, 0] == matrices['a'].loc['C1', 2011] or np.isnan(matrices['a'].loc['C1', 2011])
+
+
+@pytest.mark.parametrize('method', ['pearson', 'spearman'])
+def test_matches_pandas(matrices, method):
+    values, years, _, _ = stack_panel(matrices)
+    for y, corr in zip(years, batched_corr(values, method)):
+        expected = pd.DataFrame(values[y - 2010]).corr(method=method).values
+        np.testing.assert_allclose(corr, expected, atol=1e-12)
+    corr = indicator_correlations(matrices, years, method)
+    pd.testing.assert_frame_equal(corr, notebook_corr(matrices, years, method)[list(matrices)].loc[list(matrices)])
+
+
+def test_bootstrap_correlations(matrices):
+    low, high = bootstrap_correlations(matrices, n_boot=40, batch_size=16, seed=1)
+    corr = indicator_correlations(matrices)
+    assert (low.values <= high.values).all()
+    assert np.allclose(np.diag(low), 1) and np.allclose(np.diag(high), 1)
+    assert low.loc['a', 'b'] < corr.loc['a', 'b'] < high.loc['a', 'b']
+    with pytest.raises(ValueError):
+        batched_corr(np.zeros((3, 2)), method='kendall')
@@ -0,0 +1,132 @@
+import json
+import numpy as np
+import pytest
+import zipfile
+
+from eis.data.course_shards import JsonShardWriter
+from eis.transformers.digital_skills import KeywordMatcher
+from eis.transformers.digital_skills import tag_corpus
+
+# things we're testing
+from eis.data.course_cube import CourseCube
+from eis.data.course_cube import CubeShardWriter
+from eis.data.course_cube import build_cube
+from eis.data.course_cube import shard_courses
+
+TAXONOMY = {'data_ai': {'keywords': ['machine learning'], 'disciplines': ['Machine Learning']},
+            'software': {'keywords': ['software']}}
+
+DISCIPLINES = [{'discipline_id': 10, 'discipline_title': 'Computing', 'parent': None},
+               {'discipline_id': 11, 'discipline_title': 'Machine Learning',
+                'parent': {'discipline_id': 10, 'discipline_title': 'Computing'}},
+               {'discipline_id': 12, 'discipline_title': 'Software',
+                'parent': {'discipline_id': 10, 'discipline_title': 'Computing'}},
+               {'discipline_id': 20, 'discipline_title': 'Arts', 'parent': None},
+               {'discipline_id': 21, 'discipline_title': 'Painting',
+                'parent': {'discipline_id': 20, 'discipline_title': 'Arts'}}]
+
+
+def course(ci, di, title, countries):
+    return {'id': ci, 'title': title, 'summary': None, 'discipline_id': di,
+            'discipline_title': {11: 'Machine Learning', 12: 'Software', 21: 'Painting'}[di],
+            'venues': [{'city': 'A city', 'country': country} for country in countries]}
+
+
+COURSES = {(11, 'master'): [course(1, 11, 'Statistics', ['France', 'Spain', 'France']),
+                            course(2, 11, 'Software for machine learning', ['Spain'])],
+           (12, 'master'): [course(2, 12, 'Software for machine learning', ['Spain'])],
+           (12, 'bachelor'): [course(3, 12, 'Software', [])],
+           (21, 'bachelor'): [course(4, 21, 'Oil painting', ['Spain']),
+                              course(5, 21, 'Watercolours', ['France'])]}
+
+
+def make_archive(path):
+    with zipfile.ZipFile(path, 'w') as archive:
+        for (di, lvl), courses in COURSES.items():
+            archive.writestr(f'courses/{di}/{lvl}/{di}-{lvl}-1000.json', json.dumps(courses))
+        archive.writestr('courses/discipline_dictionary.json', json.dumps(DISCIPLINES))
+    return str(path)
+
+
+def test_shard_courses(tmp_path):
+    assert shard_courses(COURSES[(11, 'master')]) == [[1, ['France', 'Spain'], 0], [2, ['Spain'], 0]]
+    # Bitmasks of the categories; every course in Machine Learning is data_ai
+    matcher = KeywordMatcher(TAXONOMY)
+    assert shard_courses(COURSES[(11, 'master')], matcher) == [[1, ['France', 'Spain'], 0b01],
+                                                               [2, ['Spain'], 0b11]]
+    assert shard_courses(COURSES[(12, 'bachelor')], matcher) == [[3, ['Unknown'], 0b10]]
+    # The same from labels which are already known
+    tags = tag_corpus(make_archive(tmp_path / 'courses.zip'), TAXONOMY, n_processes=0)
+    for courses in COURSES.values():
+        assert shard_courses(courses, matcher, tags) == shard_courses(courses, matcher)
+
+
+def test_build_cube(tmp_path):
+    cube = build_cube(make_archive(tmp_path / 'courses.zip'), KeywordMatcher(TAXONOMY))
+    assert cube.labels == {'discipline': [11, 12, 21], 'level': ['bachelor', 'master'],
+                           'country': ['France', 'Spain', 'Unknown'],
+                           'tag': ['all', 'digital', 'data_ai', 'software']}
+    assert cube.shape == (3, 2, 3, 4)
+    assert cube.count() == 7
+    assert cube.select(discipline=11, level='master').tolist() == [1, 2, 0]
+    assert cube.count(level='master', country='Spain', tag='software') == 2
+    assert cube.select(discipline=[21, 11], country='Spain', tag=['all', 'digital']).tolist() == \
+        [[[1, 0], [0, 0]], [[0, 0], [2, 2]]]
+    # Parents count each course once, although course 2 is under two of its children
+    assert cube.parent_ids == [10, 20] and cube.children(10) == [11, 12]
+    assert cube.count(parent=10, country='Spain') == 2
+    assert cube.count(parent=10, tag='software') == 2
+    assert cube.select(parent=[10, 20], level='bachelor', country=None).tolist() == [[0, 0, 1], [1, 1, 0]]
+    assert cube.rollup().count(discipline=10) == cube.count(parent=10) == 4
+    assert cube.count(discipline=[11, 12]) == 5
+    with pytest.raises(ValueError):
+        cube.select(discipline=11, parent=10)
+    with pytest.raises(KeyError):
+        cube.select(country='Atlantis')
+    frame = cube.to_frame()
+    assert frame['n_courses'].sum() == cube.counts.sum()
+    assert set(frame.loc[frame['discipline'] == 21, 'discipline_title']) == {'Painting'}
+
+
+def test_build_cube_from_tags(tmp_path):
+    path, matcher = make_archive(tmp_path / 'courses.zip'), KeywordMatcher(TAXONOMY)
+    cube = build_cube(path, matcher, tags=tag_corpus(path, TAXONOMY, n_processes=0))
+    expected = build_cube(path, matcher)
+    assert np.array_equal(cube.counts, expected.counts) and np.array_equal(cube.parent_counts,
+                                                                           expected.parent_counts)
+    with pytest.raises(ValueError):
+        build_cube(path, matcher, tags=tag_corpus(path, {'other': {'keywords': ['x']}}, n_processes=0))
+
+
+def test_save_load(tmp_path):
+    cube = build_cube(make_archive(tmp_path / 'courses.zip'))
+    cube.save(str(tmp_path / 'cube.npz'))
+    loaded = CourseCube.load(str(tmp_path / 'cube.npz'))
+    assert np.array_equal(loaded.counts, cube.counts) and loaded.labels == cube.labels
+    assert loaded.parents == cube.parents == [10, 10, 20] and loaded.titles == cube.titles
+    assert np.array_equal(loaded.parent_counts, cube.parent_counts)
+
+
+def test_cube_shard_writer(tmp_path):
+    matcher = KeywordMatcher(TAXONOMY)
+    expected = build_cube(make_archive(tmp_path / 'courses.zip'), matcher)
+    journal = str(tmp_path / 'cube.jsonl')
+    writer = CubeShardWriter(JsonShardWriter(str(tmp_path)), journal, matcher)
+    for (di, lvl), courses in COURSES.items():
+        writer.write(courses, di, lvl, 1000)
+    cube = writer.cube(DISCIPLINES)
+    assert np.array_equal(cube.counts, expected.counts) and np.array_equal(cube.parent_counts,
+                                                                           expected.parent_counts)
+    # Resuming adds to the journal, rewriting a shard replaces its counts and removing a bucket drops them
+    writer = CubeShardWriter(JsonShardWriter(str(tmp_path)), journal, matcher, reset=False)
+    writer.write(COURSES[(11, 'master')], 11, 'master', 1000)
+    writer.remove(21, 'bachelor')
+    assert not writer.shards(21, 'bachelor')
+    cube = writer.cube(DISCIPLINES)
+    assert cube.count() == 5 and cube.count(discipline=21) == 0
+    assert cube.count(discipline=11) == expected.count(discipline=11)
+    with pytest.raises(ValueError):
+        writer.write([1, 2], 11, 'master', 2000)
+    # A fresh crawl starts a new journal
+    writer = CubeShardWriter(JsonShardWriter(str(tmp_path)), journal, matcher)
+    assert writer.cube(DISCIPLINES).count() == 0
@@ -0,0 +1,49 @@
+import numpy as np
+
+# things we're testing
+from eis.data.course_index import CourseDisciplineIndex
+
+COURSE_DISCIPLINE_LOOKUP = {10: [1, 2], 11: [2], 12: [3, 1, 2], 40: [3]}
+
+
+def test_from_lookup_round_trip():
+    index = CourseDisciplineIndex.from_lookup(COURSE_DISCIPLINE_LOOKUP)
+    course_discipline_lookup, discipline_course_lookup = index.to_lookups()
+    assert course_discipline_lookup == {ci: sorted(dis) for ci, dis in COURSE_DISCIPLINE_LOOKUP.items()}
+    assert discipline_course_lookup == {1: [10, 12], 2: [10, 11, 12], 3: [12, 40]}
+    assert len(index) == 7
+    assert (index.n_courses, index.n_disciplines) == (4, 3)
+
+
+def test_json_keys_and_duplicates():
+    index = CourseDisciplineIndex.from_lookup({'10': [1, 1, 2], '11': [2]})
+    assert index.to_lookups()[0] == {10: [1, 2], 11: [2]}
+
+
+def test_lookups():
+    index = CourseDisciplineIndex.from_lookup(COURSE_DISCIPLINE_LOOKUP)
+    assert index.courses_for(2).tolist() == [10, 11, 12]
+    assert index.disciplines_for(12).tolist() == [1, 2, 3]
+    # Unknown ids, including out of range
+    assert index.courses_for(0).tolist() == []
+    assert index.courses_for(1000).tolist() == []
+    assert index.disciplines_for(13).tolist() == []
+    assert index.disciplines_for(-1).tolist() == []
+    assert index.discipline_counts().tolist() == [2, 3, 2]
+
+
+def test_set_operations():
+    index = CourseDisciplineIndex.from_lookup(COURSE_DISCIPLINE_LOOKUP)
+    assert index.union([1, 3]).tolist() == [10, 12, 40]
+    assert index.intersection([1, 2, 3]).tolist() == [12]
+    assert index.difference([2], [3]).tolist() == [10, 11]
+    assert index.union([]).tolist() == index.intersection([]).tolist() == []
+
+
+def test_save_load(tmp_path):
+    index = CourseDisciplineIndex.from_lookup(COURSE_DISCIPLINE_LOOKUP)
+    index.save(tmp_path / 'index.npz')
+    loaded = CourseDisciplineIndex.load(tmp_path / 'index.npz')
+    for field in CourseDisciplineIndex._fields:
+        assert np.array_equal(getattr(index, field), getattr(loaded, field))
+    assert loaded.disciplines_for(10).tolist() == [1, 2]
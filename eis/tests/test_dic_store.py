@@ -0,0 +1,61 @@
+import pandas as pd
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# things we're testing
+from eis.data.cache import DiskCache
+from eis.data.dic_store import DicStore
+from eis.data.dic_store import parse_toc_date
+from eis.data.dic_store import structure_changed
+
+
+def test_parse_toc_date():
+    assert parse_toc_date('02.01.1970') == 24*60*60
+    assert parse_toc_date('1970-01-02T01:00:00+0100') == 24*60*60
+    assert parse_toc_date(' ') is None
+    assert parse_toc_date(float('nan')) is None
+
+
+def test_structure_changed():
+    toc = pd.DataFrame({'code': ['a', 'a'], 'last table structure change': ['02.01.1970', '03.01.1970']})
+    assert structure_changed(toc) == 2*24*60*60
+    assert structure_changed(toc[['code']]) is None
+
+
+def test_fetch_once(tmp_path):
+    calls = []
+
+    def fetch(dim):
+        calls.append(dim)
+        return {'UK': 'United Kingdom'}
+
+    store = DicStore(fetch, DiskCache(tmp_path / 'cache.sqlite'))
+    assert store.get('geo') == store.get('geo', changed=0) == {'UK': 'United Kingdom'}
+    assert calls == ['geo']
+    # Read back from disk by a new store, until a table's structure changes
+    store = DicStore(fetch, DiskCache(tmp_path / 'cache.sqlite'))
+    assert store.get('geo', changed=0) == {'UK': 'United Kingdom'}
+    assert calls == ['geo']
+    store.get('geo', changed=10**12)
+    assert calls == ['geo', 'geo']
+
+
+def test_fetch_outside_lock():
+    calls, geo_started, release_geo = [], threading.Event(), threading.Event()
+
+    def fetch(dim):
+        calls.append(dim)
+        if dim == 'geo':
+            geo_started.set()
+            assert release_geo.wait(5)
+        return {'dim': dim}
+
+    store = DicStore(fetch)
+    with ThreadPoolExecutor(3) as pool:
+        geo = [pool.submit(store.get, 'geo') for _ in range(2)]
+        assert geo_started.wait(5)
+        # Other dimensions aren't held up by a slow download
+        assert pool.submit(store.get, 'unit').result(timeout=5) == {'dim': 'unit'}
+        release_geo.set()
+        assert [future.result(timeout=5) for future in geo] == [{'dim': 'geo'}] * 2
+    assert sorted(calls) == ['geo', 'unit']  # Tables waiting on the same dimension share its download
@@ -0,0 +1,81 @@
+import json
+import numpy as np
+import zipfile
+
+from eis.data.course_index import CourseDisciplineIndex
+
+# things we're testing
+from eis.transformers.digital_skills import CourseTags
+from eis.transformers.digital_skills import KeywordMatcher
+from eis.transformers.digital_skills import normalise
+from eis.transformers.digital_skills import read_taxonomy
+from eis.transformers.digital_skills import tag_corpus
+
+TAXONOMY = {'data_ai': {'keywords': ['machine learning', 'AI', 'data'],
+                        'disciplines': ['Machine Learning']},
+            'software': {'keywords': ['software', 'C++', 'machine learning systems']},
+            'business': {'keywords': ['e-commerce']}}
+
+COURSES = {(331, 'bachelor'): [{'id': 1, 'title': 'Machine-Learning&nbsp;Systems', 'summary': None,
+                                'discipline_title': 'Machine Learning'},
+                               {'id': 2, 'title': 'Speech Pathology', 'summary': 'Rain and paint',
+                                'discipline_title': 'Machine Learning'}],
+           (40, 'master'): [{'id': 1, 'title': 'Machine-Learning&nbsp;Systems', 'summary': None,
+                             'discipline_title': 'Business'},
+                            {'id': 3, 'title': 'Retail', 'summary': 'E commerce with AI.',
+                             'discipline_title': 'Business'}]}
+
+
+def make_archive(path):
+    with zipfile.ZipFile(path, 'w') as archive:
+        for (di, lvl), courses in COURSES.items():
+            archive.writestr(f'courses/{di}/{lvl}/{di}-{lvl}-1000.json', json.dumps(courses))
+        archive.writestr('courses/discipline_dictionary.json', '[]')
+    return str(path)
+
+
+def test_taxonomy_compiles():
+    matcher = KeywordMatcher(read_taxonomy())
+    assert matcher.text_labels(['A degree in cyber-security']).item() != 0
+
+
+def test_keyword_matcher():
+    matcher = KeywordMatcher(TAXONOMY)
+    assert normalise('E-Commerce/Data&nbsp;x') == 'e commerce data x'
+    # Whole words only, and the longest keyword at each position
+    assert matcher.find(normalise('Rain, AI and machine  learning systems in C++')) == \
+        [(6, 'ai'), (13, 'machine learning systems'), (42, 'c++')]
+    labels = matcher.text_labels(['Machine learning', 'Software for e-commerce', '', 'painting'])
+    assert labels.tolist() == [0b001, 0b110, 0, 0]
+    assert matcher.discipline_labels(['Machine Learning', 'Business', None]).tolist() == [1, 0, 0]
+
+
+def test_tag_corpus(tmp_path):
+    path = make_archive(tmp_path / 'courses.zip')
+    tags = tag_corpus(path, TAXONOMY, n_processes=0, members_per_batch=1)
+    assert tags.course_ids.tolist() == [1, 2, 3]
+    assert tags.text_labels.tolist() == [0b010, 0, 0b101]  # The longest keyword wins
+    assert tags.discipline_labels.tolist() == [0b001, 0b001, 0]
+    assert tags.is_digital(disciplines=False).tolist() == [True, False, True]
+    assert tags.is_digital().tolist() == [True, True, True]
+    assert tags.has_category('software').tolist() == [True, False, False]
+    # The same in worker processes
+    in_processes = tag_corpus(path, TAXONOMY, n_processes=2)
+    assert np.array_equal(in_processes.text_labels, tags.text_labels)
+
+    frame = tags.to_frame(disciplines=False)
+    assert frame.loc[3].tolist() == [True, False, True, True]
+
+    tags.save(str(tmp_path / 'tags.npz'))
+    loaded = CourseTags.load(str(tmp_path / 'tags.npz'))
+    assert loaded.categories == ['data_ai', 'software', 'business']
+    assert np.array_equal(loaded.labels(), tags.labels())
+
+
+def test_join_with_course_index(tmp_path):
+    tags = tag_corpus(make_archive(tmp_path / 'courses.zip'), TAXONOMY, n_processes=0)
+    assert tags.positions([3, 1, 99]).tolist() == [2, 0, -1]
+    index = CourseDisciplineIndex([1, 2, 1, 3, 99], [331, 331, 40, 40, 40])
+    discipline_ids, shares = tags.discipline_shares(index, disciplines=False)
+    assert discipline_ids.tolist() == [40, 331]
+    assert np.allclose(shares, [2/3, 1/2])  # Course 99 wasn't tagged, so isn't digital
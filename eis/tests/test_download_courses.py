@@ -1,3 +1,6 @@
+import json
+import numpy as np
+import pytest
 from unittest import mock
 
 # things we're testing
@@ -5,18 +8,27 @@ from eis.data.download_courses import BACHELOR_DISCIPLINES_URL
 from eis.data.download_courses import SEARCH_FACETS_URL
 from eis.data.download_courses import SEARCH_URL
 from eis.data.download_courses import PAGE_SIZE
+from eis.data.download_courses import discipline_url
 from eis.data.download_courses import discover_disciplines
 from eis.data.download_courses import discover_level_count
 from eis.data.download_courses import _discover_courses
+from eis.data.download_courses import _fetch_page
 from eis.data.download_courses import discover_courses
+from eis.data.download_courses import discover_course_pages
 from eis.data.download_courses import standardise_ddsl
 from eis.data.download_courses import download_courses
+from eis.data.download_courses import read_journal
+from eis.data.download_courses import read_course_store
+
+from eis.data.course_cube import CourseCube
+from eis.data.course_shards import ParquetShardWriter
+from eis.data.course_shards import read_parquet_courses
 
 # things we're obviously not testing
 from eis.data.download_courses import os
 from eis.data.download_courses import requests
+from eis.data.download_courses import array
 from eis.data.download_courses import defaultdict
-from eis.data.download_courses import SortedList
 
 PATH = 'eis.data.download_courses.{}'  # For mocking
 
@@ -31,6 +43,17 @@ def test_page_size_is_ten():
     assert PAGE_SIZE == 10
 
 
+def test_discipline_url():
+    page = 'https://www.bachelorsportal.com/disciplines/24/natural-sciences.html'
+    assert discipline_url(page, '/disciplines/90/maths.html') == 'https://www.bachelorsportal.com/disciplines/90/maths.html'
+    # Links are followed on a stand-in for the portal, however they are written
+    stand_in = 'http://127.0.0.1:8000/www.bachelorsportal.com/disciplines/'
+    with mock.patch(PATH.format('BACHELOR_DISCIPLINES_URL'), stand_in):
+        for href in ('/disciplines/90/maths.html', '../90/maths.html',
+                     'https://www.bachelorsportal.com/disciplines/90/maths.html'):
+            assert discipline_url(f'{stand_in}24/natural-sciences.html', href) == f'{stand_in}90/maths.html'
+
+
 @mock.patch(PATH.format('BeautifulSoup'))
 def test_discover_disciplines(_mocked_soup):
     n = 3  # number of results returned each time
@@ -117,15 +140,211 @@ def test_discover_courses(mocked___discover_courses, mocked_discover_level_count
 
 
 def test_standardise_ddsl():
-    ddsl = defaultdict(SortedList)
+    ddsl = defaultdict(lambda: array('q'))
     expected_output = {"a": [1, 2, 3, 4],
                        "b": ["a", "b", "c"]}
-    # Insert elements in a jumbled order
-    ddsl["a"].add(2)
-    ddsl["a"].add(1)
-    ddsl["a"].add(3)
-    ddsl["a"].add(4)
-    ddsl["b"].add('b')
-    ddsl["b"].add('c')
-    ddsl["b"].add('a')
-    assert standardise_ddsl(ddsl) == expected_output
+    ddsl["a"].extend([1, 2, 3, 4])
+    ddsl["b"] = ("a", "b", "c")
+    output = standardise_ddsl(ddsl)
+    assert output == expected_output
+    assert json.loads(json.dumps(output)) == expected_output
+
+
+class FakeStudyPortal:
+    """Stand-in for a requests session, serving deterministic level counts and pages."""
+    levels = {'bachelor': 23, 'master': 7}
+
+    def __init__(self, changes=None):
+        self.changes = changes or {}  # Override the level counts for (di, lvl)
+
+    def count(self, di, lvl):
+        return self.changes.get((di, lvl), self.levels[lvl])
+
+    def course_id(self, di, lvl, i):
+        return 1000*di + 100*list(self.levels).index(lvl) + i
+
+    def get(self, url, params):
+        response = mock.Mock()
+        if url == SEARCH_FACETS_URL:
+            di = int(params['q'][3:])
+            response.json.return_value = {'lv': {lvl: self.count(di, lvl) for lvl in self.levels}}
+        else:
+            di, _, lvl = params['q'].split('|')[:3]
+            di, lvl = int(di[3:]), lvl[3:]
+            start = params['start']
+            stop = min(start + PAGE_SIZE, self.count(di, lvl))
+            response.json.return_value = [{'id': self.course_id(di, lvl, i), 'level': lvl,
+                                           'logo': 'boring'} for i in range(start, stop)]
+        return response
+
+
+def test_discover_course_pages_concurrent_matches_serial():
+    disciplines = [{'discipline_id': 0, 'discipline_title': 'Zero', 'parent': None},
+                   {'discipline_id': 1, 'discipline_title': 'One', 'parent': 0},
+                   {'discipline_id': 2, 'discipline_title': 'Two', 'parent': 0}]
+    session = FakeStudyPortal()
+    serial = list(discover_course_pages(session, disciplines))
+    concurrent = list(discover_course_pages(session, disciplines, n_workers=4))
+    assert serial == concurrent
+    # Flattening the pages gives exactly the output of discover_courses
+    flat = [(key, course) for key, _, courses in serial for course in courses]
+    assert flat == list(discover_courses(session, disciplines))
+    assert len(flat) == 2*sum(FakeStudyPortal.levels.values())
+
+
+DISCIPLINES = [{'discipline_id': 0, 'discipline_title': 'Zero', 'parent': None},
+               {'discipline_id': 1, 'discipline_title': 'One', 'parent': 0},
+               {'discipline_id': 2, 'discipline_title': 'Two', 'parent': 0}]
+
+
+def read_output(path):
+    """Read every json file written by download_courses into a dict of relative path --> json"""
+    output = {}
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            if not filename.endswith('.json'):
+                continue
+            with open(os.path.join(root, filename)) as f:
+                output[os.path.relpath(os.path.join(root, filename), path)] = json.load(f)
+    return output
+
+
+@mock.patch(PATH.format('discover_disciplines'), return_value=DISCIPLINES)
+@mock.patch(PATH.format('cachecontrol'))
+def test_download_courses_resume(mocked_cachecontrol, _mocked_discover_disciplines, tmp_path):
+    mocked_cachecontrol.CacheControl.return_value = FakeStudyPortal()
+    complete, crashed = tmp_path / 'complete', tmp_path / 'crashed'
+    complete.mkdir()
+    crashed.mkdir()
+    with mock.patch(PATH.format('DATA_PATH'), str(complete)):
+        download_courses(flush_count=4)
+    # Crash part of the way through a (di, lvl), then resume
+    with mock.patch(PATH.format('DATA_PATH'), str(crashed)):
+        with mock.patch(PATH.format('_fetch_page'), side_effect=[_fetch_page(FakeStudyPortal(), 1, 'bachelor', 0),
+                                                                 _fetch_page(FakeStudyPortal(), 1, 'bachelor', 1),
+                                                                 OSError]):
+            with pytest.raises(OSError):
+                download_courses(flush_count=4)
+        with mock.patch(PATH.format('_fetch_page'), wraps=_fetch_page) as mocked_fetch_page:
+            download_courses(flush_count=4, resume=True)
+    assert read_output(complete) == read_output(crashed)
+    # Of the 8 pages, only page 0 of (1, bachelor) is skipped, but (1, bachelor) then
+    # needs fingerprinting from its first and last pages
+    assert mocked_fetch_page.call_count == 7 + 2
+    # The journal records the position after every file, and the end of every (di, lvl)
+    with mock.patch(PATH.format('DATA_PATH'), str(complete)):
+        records = read_journal()
+    assert records[0] == {'di': 1, 'lvl': 'bachelor', 'count': 4, 'page': 0, 'offset': 4,
+                          'shard': '1/bachelor/1-bachelor-4.json'}
+    assert sum(record.get('done', False) for record in records) == 4
+
+
+@mock.patch(PATH.format('discover_disciplines'), return_value=DISCIPLINES)
+@mock.patch(PATH.format('cachecontrol'))
+def test_download_courses_incremental(mocked_cachecontrol, _mocked_discover_disciplines, tmp_path):
+    changed_portal = FakeStudyPortal(changes={(2, 'bachelor'): 31})
+    complete, refreshed = tmp_path / 'complete', tmp_path / 'refreshed'
+    complete.mkdir()
+    refreshed.mkdir()
+    mocked_cachecontrol.CacheControl.return_value = changed_portal
+    with mock.patch(PATH.format('DATA_PATH'), str(complete)):
+        download_courses(flush_count=4)
+    # Crawl the original state, and then refresh to the changed state
+    with mock.patch(PATH.format('DATA_PATH'), str(refreshed)):
+        mocked_cachecontrol.CacheControl.return_value = FakeStudyPortal()
+        download_courses(flush_count=4)
+        mocked_cachecontrol.CacheControl.return_value = changed_portal
+        with mock.patch(PATH.format('_fetch_page'), wraps=_fetch_page) as mocked_fetch_page:
+            download_courses(flush_count=4, incremental=True)
+    assert read_output(complete) == read_output(refreshed)
+    # Fingerprinting fetches the first and last pages (2 + 1 + 2 + 1), then only the
+    # 4 pages of (2, bachelor) are crawled
+    assert mocked_fetch_page.call_count == 6 + 4
+
+
+class MultiDisciplinePortal(FakeStudyPortal):
+    """Stand-in for a requests session, where every course is in every discipline."""
+    def course_id(self, di, lvl, i):
+        return 100*list(self.levels).index(lvl) + i
+
+
+@mock.patch(PATH.format('discover_disciplines'), return_value=DISCIPLINES)
+@mock.patch(PATH.format('cachecontrol'))
+def test_download_courses_dedup(mocked_cachecontrol, _mocked_discover_disciplines, tmp_path):
+    mocked_cachecontrol.CacheControl.return_value = MultiDisciplinePortal()
+    full, dedup = tmp_path / 'full', tmp_path / 'dedup'
+    full.mkdir()
+    dedup.mkdir()
+    with mock.patch(PATH.format('DATA_PATH'), str(full)):
+        download_courses(flush_count=4)
+    with mock.patch(PATH.format('DATA_PATH'), str(dedup)):
+        download_courses(flush_count=4, dedup=True)
+        store = read_course_store()
+        with open(f'{dedup}/course_store.jsonl') as f:
+            assert len(f.readlines()) == len(store) == 30  # Each course stored once
+    full_output, dedup_output = read_output(full), read_output(dedup)
+    # Same look-ups, and same files, but with ids in place of courses
+    for filename, courses in full_output.items():
+        if filename.endswith('_lookup.json'):
+            assert dedup_output[filename] == courses
+        elif filename.count(os.sep) == 2:
+            assert dedup_output[filename] == [course['id'] for course in courses]
+            for course in courses:
+                assert store[course['id']] == {k: v for k, v in course.items()
+                                               if k not in ('discipline_title', 'discipline_id')}
+
+
+@mock.patch(PATH.format('discover_disciplines'), return_value=DISCIPLINES)
+@mock.patch(PATH.format('cachecontrol'))
+def test_download_courses_parquet(mocked_cachecontrol, _mocked_discover_disciplines, tmp_path):
+    pytest.importorskip('pyarrow')
+    mocked_cachecontrol.CacheControl.return_value = FakeStudyPortal()
+    with mock.patch(PATH.format('DATA_PATH'), str(tmp_path)):
+        download_courses(flush_count=4)
+        json_output = read_output(tmp_path)
+        download_courses(flush_count=4, shard_writer=ParquetShardWriter(f'{tmp_path}/parquet'))
+        records = read_journal()
+    courses = read_parquet_courses(f'{tmp_path}/parquet',
+                                   columns=['id', 'level', 'discipline_id', 'extra'])
+    expected = sorted((course['id'], course['level'], course['discipline_id'])
+                      for filename, shard in json_output.items() if filename.count(os.sep) == 2
+                      for course in shard)
+    assert sorted(zip(courses['id'], courses['level'], courses['discipline_id'])) == expected
+    assert courses['extra'].isnull().all()
+    # Only read the requested partitions
+    courses = read_parquet_courses(f'{tmp_path}/parquet', columns=['id'], disciplines=[2], levels=['master'])
+    assert sorted(courses['id']) == list(range(2100, 2107))
+    # The journal only records each file once it is complete
+    assert [record['shard'] for record in records] == [f'discipline_id={di}/level={lvl}/{di}-{lvl}.parquet'
+                                                       for di in (1, 2) for lvl in ('bachelor', 'master')]
+
+
+@mock.patch(PATH.format('discover_disciplines'), return_value=DISCIPLINES)
+@mock.patch(PATH.format('cachecontrol'))
+def test_download_courses_cube(mocked_cachecontrol, _mocked_discover_disciplines, tmp_path):
+    changed_portal = FakeStudyPortal(changes={(2, 'bachelor'): 31})
+    complete, refreshed = tmp_path / 'complete', tmp_path / 'refreshed'
+    complete.mkdir()
+    refreshed.mkdir()
+    mocked_cachecontrol.CacheControl.return_value = changed_portal
+    with mock.patch(PATH.format('DATA_PATH'), str(complete)):
+        download_courses(flush_count=4, cube=True)
+        with pytest.raises(ValueError):
+            download_courses(flush_count=4, cube=True, dedup=True)
+    # Crash, resume and then refresh to the changed state
+    with mock.patch(PATH.format('DATA_PATH'), str(refreshed)):
+        mocked_cachecontrol.CacheControl.return_value = FakeStudyPortal()
+        with mock.patch(PATH.format('_fetch_page'), side_effect=[_fetch_page(FakeStudyPortal(), 1, 'bachelor', 0),
+                                                                 _fetch_page(FakeStudyPortal(), 1, 'bachelor', 1),
+                                                                 OSError]):
+            with pytest.raises(OSError):
+                download_courses(flush_count=4, cube=True)
+        download_courses(flush_count=4, resume=True, cube=True)
+        mocked_cachecontrol.CacheControl.return_value = changed_portal
+        download_courses(flush_count=4, incremental=True, cube=True)
+    cube = CourseCube.load(f'{complete}/course_cube.npz')
+    assert cube.count() == 23 + 7 + 31 + 7
+    assert cube.count(discipline=2, level='bachelor', country='Unknown') == 31
+    assert cube.count(parent=0) == cube.count()
+    refreshed_cube = CourseCube.load(f'{refreshed}/course_cube.npz')
+    assert np.array_equal(refreshed_cube.counts, cube.counts) and refreshed_cube.labels == cube.labels
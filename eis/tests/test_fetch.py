@@ -0,0 +1,96 @@
+import io
+import pytest
+import requests
+from unittest import mock
+
+# things we're testing
+from eis.data.fetch import Throttle
+from eis.data.fetch import ThrottledAdapter
+from eis.data.fetch import backoff_delay
+from eis.data.fetch import get_throttle
+from eis.data.fetch import throttled
+
+PATH = 'eis.data.fetch.{}'  # For mocking
+
+
+def test_throttle_adapts():
+    throttle = Throttle(rate=4, min_rate=1, max_rate=5, increase=0.5, target_latency=2)
+    throttle.success(latency=1)
+    assert throttle.rate == 4.5
+    throttle.success(latency=3)  # Too slow
+    assert throttle.rate == 2.25
+    throttle.backoff()
+    throttle.backoff()
+    assert throttle.rate == 1
+    for _ in range(10):
+        throttle.success()
+    assert throttle.rate == 5
+
+
+@mock.patch(PATH.format('time.sleep'))
+@mock.patch(PATH.format('time.monotonic'), return_value=100.0)
+def test_throttle_spaces_requests(_mocked_monotonic, mocked_sleep):
+    throttle = Throttle(rate=2)
+    for _ in range(3):
+        with throttle:
+            pass
+    assert [call[0][0] for call in mocked_sleep.call_args_list] == [0, 0.5, 1.0]
+    throttle.backoff(retry_after=30)
+    with throttle:
+        pass
+    assert mocked_sleep.call_args[0][0] == 30
+
+
+def test_backoff_delay():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, base=1, cap=60) <= min(60, 2**attempt)
+
+
+def response(status_code):
+    r = requests.Response()
+    r.status_code = status_code
+    r.raw = io.BytesIO(b'')
+    return r
+
+
+@mock.patch(PATH.format('time.sleep'))
+@mock.patch(PATH.format('get_throttle'), return_value=Throttle(rate=1000))
+@mock.patch(PATH.format('HTTPAdapter.send'))
+def test_throttled_adapter_retries(mocked_send, _mocked_get_throttle, _mocked_sleep):
+    request = requests.Request('GET', 'https://example.com').prepare()
+    mocked_send.side_effect = [response(503), requests.ConnectionError(), response(200)]
+    assert ThrottledAdapter().send(request).status_code == 200
+    # Non-transient failures are returned straight away
+    mocked_send.side_effect = [response(404), response(200)]
+    assert ThrottledAdapter().send(request).status_code == 404
+    # After the last retry, the last failure is returned
+    mocked_send.side_effect = [response(429)]*3
+    assert ThrottledAdapter(retries=2).send(request).status_code == 429
+    mocked_send.side_effect = [requests.ConnectionError()]*3
+    with pytest.raises(requests.ConnectionError):
+        ThrottledAdapter(retries=2).send(request)
+
+
+@mock.patch(PATH.format('time.sleep'))
+def test_throttled(_mocked_sleep):
+    calls = []
+
+    @throttled('example.com', retries=3)
+    def flaky(x):
+        calls.append(x)
+        if len(calls) < 3:
+            raise requests.HTTPError(response=response(503))
+        return x
+
+    assert flaky(1) == 1
+    assert len(calls) == 3
+
+    @throttled('example.com')
+    def broken():
+        calls.append(None)
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        broken()
+    assert len(calls) == 4  # Not retried
+    assert get_throttle('example.com') is get_throttle('example.com')
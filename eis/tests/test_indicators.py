@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from eis.data.panel_store import to_panel
+from eis.data.panel_store import write_panel
+
+# things we're testing
+from eis.transformers.indicators import filter_table
+from eis.transformers.indicators import indicator_matrices
+from eis.transformers.indicators import load_indicator_matrices
+from eis.transformers.indicators import pivot_indicator
+from eis.transformers.indicators import read_clean_names
+from eis.transformers.indicators import read_filters
+
+FILTERS = {'abc': {'sex': ['T'], 'unit': ['PC', 'NR']}}
+
+
+@pytest.fixture
+def table():
+    rng = np.random.RandomState(0)
+    index = pd.MultiIndex.from_product([['T', 'M'], ['PC', 'NR', 'XX'], ['UK', 'FR', 'EU28', 'EA19', 'DE'],
+                                        [2017, 2018, 2019]], names=['sex', 'unit', 'geo\\time', 'time'])
+    table = pd.DataFrame({'abc': rng.randint(0, 5, len(index)).astype(float)}, index=index).reset_index()
+    table.loc[3, 'abc'] = np.nan
+    return table
+
+
+def notebook_matrix(df, filter_dict, var_name):
+    """The original filter_df and pivot from the eurostat EDA notebook"""
+    df_2 = df.copy()
+    for k, v in filter_dict.items():
+        df_2 = df_2.loc[[x in v for x in df_2[k]]]
+    df = df_2.reset_index(drop=True)[['geo\\time', 'time', var_name]]
+    df_pivoted = df.pivot_table(index='geo\\time', columns='time', values=var_name, aggfunc='sum').replace(0, np.nan)
+    df_processed = df_pivoted.drop([x for x in df_pivoted.index if any(v in x for v in ['EU', 'EA'])])
+    sort_countries = df_processed.mean(axis=1).sort_values(ascending=False).index
+    return df_processed.loc[sort_countries]
+
+
+def test_filter_table(table):
+    filtered = filter_table(table, FILTERS['abc'], 'abc')
+    assert list(filtered.columns) == ['geo\\time', 'time', 'abc']
+    assert len(filtered) == 2*5*3
+
+
+def test_matches_notebook(table):
+    expected = notebook_matrix(table, FILTERS['abc'], 'abc')
+    matrix = indicator_matrices({'abc': table}, FILTERS, ['abc'])['abc']
+    assert sorted(matrix.index) == ['DE', 'FR', 'UK']
+    pd.testing.assert_frame_equal(matrix.sort_index(), expected.sort_index(), check_names=False)
+    assert matrix.mean(axis=1).is_monotonic_decreasing
+
+
+def test_load_indicator_matrices(table, tmp_path):
+    write_panel(to_panel(table, 'abc'), 'abc', str(tmp_path))
+    matrix = load_indicator_matrices(str(tmp_path), FILTERS, ['abc'])['abc']
+    expected = pivot_indicator(filter_table(table, FILTERS['abc'], 'abc'), 'abc')
+    np.testing.assert_allclose(matrix.values, expected.values)
+    assert list(matrix.index) == list(expected.index)
+
+
+def test_shipped_config():
+    assert set(read_clean_names()) <= set(read_filters())
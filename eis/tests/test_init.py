@@ -0,0 +1,25 @@
+import logging
+import subprocess
+import sys
+
+# things we're testing
+import eis
+
+
+def test_import_is_lazy():
+    # In a fresh interpreter, as the config may already have been read by other tests
+    code = """
+import logging, sys
+import eis
+assert 'yaml' not in sys.modules and 'logging.config' not in sys.modules
+assert not logging.getLogger('eis').handlers
+assert 'eurostat_inventory' in eis.config
+"""
+    subprocess.run([sys.executable, '-c', code], check=True, cwd=str(eis.project_dir))
+
+
+def test_setup_logging_without_files(monkeypatch):
+    monkeypatch.setenv('EIS_LOG_FILES', '0')
+    eis.setup_logging()
+    handlers = logging.getLogger('eis').handlers
+    assert handlers and not any(isinstance(h, logging.FileHandler) for h in handlers)
@@ -0,0 +1,49 @@
+import numpy as np
+from unittest import mock
+
+from eis.data.course_cube import CourseCube
+from eis.pipeline import sort_stages
+from eis.transformers.digital_skills import CourseTags
+
+# things we're testing
+from eis.make_dataset import STAGES
+from eis.make_dataset import OUTPUTS
+from eis.make_dataset import main
+
+
+def test_stages():
+    names = [stage.name for stage in sort_stages(STAGES)]
+    assert set(OUTPUTS) <= set(names)
+
+
+def test_course_branch(tmp_path):
+    with mock.patch('eis.make_dataset.OUTPUTS', {'discipline_counts': str(tmp_path / 'counts.csv')}):
+        outputs = main(targets=['discipline_counts'], cache_dir=str(tmp_path / 'cache'))
+    assert (tmp_path / 'counts.csv').exists()
+    assert set(outputs) == {'course_index', 'discipline_counts'}
+    counts = outputs['discipline_counts']
+    assert (counts['n_courses'] > 0).all() and counts['discipline_title'].notnull().all()
+
+
+def test_digital_skills(tmp_path):
+    with mock.patch('eis.make_dataset.OUTPUTS', {'digital_skills': str(tmp_path / 'tags.npz')}):
+        outputs = main(targets=['digital_skills'], cache_dir=str(tmp_path / 'cache'))
+    tags = outputs['digital_skills']
+    assert len(tags) > 0 and tags.is_digital().any()
+    saved = CourseTags.load(str(tmp_path / 'tags.npz'))
+    assert np.array_equal(saved.labels(), tags.labels()) and saved.categories == tags.categories
+
+
+def test_course_cube(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    with mock.patch('eis.make_dataset.OUTPUTS', {}):
+        main(targets=['digital_skills'], cache_dir=cache_dir)
+    # The cube is counted from the cached tags, without scanning the course texts again
+    with mock.patch('eis.make_dataset.OUTPUTS', {'course_cube': str(tmp_path / 'cube.npz')}), \
+            mock.patch('eis.transformers.digital_skills.KeywordMatcher.text_labels', side_effect=AssertionError):
+        outputs = main(targets=['course_cube'], cache_dir=cache_dir)
+    cube = outputs['course_cube']
+    assert cube.count() > 0 and cube.count(tag='digital') > 0
+    assert 0 < cube.rollup().count() < cube.count()  # Courses under several children count once for a parent
+    saved = CourseCube.load(str(tmp_path / 'cube.npz'))
+    assert np.array_equal(saved.counts, cube.counts) and saved.labels == cube.labels
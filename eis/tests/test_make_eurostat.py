@@ -0,0 +1,158 @@
+import pandas as pd
+import yaml
+from unittest import mock
+
+from eis.data.dic_store import DicStore
+from eis.data.toc_index import TocIndex
+
+# things we're testing
+from eis.data.make_eurostat import collect_data_for_topic
+from eis.data.make_eurostat import collect_tables
+from eis.data.make_eurostat import index_toc
+from eis.data.make_eurostat import main
+from eis.data.make_eurostat import make_schema
+from eis.data.make_eurostat import make_targets
+from eis.data.make_eurostat import read_manifest
+from eis.data.make_eurostat import sync_tables
+from eis.data.make_eurostat import topic_codes
+from eis.data.make_eurostat import transform_table
+from eis.data.make_eurostat import use_eurostat_url
+
+PATH = 'eis.data.make_eurostat.{}'  # For mocking
+
+TOC = pd.DataFrame({'title': ['Digital skills', 'Skills folder', 'Innovation', 'Broken skills'],
+                    'code': ['dig_1', 'skills', 'inn_1', 'broken'],
+                    'type': ['dataset', 'folder', 'dataset', 'dataset']})
+DIC = {'unit': {'PC': 'Percentage', 'NR': 'Number'}}
+
+
+def fake_data_df(code):
+    if code == 'broken':
+        raise ValueError('API failure')
+    return pd.DataFrame({'unit': ['PC', 'PC'], 'geo\\time': ['UK', 'FR'],
+                         2018: [1.0, 2.0], 2019: [3.0, 4.0]})
+
+
+def test_topic_codes():
+    assert topic_codes(TOC, ['skills']) == {'dig_1', 'broken'}
+    assert topic_codes(TOC, ['digital', 'innovation']) == {'dig_1', 'inn_1'}
+
+
+def test_transform_table(tmp_path):
+    with mock.patch(PATH.format('dic_store'), DicStore(DIC.get)):
+        transform_table(fake_data_df('dig_1'), 'dig_1', TOC.loc[TOC['code'] == 'dig_1'], [str(tmp_path)])
+    table = pd.read_csv(tmp_path / 'dig_1.csv')
+    assert list(table.columns) == ['unit', 'geo\\time', 'time', 'dig_1']
+    assert len(table) == 4
+    with open(tmp_path / 'dig_1.yaml') as f:
+        sch = yaml.safe_load(f)
+    assert sch['schema']['unit'] == {'PC': 'Percentage'}
+    assert sch['title'] == {0: 'Digital skills'}
+
+
+def test_make_schema():
+    table = pd.DataFrame({'unit': ['PC', 'NR', 'XX', 'PC'], 'geo\\time': ['UK', 'FR', 'UK', 'FR'],
+                          'time': [2018, 2018, 2019, 2019], 'dig_1': [1.0, 2.0, 3.0, 4.0]})
+    with mock.patch(PATH.format('dic_store'), DicStore(DIC.get)):
+        sch = make_schema(table, 'dig_1', TOC, 'geo\\time', 'time')
+        assert make_schema(table, 'dig_1', TOC, 'geo\\time', 'time', toc_index=index_toc(TOC)) == sch
+    assert sch['code'] == {0: 'dig_1'}
+    assert sch['schema']['unit'] == DIC['unit']
+    assert sorted(sch['schema']['time']) == [2018, 2019]
+    assert sorted(sch['schema']['geo']) == ['FR', 'UK']
+
+
+def test_collect_data_for_topic(tmp_path):
+    with mock.patch(PATH.format('get_data_df'), side_effect=fake_data_df), \
+            mock.patch(PATH.format('dic_store'), DicStore(DIC.get)), \
+            mock.patch(PATH.format('transform_table'), wraps=transform_table) as transform:
+        collect_data_for_topic(TOC, ['skills'], str(tmp_path))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['dig_1.csv', 'dig_1.yaml']
+    # Each table gets only its own rows of the table of contents
+    (table, code, toc_rows, paths), _ = transform.call_args
+    assert code == 'dig_1' and toc_rows['code'].tolist() == ['dig_1']
+
+
+def test_collect_tables(tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    targets = {'dig_1': [str(tmp_path / 'a'), str(tmp_path / 'b')],
+               'inn_1': [str(tmp_path / 'b')],
+               'broken': [str(tmp_path / 'a')]}
+    with mock.patch(PATH.format('get_data_df'), side_effect=fake_data_df) as get_data_df, \
+            mock.patch(PATH.format('dic_store'), DicStore(DIC.get)):
+        failed = collect_tables(TOC, targets, n_threads=2, n_processes=0, max_in_flight=2)
+    assert failed == ['broken']
+    assert get_data_df.call_count == 3  # Tables in several directories are only downloaded once
+    assert sorted(p.name for p in (tmp_path / 'a').iterdir()) == ['dig_1.csv', 'dig_1.yaml']
+    assert sorted(p.name for p in (tmp_path / 'b').iterdir()) == ['dig_1.csv', 'dig_1.yaml',
+                                                                  'inn_1.csv', 'inn_1.yaml']
+
+
+def test_collect_tables_processes(tmp_path):
+    # The workers are fresh processes, so only work if everything they need is downloaded for them
+    targets = {'dig_1': [str(tmp_path)], 'inn_1': [str(tmp_path)], 'broken': [str(tmp_path)]}
+    with mock.patch(PATH.format('get_data_df'), side_effect=fake_data_df), \
+            mock.patch(PATH.format('dic_store'), DicStore(DIC.get)) as dic_store:
+        failed = collect_tables(TOC, targets, n_threads=4, n_processes=2, max_in_flight=4)
+    assert failed == ['broken']
+    assert dic_store._dics.keys() == {'unit'}  # The dictionaries were fetched in this process
+    with open(tmp_path / 'inn_1.yaml') as f:
+        assert yaml.safe_load(f)['schema']['unit'] == {'PC': 'Percentage'}
+
+
+def test_sync_tables(tmp_path):
+    toc = TOC.assign(**{'last update of data': '01.01.2020', 'last table structure change': '01.01.2019'})
+    targets = {'dig_1': [str(tmp_path)], 'inn_1': [str(tmp_path)], 'broken': [str(tmp_path)]}
+    manifest_path = str(tmp_path / 'manifest.json')
+
+    def sync(toc):
+        with mock.patch(PATH.format('get_data_df'), side_effect=fake_data_df) as get_data_df, \
+                mock.patch(PATH.format('dic_store'), DicStore(DIC.get)):
+            changed, failed = sync_tables(toc, targets, manifest_path, n_threads=2, n_processes=0)
+        assert failed == (['broken'] if 'broken' in changed else [])
+        assert sorted(call[0][0] for call in get_data_df.call_args_list) == sorted(changed)
+        return changed
+
+    assert sync(toc) == {'dig_1', 'inn_1', 'broken'}
+    assert set(read_manifest(manifest_path)) == {'dig_1', 'inn_1'}
+    assert sync(toc) == {'broken'}  # Only the failure is retried
+    modified = (tmp_path / 'inn_1.csv').stat().st_mtime_ns
+    toc.loc[toc['code'] == 'dig_1', 'last update of data'] = '01.02.2020'
+    (tmp_path / 'dig_1.yaml').unlink()
+    assert sync(toc) == {'dig_1', 'broken'}
+    (tmp_path / 'dig_1.csv').unlink()
+    assert sync(toc) == {'dig_1', 'broken'}
+    assert (tmp_path / 'inn_1.csv').stat().st_mtime_ns == modified  # Unchanged tables are left alone
+
+
+def test_make_targets():
+    targets = make_targets(TOC, ['inn_1'], ['skills', 'innovation'], 'out', toc_index=TocIndex(TOC))
+    assert targets == {'inn_1': ['out/selected_tables', 'out/innovation'],
+                       'broken': ['out/skills'], 'dig_1': ['out/skills']}
+
+
+def test_main(tmp_path, capsys):
+    argv = ['--codes', 'inn_1', '--topics', 'digital', '--target-dir', str(tmp_path), '--processes', '0']
+    with mock.patch(PATH.format('get_toc_df'), return_value=TOC), \
+            mock.patch(PATH.format('load_toc_index'), side_effect=TocIndex), \
+            mock.patch(PATH.format('get_data_df'), side_effect=fake_data_df) as get_data_df, \
+            mock.patch(PATH.format('dic_store'), DicStore(DIC.get)), \
+            mock.patch(PATH.format('metrics.write_summary')) as write_summary:
+        main(argv + ['--dry-run'])
+        assert get_data_df.call_count == 0
+        assert capsys.readouterr().out.endswith('2 of 2 tables would be collected\n')
+        main(argv + ['--format', 'parquet'])
+        write_summary.assert_called_once_with('make_eurostat')
+    assert list(pd.read_parquet(tmp_path / 'digital' / 'dig_1.parquet').columns) == ['unit', 'geo', 'time',
+                                                                                      'value', 'flag']
+    assert (tmp_path / 'selected_tables' / 'inn_1.yaml').exists()
+
+
+def test_use_eurostat_url():
+    base_url = {'EUROSTAT': 'https://ec.europa.eu/eurostat/api/dissemination/sdmx/2.1/'}
+    with mock.patch('eurostat.eurostat.__Uri__.BASE_URL', base_url), \
+         mock.patch('eurostat.eurostat.__Uri__.BASE_ASYNC_URL', {}):
+        use_eurostat_url('http://127.0.0.1:8000')
+        use_eurostat_url('http://127.0.0.1:8000')  # Idempotent
+    assert base_url == {'EUROSTAT': 'http://127.0.0.1:8000/ec.europa.eu/eurostat/api/dissemination/sdmx/2.1/'}
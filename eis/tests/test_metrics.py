@@ -0,0 +1,72 @@
+import json
+import logging
+import pstats
+import pytest
+from unittest import mock
+
+# things we're testing
+from eis.metrics import Histogram
+from eis.metrics import Metrics
+from eis.metrics import SIZE_BUCKETS
+from eis.metrics import profilers
+
+PATH = 'eis.metrics.{}'  # For mocking
+
+
+def test_profilers():
+    assert profilers('') == set()
+    assert profilers('cpu') == {'cpu'}
+    assert profilers('1') == profilers('all') == {'cpu', 'memory'}
+    assert profilers('memory, nonsense') == {'memory'}
+
+
+def test_histogram():
+    histogram = Histogram(SIZE_BUCKETS)
+    for value in [5, 50, 500, 1000, 1000]:
+        histogram.observe(value)
+    summary = histogram.summary()
+    assert summary['count'] == 5
+    assert summary['mean'] == 511
+    assert summary['p50'] == 1000  # The upper bound of its bucket
+    assert summary['p99'] == 1000
+    assert summary['buckets'] == {'10': 1, '100': 1, '1000': 3}
+    assert Histogram().summary() == {'count': 0}
+
+
+def test_metrics(tmp_path, caplog):
+    metrics = Metrics()
+    metrics.incr('http.requests')
+    metrics.incr('http.bytes', 100)
+    metrics.observe('http.latency', 0.2)
+    metrics.gauge('courses.pages_per_second', 12.5)
+    with caplog.at_level(logging.INFO, logger='eis.metrics'):
+        with metrics.stage('crawl', profile=()) as record:
+            sum(range(1000))
+        with pytest.raises(ValueError):
+            with metrics.stage('broken', profile=()):
+                raise ValueError('oops')
+    assert record['wall_seconds'] >= 0 and record['cpu_seconds'] >= 0
+    logged = [r.metrics for r in caplog.records if hasattr(r, 'metrics')]
+    assert [r['stage'] for r in logged] == ['crawl', 'broken']
+    assert logged[1]['error'] == "ValueError('oops')"
+
+    path = metrics.write_summary('test', str(tmp_path / 'summary.json'))
+    with open(path) as f:
+        summary = json.load(f)
+    assert summary['counters'] == {'http.requests': 1, 'http.bytes': 100}
+    assert summary['histograms']['http.latency']['count'] == 1
+    assert summary['gauges'] == {'courses.pages_per_second': 12.5}
+    assert [stage['stage'] for stage in summary['stages']] == ['crawl', 'broken']
+    metrics.reset()
+    assert metrics.summary()['counters'] == {}
+
+
+def test_stage_profiles(tmp_path):
+    metrics = Metrics()
+    with mock.patch(PATH.format('PROFILE_PATH'), str(tmp_path)):
+        with metrics.stage('crawl', profile=('cpu', 'memory')) as record:
+            data = [list(range(100)) for _ in range(100)]
+    assert record['traced_peak_mb'] > 0
+    assert pstats.Stats(record['cpu_profile']).total_calls > 0
+    with open(record['memory_profile']) as f:
+        assert 'test_metrics.py' in f.read()
@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+# things we're testing
+from eis.data.panel_store import csvs_to_panels
+from eis.data.panel_store import parse_values
+from eis.data.panel_store import read_panel
+from eis.data.panel_store import read_panels
+from eis.data.panel_store import to_panel
+from eis.data.panel_store import write_panel
+
+
+def test_parse_values():
+    value, flag = parse_values(pd.Series(['12.5', '4 e', ':', ': c', '', None]))
+    assert value.dtype == np.float32
+    assert value.tolist()[:2] == [12.5, 4.0] and value[2:].isnull().all()
+    assert flag.tolist() == ['', 'e', ':', ': c', ':', ':']
+    value, flag = parse_values(pd.Series([1.5, np.nan]))
+    assert value.tolist()[0] == 1.5 and flag.tolist() == ['', ':']
+
+
+def test_to_panel():
+    table = pd.DataFrame({'unit': ['PC', 'PC'], 'geo\\time': ['UK', 'NA'], 'time': [2018, 2019],
+                          'abc': ['1 e', ':']})
+    panel = to_panel(table, 'abc')
+    assert list(panel.columns) == ['unit', 'geo', 'time', 'value', 'flag']
+    assert panel['time'].dtype == np.int16
+    assert panel['geo'].dtype.name == panel['unit'].dtype.name == 'category'
+    table = pd.DataFrame({'time\\geo': ['2018Q1', '2018Q2'], 'geo': ['UK', 'FR'], 'abc': [1.0, 2.0]})
+    assert list(to_panel(table, 'abc').columns) == ['geo', 'time', 'value', 'flag']
+
+
+def test_csvs_to_panels(tmp_path):
+    (tmp_path / 'csv').mkdir()
+    for code in ['abc', 'xyz']:
+        pd.DataFrame({'unit': ['PC', 'NR'], 'geo\\time': ['NA', 'FR'], 'time': [2018, 2019],
+                      code: ['1.5', '2 p']}).to_csv(tmp_path / 'csv' / f'{code}.csv', index=False)
+    assert csvs_to_panels(str(tmp_path / 'csv'), str(tmp_path / 'panel')) == ['abc', 'xyz']
+    panel = read_panel('abc', str(tmp_path / 'panel'))
+    assert panel['geo'].tolist() == ['NA', 'FR']  # Namibia, rather than missing
+    assert panel['value'].tolist() == [1.5, 2.0] and panel['flag'].tolist() == ['', 'p']
+    assert panel['unit'].dtype.name == 'category' and panel['time'].dtype == np.int16
+    panels = read_panels(path=str(tmp_path / 'panel'), columns=['geo', 'value', 'sex'])
+    assert list(panels) == ['abc', 'xyz']
+    assert list(panels['xyz'].columns) == ['geo', 'value']
+
+
+def test_read_panel_filters(tmp_path):
+    table = pd.DataFrame({'unit': ['PC', 'NR', 'PC'], 'geo\\time': ['UK', 'UK', 'FR'], 'time': [2018] * 3,
+                          'abc': [1.0, 2.0, 3.0]})
+    write_panel(to_panel(table, 'abc'), 'abc', str(tmp_path))
+    panel = read_panel('abc', str(tmp_path), columns=['geo', 'value'], filters={'unit': ['PC']})
+    assert panel['geo'].tolist() == ['UK', 'FR'] and panel['value'].tolist() == [1.0, 3.0]
@@ -0,0 +1,119 @@
+import threading
+import time
+import pytest
+from unittest import mock
+
+# things we're testing
+from eis.pipeline import Stage
+from eis.pipeline import module_hashes
+from eis.pipeline import run_pipeline
+from eis.pipeline import sort_stages
+
+
+def make_stages(calls, config_section='a'):
+    def source():
+        calls.append('source')
+        return 1
+
+    def double(source):
+        calls.append('double')
+        return 2*source
+
+    def parity(source):
+        calls.append('parity')
+        return source % 2
+
+    def report(double, parity):
+        calls.append('report')
+        return {'double': double, 'parity': parity}
+
+    return [Stage('report', report, inputs=['double', 'parity']),
+            Stage('source', source),
+            Stage('double', double, inputs=['source'], config=config_section),
+            Stage('parity', parity, inputs=['source'])]
+
+
+def test_sort_stages():
+    stages = make_stages([])
+    assert [s.name for s in sort_stages(stages)][0] == 'source'
+    assert [s.name for s in sort_stages(stages, ['parity'])] == ['source', 'parity']
+    with pytest.raises(ValueError):
+        sort_stages(stages + [Stage('loop', len, inputs=['loop'])])
+    with pytest.raises(ValueError):
+        sort_stages(stages + [Stage('orphan', len, inputs=['missing'])])
+
+
+def test_skips_unchanged_stages(tmp_path):
+    calls = []
+    stages = make_stages(calls)
+    with mock.patch('eis.load_config', return_value={'a': 1}):
+        assert run_pipeline(stages, cache_dir=str(tmp_path))['report'] == {'double': 2, 'parity': 1}
+        assert sorted(calls) == ['double', 'parity', 'report', 'source']
+        calls.clear()
+        assert run_pipeline(stages, cache_dir=str(tmp_path))['report'] == {'double': 2, 'parity': 1}
+        assert calls == []
+        run_pipeline(stages, cache_dir=str(tmp_path), force=['source'])
+        assert calls == ['source']  # Same output, so nothing below it runs again
+    calls.clear()
+    with mock.patch('eis.load_config', return_value={'a': 2}):
+        run_pipeline(stages, cache_dir=str(tmp_path))
+    assert calls == ['double']  # Only the stage which reads the changed config
+
+
+def test_runs_branches_in_parallel(tmp_path):
+    barrier = threading.Barrier(2, timeout=5)
+
+    def branch():
+        barrier.wait()  # Deadlocks (and times out) unless both branches run at once
+        return 0
+
+    stages = [Stage('left', branch, version='l'), Stage('right', branch, version='r')]
+    assert run_pipeline(stages, cache_dir=str(tmp_path), n_workers=2) == {'left': 0, 'right': 0}
+
+
+def test_failure(tmp_path):
+    def fail():
+        raise RuntimeError('failed')
+
+    with pytest.raises(RuntimeError):
+        run_pipeline([Stage('fail', fail), Stage('after', len, inputs=['fail'])], cache_dir=str(tmp_path))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_key_follows_imported_modules(tmp_path):
+    hashes = module_hashes('def stage():\n    from eis.data.course_cube import build_cube\n')
+    # Including the modules which that module imports
+    assert {'eis', 'eis.data.course_cube', 'eis.data.read_courses'} <= set(hashes)
+    assert 'eis.data.course_cube.build_cube' not in hashes
+
+    def stage():
+        from eis.fake import thing
+        return thing
+
+    module = tmp_path / 'fake.py'
+    module.write_text('thing = 1\n')
+    with mock.patch('eis.pipeline._module_path', lambda name: str(module) if name == 'eis.fake' else None):
+        key = Stage('stage', stage).key({})
+        assert Stage('stage', stage).key({}) == key
+        module.write_text('thing = 2\n')
+        assert Stage('stage', stage).key({}) != key
+
+
+def test_process_stages_run_alone(tmp_path):
+    active, seen = [], []
+
+    def branch():
+        active.append(1)
+        time.sleep(0.05)
+        active.pop()
+        return 0
+
+    def processes():
+        seen.append((threading.current_thread() is threading.main_thread(), len(active)))
+        return 1
+
+    stages = [Stage('left', branch, version='l'), Stage('pool', processes, processes=True),
+              Stage('right', branch, version='r'), Stage('after', lambda pool: pool, inputs=['pool'])]
+    outputs = run_pipeline(stages, cache_dir=str(tmp_path), n_workers=2)
+    assert outputs == {'left': 0, 'pool': 1, 'right': 0, 'after': 1}
+    assert seen == [(True, 0)]
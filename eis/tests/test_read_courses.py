@@ -0,0 +1,75 @@
+import json
+import zipfile
+import pytest
+from unittest import mock
+
+# things we're testing
+from eis.data.read_courses import ZIP_PATH
+from eis.data.read_courses import parse_member
+from eis.data.read_courses import iter_courses
+from eis.data.read_courses import iter_course_batches
+from eis.data.read_courses import read_archive_json
+
+
+@pytest.fixture
+def archive(tmp_path):
+    path = tmp_path / 'courses.zip'
+    with zipfile.ZipFile(path, 'w') as z:
+        for di in (1, 2):
+            for lvl, n in (('bachelor', 3), ('master', 2)):
+                courses = [{'id': 100*di + i, 'level': lvl, 'discipline_id': di} for i in range(n)]
+                z.writestr(f'courses/{di}/{lvl}/{di}-{lvl}-1000.json', json.dumps(courses))
+        z.writestr('courses/discipline_dictionary.json', json.dumps([{'discipline_id': 1}]))
+        z.writestr('courses/README.txt', 'not json')
+    return str(path)
+
+
+def test_parse_member():
+    assert parse_member('courses/38/bachelor/38-bachelor-1000.json') == (38, 'bachelor')
+    assert parse_member('38/phd/38-phd-2000.json') == (38, 'phd')
+    assert parse_member('courses/38/phd/') is None
+    assert parse_member('courses/course_discipline_lookup.json') is None
+
+
+def test_iter_courses(archive):
+    assert len(list(iter_courses(archive))) == 10
+    courses = list(iter_courses(archive, disciplines=[2], levels=['master']))
+    assert [course['id'] for course in courses] == [200, 201]
+
+
+def test_iter_courses_only_opens_matching_members(archive):
+    with mock.patch('eis.data.read_courses.zipfile.ZipFile.open', autospec=True,
+                    side_effect=zipfile.ZipFile.open) as mocked_open:
+        list(iter_courses(archive, disciplines=[1]))
+    assert sorted(call[0][1] for call in mocked_open.call_args_list) == [
+        'courses/1/bachelor/1-bachelor-1000.json', 'courses/1/master/1-master-1000.json']
+
+
+def test_iter_course_batches(archive):
+    batches = list(iter_course_batches(archive, batch_size=4))
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert list(batches[0].columns) == ['id', 'level', 'discipline_id']
+    batches = list(iter_course_batches(archive, levels=['bachelor'], output='records'))
+    assert len(batches) == 1 and len(batches[0]) == 6
+    with pytest.raises(ValueError):
+        next(iter_course_batches(archive, output='csv'))
+
+
+def test_iter_course_batches_arrow(archive):
+    pytest.importorskip('pyarrow')
+    batches = list(iter_course_batches(archive, disciplines=[2], batch_size=4, output='arrow'))
+    assert [batch.num_rows for batch in batches] == [4, 1]
+    assert batches[0].column_names == ['id', 'level', 'discipline_id']
+    assert batches[0].column('id').to_pylist() == [200, 201, 202, 200]
+
+
+def test_read_archive_json(archive):
+    assert read_archive_json('discipline_dictionary.json', archive) == [{'discipline_id': 1}]
+    with pytest.raises(KeyError):
+        read_archive_json('course_discipline_lookup.json', archive)
+
+
+def test_shipped_archive():
+    courses = list(iter_courses(ZIP_PATH, disciplines=[331], levels=['bachelor']))
+    assert courses
+    assert all(course['discipline_id'] == 331 and course['level'] == 'bachelor' for course in courses)
@@ -0,0 +1,133 @@
+import json
+import os
+import pytest
+import requests
+import time
+from unittest import mock
+
+from eis.data import download_courses
+from eis.data.cache import DiskCache
+from eis.data.course_cube import CourseCube
+
+# things we're testing
+from eis.data.fetch import Throttle
+from eis.data.fetch import ThrottledAdapter
+from eis.data.replay import FixtureArchive
+from eis.data.replay import ReplayServer
+from eis.data.replay import proxied_url
+from eis.data.replay import request_key
+from eis.metrics import metrics
+
+PATH = 'eis.data.fetch.{}'  # For mocking
+# A small crawl of studyportal: three disciplines under two parents, with five buckets of courses
+SESSION = os.path.join(os.path.dirname(__file__), 'fixtures', 'studyportal_session.zip')
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = FixtureArchive(str(tmp_path / 'fixtures.zip'))
+    archive.put('GET /search.prtl.co/2018-07-23/?q=di-24&start=0', 200,
+                {'Content-Type': 'application/json', 'Content-Length': '99'}, b'[1, 2]')
+    return archive
+
+
+def test_proxied_url():
+    assert (proxied_url('https://search.prtl.co/2018-07-23/?q=x', 'http://127.0.0.1:8000/')
+            == 'http://127.0.0.1:8000/search.prtl.co/2018-07-23/?q=x')
+    assert request_key('GET', '/a/?z=1&b=2') == 'GET /a/?b=2&z=1'
+
+
+def test_archive_round_trip(archive):
+    archive.save()
+    loaded = FixtureArchive(archive.path)
+    assert len(loaded) == 1
+    status, headers, body = loaded.get('GET /search.prtl.co/2018-07-23/?q=di-24&start=0')
+    assert (status, headers, body) == (200, {'Content-Type': 'application/json'}, b'[1, 2]')
+
+
+def test_replay(archive):
+    with ReplayServer(archive) as server:
+        url = proxied_url('https://search.prtl.co/2018-07-23/?start=0&q=di-24', server.url)
+        r = requests.get(url)
+        assert r.status_code == 200
+        assert r.json() == [1, 2]
+        assert requests.get(f'{server.url}/search.prtl.co/other').status_code == 404
+    assert server.stats['served'] == 1
+    assert server.stats['missing'] == 1
+
+
+def test_record(archive, tmp_path):
+    recorded = FixtureArchive(str(tmp_path / 'recorded.zip'))
+    with ReplayServer(archive) as upstream:
+        host = upstream.url.split('://')[1]
+        with ReplayServer(recorded, record=True, upstream_scheme='http') as server:
+            r = requests.get(f'{server.url}/{host}/search.prtl.co/2018-07-23/?q=di-24&start=0')
+            assert r.json() == [1, 2]
+    assert server.stats['recorded'] == 1
+    # The recording is saved on stopping, and can then be replayed offline
+    with ReplayServer(FixtureArchive(recorded.path)) as server:
+        r = requests.get(f'{server.url}/{host}/search.prtl.co/2018-07-23/?q=di-24&start=0')
+        assert r.json() == [1, 2]
+
+
+def test_latency(archive):
+    with ReplayServer(archive, latency=0.2) as server:
+        start = time.monotonic()
+        requests.get(f'{server.url}/search.prtl.co/2018-07-23/?q=di-24&start=0')
+        assert time.monotonic() - start >= 0.2
+
+
+def test_rate_limit(archive):
+    with ReplayServer(archive, rate=1, burst=2) as server:
+        statuses = [requests.get(f'{server.url}/search.prtl.co/2018-07-23/?q=di-24&start=0').status_code
+                    for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    assert server.stats['rate_limited'] == 1
+
+
+@mock.patch(PATH.format('get_throttle'), return_value=Throttle(rate=100, min_rate=50))
+@mock.patch(PATH.format('backoff_delay'), return_value=0)
+def test_adapter_recovers_from_injected_errors(mocked_delay, mocked_throttle, archive):
+    session = requests.Session()
+    session.mount('http://', ThrottledAdapter(retries=20))
+    with ReplayServer(archive, error_rate=0.5, seed=1) as server:
+        host = server.url.split('://')[1]
+        retries = metrics.counters[f'http.{host}.retries']
+        for _ in range(5):
+            r = session.get(f'{server.url}/search.prtl.co/2018-07-23/?q=di-24&start=0')
+            assert r.json() == [1, 2]
+    assert server.stats['errors'] > 0
+    assert server.stats['served'] == 5
+    # The retries and downloads are counted
+    assert metrics.counters[f'http.{host}.retries'] - retries == server.stats['errors']
+    assert (metrics.counters[f'http.{host}.bytes']
+            == 5*len(b'[1, 2]') + server.stats['errors']*len(b'Injected error'))
+
+
+@mock.patch(PATH.format('get_throttle'), return_value=Throttle(rate=100, min_rate=50))
+@mock.patch(PATH.format('backoff_delay'), return_value=0)
+def test_replay_download_courses(mocked_delay, mocked_throttle, tmp_path):
+    data_path = tmp_path / 'courses'
+    data_path.mkdir()
+    with ReplayServer(FixtureArchive(SESSION), error_rate=0.2, seed=1) as server, \
+            mock.patch.multiple(download_courses, DATA_PATH=str(data_path), **{
+                name: proxied_url(getattr(download_courses, name), server.url)
+                for name in ('BACHELOR_DISCIPLINES_URL', 'SEARCH_FACETS_URL', 'SEARCH_URL')}):
+        download_courses.download_courses(flush_count=5, n_workers=4, cube=True,
+                                          cache=DiskCache(str(tmp_path / 'cache.sqlite')))
+    # Every request of the crawl was recorded, and the injected errors were retried
+    assert server.stats['missing'] == 0 and server.stats['errors'] > 0
+    with open(data_path / 'discipline_dictionary.json') as f:
+        disciplines = json.load(f)
+    assert sorted((d['discipline_id'], (d['parent'] or {}).get('discipline_id')) for d in disciplines) == \
+        [(6, None), (24, None), (60, 6), (90, 24), (93, 24)]
+    with open(data_path / 'course_discipline_lookup.json') as f:
+        lookup = json.load(f)
+    assert len(lookup) == 12 + 2 + 2 + 3  # The preparation course is left out of the bachelors
+    assert lookup['2001'] == [90, 93] and lookup['3001'] == [60, 93]
+    with open(data_path / '90' / 'bachelor' / '90-bachelor-15.json') as f:
+        courses = json.load(f)
+    assert [course['id'] for course in courses] == [1010, 1011] and 'logo' not in courses[0]
+    cube = CourseCube.load(str(data_path / 'course_cube.npz'))
+    assert cube.count() == 12 + 2 + 3 + 4
+    assert cube.count(parent=24) == 12 + 2 + 2 and cube.count(parent=24, country='Italy') == 4
@@ -0,0 +1,41 @@
+import eurostat
+import pandas as pd
+import pytest
+from unittest import mock
+
+# things we're testing
+from eis.data.toc_index import TocIndex
+from eis.data.toc_index import load_toc_index
+
+TOC = pd.DataFrame({'title': ['Digital skills of individuals', 'Skills', 'Innovation in enterprises',
+                              'Digitalisation and R&D', 'Enterprises: innovation (R&D) spending', None],
+                    'code': ['dig_1', 'skills', 'inn_1', 'dig_2', 'inn_2', 'blank'],
+                    'type': ['dataset', 'folder', 'dataset', 'dataset', 'table', 'dataset'],
+                    'last update of data': ['01.01.2020'] * 6})
+
+
+def test_matches_subset_toc_df():
+    index = TocIndex(TOC, types=None)
+    for keyword in ['skills', 'DIGITAL', 'nova', 'r&d', 'ills of ind', 'enterprises:', 'xyz']:
+        expected = set(eurostat.subset_toc_df(TOC.fillna(''), keyword.replace('(', '\\('))['code'])
+        assert index.search(keyword) == expected, keyword
+
+
+def test_search():
+    index = TocIndex(TOC)
+    assert len(index) == 4 and 'skills' not in index and 'dig_1' in index
+    assert index.search('skills') == {'dig_1'}
+    assert index.search(['digital', 'innovation']) == {'dig_1', 'dig_2', 'inn_1'}
+    assert index.search(['digital', 'r&d'], match='all') == {'dig_2'}
+    assert index.search_topics({'a': ['skills'], 'b': ['enterprises']}) == {'a': {'dig_1'}, 'b': {'inn_1'}}
+    with pytest.raises(ValueError):
+        index.search('skills', match='some')
+
+
+def test_load_toc_index(tmp_path):
+    path = str(tmp_path / 'index.pkl')
+    index = load_toc_index(TOC, path)
+    with mock.patch.object(TocIndex, '__init__', side_effect=AssertionError('rebuilt')):
+        assert load_toc_index(TOC, path).search('digital') == index.search('digital')
+    changed = TOC.assign(**{'last update of data': ['02.01.2020'] * 6})
+    assert load_toc_index(changed, path).fingerprint != index.fingerprint
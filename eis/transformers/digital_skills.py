@@ -0,0 +1,278 @@
+"""Tags studyportal courses by digital skill, from a keyword taxonomy (see
+data/aux/digital_skills.yaml) matched in their titles and summaries, and from
+their disciplines.
+
+The keywords are compiled into a single regular expression, factored as a trie
+so that every keyword is found in one left to right scan of the text (as with
+an Aho-Corasick automaton, taking the longest keyword at each position). Each
+batch of courses is scanned as one string, and the matches are folded into a
+bitmask of categories per course with numpy.
+
+The full corpus is tagged straight from the zip archive of download_courses
+output, with the course files shared out between worker processes.
+"""
+from functools import lru_cache
+import html
+import json
+import re
+import zipfile
+
+import numpy as np
+import yaml
+
+import eis
+from eis.data.read_courses import ZIP_PATH, course_members
+
+TAXONOMY_PATH = f'{eis.project_dir}/data/aux/digital_skills.yaml'
+TAGS_PATH = f'{eis.project_dir}/data/processed/course_digital_skills.npz'
+TEXT_FIELDS = ('title', 'summary')
+LABEL_DTYPE = np.uint16  # One bit per category
+# Characters read as spaces (a class of single characters is far quicker to replace than runs)
+SEPARATORS = re.compile('[\t\n\r\f\v\xa0\u2000-\u200a\u202f\u3000\\-_/]')
+
+
+def read_taxonomy(path=TAXONOMY_PATH):
+    """Look-up of category --> {'keywords': [...], 'disciplines': [...]}, in order."""
+    with open(path, 'r') as f:
+        return yaml.safe_load(f)
+
+
+def normalise(text):
+    """Lower case, unescape html (e.g. &nbsp;) and replace hyphens, slashes,
+    underscores and other whitespace with spaces."""
+    return SEPARATORS.sub(' ', html.unescape(text).lower())
+
+
+def _trie_pattern(trie):
+    """Regular expression matching any of the strings in a (nested dict) trie,
+    preferring the longest"""
+    end = trie.get('', False)
+    # Keywords match across any run of spaces
+    branches = [(' +' if char == ' ' else re.escape(char)) + _trie_pattern(child)
+                for char, child in sorted(trie.items()) if char != '']
+    if not branches:
+        return ''
+    if len(branches) == 1 and not end:
+        return branches[0]
+    pattern = '(?:' + '|'.join(branches) + ')'
+    return pattern + '?' if end else pattern
+
+
+class KeywordMatcher:
+    """Finds the keywords of a taxonomy in text, in a single pass.
+
+    Args:
+        taxonomy (dict): As from read_taxonomy.
+    """
+    def __init__(self, taxonomy):
+        self.categories = list(taxonomy)
+        if len(self.categories) > 8*np.dtype(LABEL_DTYPE).itemsize:
+            raise ValueError(f'Too many categories ({len(self.categories)}) for {LABEL_DTYPE.__name__} labels')
+        self.keywords = {}  # Normalised keyword --> bitmask of its categories
+        self.disciplines = {}  # Discipline title --> bitmask of its categories
+        for i, (category, entries) in enumerate(taxonomy.items()):
+            for keyword in entries.get('keywords') or []:
+                keyword = ' '.join(normalise(str(keyword)).split())
+                self.keywords[keyword] = self.keywords.get(keyword, 0) | 1 << i
+            for title in entries.get('disciplines') or []:
+                self.disciplines[title] = self.disciplines.get(title, 0) | 1 << i
+        trie = {}
+        for keyword in self.keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[''] = True
+        # Whole words only, i.e. 'ai' but not 'rain'
+        self.pattern = re.compile(r'(?<!\w)' + _trie_pattern(trie) + r'(?!\w)')
+
+    def find(self, text):
+        """Keywords in normalised text, as (position, keyword) pairs."""
+        return [(match.start(), ' '.join(match.group().split())) for match in self.pattern.finditer(text)]
+
+    def text_labels(self, texts):
+        """Bitmask of the categories of the keywords in each text.
+
+        Args:
+            texts (list of str): Texts to tag.
+        Returns:
+            labels (array of LABEL_DTYPE)
+        """
+        labels = np.zeros(len(texts), dtype=LABEL_DTYPE)
+        if not texts:
+            return labels
+        # Normalise and scan the whole batch as one string, then assign each match to its text
+        # (normalise never makes or removes a null, so the texts can be told apart again)
+        text = normalise('\0'.join(texts))
+        starts = np.cumsum([0] + [len(part) + 1 for part in text.split('\0')[:-1]])
+        matches = self.find(text)
+        if matches:
+            positions = np.array([position for position, _ in matches])
+            masks = np.array([self.keywords[keyword] for _, keyword in matches], dtype=LABEL_DTYPE)
+            np.bitwise_or.at(labels, np.searchsorted(starts, positions, side='right') - 1, masks)
+        return labels
+
+    def discipline_labels(self, titles):
+        """Bitmask of the categories of each discipline title."""
+        return np.fromiter((self.disciplines.get(title, 0) for title in titles),
+                           dtype=LABEL_DTYPE, count=len(titles))
+
+
+def tag_courses(courses, matcher):
+    """Tag a batch of courses (one per row of download_courses output, so possibly
+    repeated for each of their disciplines).
+
+    Args:
+        courses (list of dict): Rawish course data, as written by download_courses.
+        matcher (KeywordMatcher): Compiled taxonomy.
+    Returns:
+        course_ids, text_labels, discipline_labels (arrays): For each course.
+    """
+    course_ids = np.fromiter((course['id'] for course in courses), dtype=np.int64, count=len(courses))
+    texts = [' \n '.join(course.get(field) or '' for field in TEXT_FIELDS) for course in courses]
+    titles = [course.get('discipline_title') for course in courses]
+    return course_ids, matcher.text_labels(texts), matcher.discipline_labels(titles)
+
+
+@lru_cache(maxsize=4)
+def _matcher(taxonomy_json):
+    """Matcher for a taxonomy, compiled once per (worker) process"""
+    return KeywordMatcher(json.loads(taxonomy_json))
+
+
+def _tag_members(path, names, taxonomy_json):
+    """Tag the courses in some files of the archive"""
+    with zipfile.ZipFile(path) as archive:
+        courses = []
+        for name in names:
+            with archive.open(name) as f:
+                courses.extend(json.load(f))
+    return tag_courses(courses, _matcher(taxonomy_json))
+
+
+class CourseTags:
+    """Digital skill labels for each course, as bitmasks of the categories of the
+    taxonomy (bit i for the i-th category), sorted by course id so that they can
+    be joined with the look-ups of a CourseDisciplineIndex.
+
+    Args:
+        course_ids (array of int): Unique, sorted course ids.
+        text_labels (array): Categories found in the title or summary of each course.
+        discipline_labels (array): Categories of the disciplines of each course.
+        categories (list of str): Names of the categories, in order of their bits.
+    """
+    def __init__(self, course_ids, text_labels, discipline_labels, categories):
+        self.course_ids = np.asarray(course_ids, dtype=np.int64)
+        self.text_labels = np.asarray(text_labels, dtype=LABEL_DTYPE)
+        self.discipline_labels = np.asarray(discipline_labels, dtype=LABEL_DTYPE)
+        self.categories = list(categories)
+
+    @classmethod
+    def from_rows(cls, course_ids, text_labels, discipline_labels, categories):
+        """Combine the labels of courses which appear more than once (i.e. under each
+        of their disciplines) into one row per course."""
+        course_ids, inverse = np.unique(course_ids, return_inverse=True)
+        combined = []
+        for labels in (text_labels, discipline_labels):
+            out = np.zeros(len(course_ids), dtype=LABEL_DTYPE)
+            np.bitwise_or.at(out, inverse, labels)
+            combined.append(out)
+        return cls(course_ids, *combined, categories)
+
+    def __len__(self):
+        return len(self.course_ids)
+
+    def labels(self, disciplines=True):
+        """Bitmask of categories for each course, from its text and (optionally) its disciplines.
+        Disciplines on studyportal are broad, so a course can be in a digital discipline
+        without anything digital in its title or summary."""
+        return self.text_labels | self.discipline_labels if disciplines else self.text_labels
+
+    def is_digital(self, disciplines=True):
+        """Whether each course has any digital skill."""
+        return self.labels(disciplines) != 0
+
+    def has_category(self, category, disciplines=True):
+        """Whether each course has the named category."""
+        return (self.labels(disciplines) & (1 << self.categories.index(category))) != 0
+
+    def positions(self, course_ids):
+        """Positions of course ids in the labels (-1 for courses which weren't tagged)."""
+        course_ids = np.asarray(course_ids, dtype=np.int64)
+        if not len(self.course_ids):
+            return np.full(len(course_ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.course_ids, course_ids), len(self.course_ids) - 1)
+        return np.where(self.course_ids[positions] == course_ids, positions, -1)
+
+    def discipline_shares(self, index, disciplines=True):
+        """Share of the courses in each discipline which are digital.
+
+        Args:
+            index (CourseDisciplineIndex): Look-ups between courses and disciplines.
+            disciplines (bool): Count courses which are only digital through their disciplines.
+        Returns:
+            discipline_ids, shares (array, array): For every discipline in the index.
+        """
+        positions = self.positions(index.discipline_courses)
+        digital = (positions >= 0) & self.is_digital(disciplines)[np.maximum(positions, 0)] \
+            if len(self) else np.zeros(len(positions), dtype=bool)
+        # Every discipline in the index has at least one course, so no segment is empty
+        totals = np.add.reduceat(digital.astype(np.int64), index.discipline_offsets[:-1])
+        return index.discipline_keys, totals/index.discipline_counts()
+
+    def to_frame(self, disciplines=True):
+        """DataFrame with a boolean column per category and a digital column, indexed by course id."""
+        import pandas as pd
+        labels = self.labels(disciplines)
+        frame = pd.DataFrame({category: (labels & (1 << i)) != 0 for i, category in enumerate(self.categories)},
+                             index=pd.Index(self.course_ids, name='course_id'))
+        frame['digital'] = labels != 0
+        return frame
+
+    def save(self, path=TAGS_PATH):
+        """Save the labels to a .npz file."""
+        np.savez_compressed(path, course_ids=self.course_ids, text_labels=self.text_labels,
+                            discipline_labels=self.discipline_labels,
+                            categories=np.array(self.categories))
+
+    @classmethod
+    def load(cls, path=TAGS_PATH):
+        """Load labels saved with save."""
+        with np.load(path) as arrays:
+            return cls(arrays['course_ids'], arrays['text_labels'], arrays['discipline_labels'],
+                       arrays['categories'].tolist())
+
+
+def tag_corpus(path=ZIP_PATH, taxonomy=None, n_processes=None, members_per_batch=4,
+               disciplines=None, levels=None):
+    """Tag every course in a zip archive of download_courses output. The course files
+    are shared out in batches between worker processes, which each read their files
+    straight from the archive.
+
+    Args:
+        path (str): Path to the zip archive.
+        taxonomy (dict): As from read_taxonomy (read if not given).
+        n_processes (int): Number of worker processes (defaults to the number of CPUs).
+                           With n_processes=0 the courses are tagged in this process instead.
+        members_per_batch (int): Number of course files in each batch.
+        disciplines (iterable of int): Discipline ids to keep. Defaults to all.
+        levels (iterable of str): Degree levels to keep. Defaults to all.
+    Returns:
+        tags (CourseTags)
+    """
+    if taxonomy is None:
+        taxonomy = read_taxonomy()
+    taxonomy_json = json.dumps(taxonomy)
+    categories = KeywordMatcher(taxonomy).categories
+    with zipfile.ZipFile(path) as archive:
+        names = [name for name, _, _ in course_members(archive, disciplines, levels)]
+    batches = [names[i:i + members_per_batch] for i in range(0, len(names), members_per_batch)]
+    if n_processes == 0:
+        results = [_tag_members(path, batch, taxonomy_json) for batch in batches]
+    else:
+        with eis.process_pool(n_processes) as executor:
+            results = list(executor.map(_tag_members, [path]*len(batches), batches,
+                                        [taxonomy_json]*len(batches)))
+    if not results:
+        return CourseTags([], [], [], categories)
+    course_ids, text_labels, discipline_labels = (np.concatenate(arrays) for arrays in zip(*results))
+    return CourseTags.from_rows(course_ids, text_labels, discipline_labels, categories)
@@ -0,0 +1,143 @@
+"""Country x year matrices for the EIS indicators, from eurostat tables filtered
+as set out in data/aux/eis_filters.yaml.
+
+Tables can either be melted tables as written by make_eurostat (with 'geo\\time',
+'time' and the values in a column named by the table code) or panels from
+eis.data.panel_store (with 'geo', 'time' and 'value').
+"""
+import json
+
+import numpy as np
+import pandas as pd
+import yaml
+
+import eis
+
+FILTERS_PATH = f'{eis.project_dir}/data/aux/eis_filters.yaml'
+CLEAN_NAMES_PATH = f'{eis.project_dir}/data/aux/eurostat_clean_names.json'
+AGGREGATES = ('EU', 'EA')  # Country codes containing these are aggregates, e.g. EU28 or EA19
+
+
+def read_filters(path=FILTERS_PATH):
+    """Look-up of table code --> {column: [values to keep]}."""
+    with open(path, 'r') as f:
+        return yaml.safe_load(f)
+
+
+def read_clean_names(path=CLEAN_NAMES_PATH):
+    """Look-up of table code --> readable name of the indicator, in order."""
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def table_columns(table, code):
+    """Names of the geo, time and value columns of a table.
+
+    Args:
+        table (DataFrame): Melted eurostat table or panel.
+        code (str): Code of the table.
+    Returns:
+        geo, time, value (str, str, str)
+    """
+    if 'value' in table.columns and 'geo' in table.columns:
+        return 'geo', 'time', 'value'
+    if 'time\\geo' in table.columns:
+        return 'geo', 'time\\geo', code
+    return 'geo\\time', 'time', code
+
+
+def filter_mask(table, filters):
+    """Boolean mask of the rows of table with one of the values to keep in every filtered column.
+
+    Args:
+        table (DataFrame): Table to filter.
+        filters (dict): Look-up of column --> values to keep.
+    Returns:
+        mask (numpy array of bool)
+    """
+    mask = np.ones(len(table), dtype=bool)
+    for col, values in filters.items():
+        mask &= table[col].isin(values).values
+    return mask
+
+
+def filter_table(table, filters, code=None, make_concise=True):
+    """Filter a table with the keys and values of filters.
+
+    Args:
+        table (DataFrame): Melted eurostat table or panel.
+        filters (dict): Look-up of column --> values to keep.
+        code (str): Code of the table, needed for make_concise with melted tables.
+        make_concise (bool): Only return the geo, time and value columns.
+    Returns:
+        filtered (DataFrame)
+    """
+    filtered = table.loc[filter_mask(table, filters)]
+    if make_concise:
+        filtered = filtered[list(table_columns(table, code))]
+    return filtered.reset_index(drop=True)
+
+
+def pivot_indicator(table, code=None):
+    """Country x year matrix of a (filtered) table: values are summed over any remaining
+    dimensions, zeros are treated as missing, aggregates (e.g. EU28) are dropped, and
+    countries are sorted by their mean value, largest first.
+
+    Args:
+        table (DataFrame): Filtered melted eurostat table or panel.
+        code (str): Code of the table, needed for melted tables.
+    Returns:
+        matrix (DataFrame): Countries as index, years as columns.
+    """
+    geo, time, value = table_columns(table, code)
+    values = pd.to_numeric(table[value], errors='coerce')
+    geos = table[geo].astype(str)
+    matrix = (values.groupby([geos.values, table[time].values]).sum()
+              .unstack().replace(0, np.nan))
+    matrix.index.name, matrix.columns.name = geo, time
+    matrix = matrix.loc[~matrix.index.str.contains('|'.join(AGGREGATES))]
+    order = np.argsort(-matrix.mean(axis=1).values, kind='stable')
+    return matrix.iloc[order]
+
+
+def indicator_matrices(tables, filters=None, codes=None):
+    """Country x year matrices for many indicators in one pass.
+
+    Args:
+        tables (dict): Look-up of table code --> melted eurostat table or panel.
+        filters (dict): Look-up of table code --> filters, as in eis_filters.yaml (read if not given).
+        codes (list of str): Codes of the indicators, in order. Defaults to the
+                             indicators in eurostat_clean_names.json.
+    Returns:
+        matrices (dict): Look-up of code --> matrix, as from pivot_indicator.
+    """
+    if filters is None:
+        filters = read_filters()
+    if codes is None:
+        codes = list(read_clean_names())
+    return {code: pivot_indicator(filter_table(tables[code], filters.get(code, {}), code), code)
+            for code in codes}
+
+
+def load_indicator_matrices(path=None, filters=None, codes=None):
+    """Country x year matrices for many indicators, straight from the panel store,
+    reading only the filtered rows and the columns which are needed.
+
+    Args:
+        path (str): Directory of the panel store (defaults to eis.data.panel_store.PANEL_PATH).
+        filters (dict): Look-up of table code --> filters, as in eis_filters.yaml (read if not given).
+        codes (list of str): Codes of the indicators, in order. Defaults to the
+                             indicators in eurostat_clean_names.json.
+    Returns:
+        matrices (dict): Look-up of code --> matrix, as from pivot_indicator.
+    """
+    from eis.data.panel_store import PANEL_PATH, read_panel
+    if path is None:
+        path = PANEL_PATH
+    if filters is None:
+        filters = read_filters()
+    if codes is None:
+        codes = list(read_clean_names())
+    return {code: pivot_indicator(read_panel(code, path, columns=['geo', 'time', 'value'],
+                                             filters=filters.get(code)))
+            for code in codes}
@@ -7,4 +7,7 @@ setup(
     description='Data collection and analysis for exploratory paper about Digital Skills in the European Innovation Scoreboard',
     author='Nesta',
     license='MIT',
+    entry_points={
+        'console_scripts': ['make_eurostat=eis.data.make_eurostat:main'],
+    },
 )